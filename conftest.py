@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+# 仓库根目录加入 sys.path，tests/ 下可直接 import reverie
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/13 15:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: bench_pipeline.py
+@Description: 批处理流水线端到端吞吐基准
+
+在合成图片集（数量 × 尺寸的组合）上直接驱动 main 的调度入口，由 utils_simulate.SimulatedPhotoshop 代替 Photoshop（main._backend）：
+    --mode pipeline   main.run_pipeline + 每个模拟实例一个 PhotoshopExecutor（--slots 模式）
+    --mode batch      main.run_batch（--batch_size 模式）
+分阶段耗时取自流水线自身的 span（utils_metrics.Tracer，与 --span_log / --metrics_file 是同一组数据）：
+    scan        utils_data.find_file 扫描输入目录（每个用例一次，基准自行计时）
+    built       queued -> built：读取图片尺寸、（可选）预处理、生成 jsx
+    dispatched  built -> dispatched：等待执行槽位（batch 模式为整批派发）
+    completed   dispatched -> completed：模拟的 Photoshop 耗时 + 哨兵检测延迟；--latency 0 时即完成检测本身的开销
+    moved       completed -> moved：finalize 移动输入文件
+    job         queued -> 结束的总耗时
+输出每个用例的 images/min、各阶段 p50/p99（毫秒）与峰值 RSS，写为 JSON；给出 --baseline 时逐项对比，
+吞吐下降或延迟上升超过 --tolerance 记为回退。
+
+用法：
+    python -m reverie.benchmark.bench_pipeline --counts 50 200 --sizes 640x480 2000x1500 --out bench.json
+    python -m reverie.benchmark.bench_pipeline --mode batch --batch_size 20
+    python -m reverie.benchmark.bench_pipeline --baseline bench_baseline.json --fail_on_regression
+    python -m reverie.benchmark.bench_pipeline --save_baseline bench_baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import functools
+import platform
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from reverie import main
+from reverie.utils import utils_data, utils_metrics, utils_simulate
+
+STAGES = ("scan", "built", "dispatched", "completed", "moved", "job")
+
+
+class RecordingTracer(utils_metrics.Tracer):
+    """在 Tracer 的基础上保留每个结束的 span：(状态, {阶段: 秒}, 总秒数)，用于计算分位数"""
+    def __init__(self, metrics=None):
+        super().__init__(metrics, log_spans=False)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def finish(self, span, status, error=""):
+        super().finish(span, status, error)
+        with self._lock:
+            self.spans.append((status, span.durations(), span.marks[-1][1] - span.marks[0][1]))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(np.asarray(values, dtype=np.float64), q))
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存（MB）；Windows 无 resource 模块时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def make_images(image_dir, count, width, height, seed=0):
+    """生成合成图片集，已存在时复用；返回文件列表"""
+    image_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    # 渐变 + 少量噪声，JPEG 体积接近真实照片而不是纯噪声
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1), (x + y) % 256], axis=-1)
+    paths = []
+    for i in range(count):
+        path = image_dir / f"img_{i:05d}.jpg"
+        if not path.exists():
+            noise = rng.integers(-12, 12, size=base.shape)
+            Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)).save(path, quality=90)
+        paths.append(path)
+    return paths
+
+
+def run_case(work_dir, count, width, height, mode="pipeline", build="template", latency=0.0, concurrency=4,
+             batch_size=20, wait_timeout_seconds=600):
+    """跑一个用例，返回 {"images_per_min", "stages": {stage: {p50, p99, count}}, ...}"""
+    images = make_images(work_dir / "images" / f"{width}x{height}", count, width, height)
+    case_dir = work_dir / "runs" / f"{count}_{width}x{height}"
+    shutil.rmtree(case_dir, ignore_errors=True)
+    input_dir, output_dir, finish_dir = case_dir / "input", case_dir / "output", case_dir / "finish"
+    for d in (input_dir, output_dir, finish_dir):
+        d.mkdir(parents=True)
+    for path in images:
+        shutil.copyfile(path, input_dir / path.name)
+
+    backend = main._backend = utils_simulate.SimulatedPhotoshop(latency=latency, concurrency=concurrency)
+    tracer = main._tracer = RecordingTracer()
+    timings = {stage: [] for stage in STAGES}
+    photoshop_exe = Path("Photoshop.exe")
+
+    t_start = time.perf_counter()
+    t0 = time.perf_counter()
+    files = utils_data.find_file(str(input_dir))
+    timings["scan"].append((time.perf_counter() - t0) * 1000)
+    jobs = [(input_dir / name, output_dir / name, finish_dir / name) for name in sorted(files)]
+
+    try:
+        if mode == "batch":
+            results = main.run_batch(jobs, photoshop_exe, main.template_cache.actions(""), chunk_size=batch_size,
+                                     wait_timeout_seconds=wait_timeout_seconds)
+        else:
+            if build == "inline":
+                build_jsx = functools.partial(main.get_jsx, main.build_actions_with_optional_resize_jsx(""))
+            else:
+                build_jsx = functools.partial(main.template_cache.job_jsx, "")
+            executors = [main.PhotoshopExecutor(photoshop_exe) for _ in range(concurrency)]
+            results = asyncio.run(main.run_pipeline(jobs, executors, build=build_jsx,
+                                                    wait_timeout_seconds=wait_timeout_seconds))
+        # run_batch 的移动在 finalize 线程池中异步完成，span 在移动后才结束
+        deadline = time.time() + wait_timeout_seconds
+        while len(tracer.spans) < len(jobs) and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        backend.shutdown()
+        main._backend = None
+        main._tracer = None
+    wall = time.perf_counter() - t_start
+
+    for status, durations, total in tracer.spans:
+        for stage, seconds in durations.items():
+            timings.setdefault(stage, []).append(seconds * 1000)
+        timings["job"].append(total * 1000)
+    done = sum(1 for status, *_ in tracer.spans if status == "done")
+    return {
+        "count": count,
+        "size": f"{width}x{height}",
+        "done": done,
+        "statuses": {status: sum(1 for result in results.values() if result[0] == status)
+                     for status in sorted({result[0] for result in results.values()})},
+        "wall_seconds": round(wall, 3),
+        "images_per_min": round(done / wall * 60, 1) if wall else None,
+        "stages": {stage: {"p50": percentile(values, 50), "p99": percentile(values, 99), "count": len(values)}
+                   for stage, values in timings.items()},
+        # 进程级峰值，按用例顺序单调不减；需要单独的峰值时每个用例单独运行
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """逐用例对比，返回回退列表：[(用例, 指标, 基线, 当前), ...]"""
+    regressions = []
+    for name, case in results["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        if base.get("images_per_min") and case["images_per_min"] < base["images_per_min"] * (1 - tolerance):
+            regressions.append((name, "images_per_min", base["images_per_min"], case["images_per_min"]))
+        for stage, stats in case["stages"].items():
+            base_stats = base.get("stages", {}).get(stage, {})
+            for q in ("p50", "p99"):
+                # 小于 1ms 的阶段抖动占比大，不参与比较
+                if stats[q] is not None and base_stats.get(q) and base_stats[q] >= 1.0 \
+                        and stats[q] > base_stats[q] * (1 + tolerance):
+                    regressions.append((name, f"{stage}.{q}", base_stats[q], stats[q]))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end throughput benchmark for the batch pipeline.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[50, 200], help="每个用例的图片数量")
+    parser.add_argument("--sizes", nargs="+", default=["640x480", "2000x1500"], help="图片尺寸，WxH")
+    parser.add_argument("--mode", choices=["pipeline", "batch"], default="pipeline", help="调度入口：run_pipeline 或 run_batch")
+    parser.add_argument("--build", choices=["template", "inline"], default="template", help="pipeline 的 build 阶段：编译缓存 stub 或每张完整 get_jsx")
+    parser.add_argument("--batch_size", type=int, default=20, help="batch 模式每个 Photoshop 会话的图片数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟 Photoshop 每张图的耗时（秒），0 表示只测编排开销")
+    parser.add_argument("--concurrency", type=int, default=4, help="模拟 Photoshop 实例数（pipeline 模式同时为执行槽位数）")
+    parser.add_argument("--work_dir", default=str(Path(tempfile.gettempdir()) / "reverie_bench"), help="合成图片与运行目录")
+    parser.add_argument("--out", default="", help="结果 JSON 路径")
+    parser.add_argument("--baseline", default="", help="基线 JSON，对比并打印回退项")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="回退阈值（比例）")
+    parser.add_argument("--save_baseline", default="", help="把本次结果保存为基线")
+    parser.add_argument("--fail_on_regression", action="store_true", help="有回退时以退出码 1 结束")
+    args = parser.parse_args()
+
+    work_dir = Path(args.work_dir)
+    results = {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "platform": platform.platform(),
+               "python": platform.python_version(), "cpu_count": os.cpu_count(),
+               "options": {"mode": args.mode, "build": args.build, "batch_size": args.batch_size,
+                           "latency": args.latency, "concurrency": args.concurrency},
+               "cases": {}}
+    for size in args.sizes:
+        width, height = map(int, size.lower().split("x"))
+        for count in args.counts:
+            name = f"{count}@{width}x{height}"
+            case = results["cases"][name] = run_case(work_dir, count, width, height, args.mode, args.build,
+                                                     args.latency, args.concurrency, args.batch_size)
+            stages = "  ".join(f"{stage} p50={stats['p50']:.2f} p99={stats['p99']:.2f}"
+                               for stage, stats in case["stages"].items() if stats["p50"] is not None)
+            print(f"{name}: {case['images_per_min']} images/min, {case['done']}/{count} done, "
+                  f"peak RSS {case['peak_rss_mb']} MB | {stages}")
+    if main._finalizer is not None:
+        main._finalizer.shutdown(wait=True)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.out:
+        Path(args.out).write_text(text, encoding="utf-8")
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(text, encoding="utf-8")
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for name, metric, base, current in regressions:
+            print(f"REGRESSION {name} {metric}: {base:.2f} -> {current:.2f}")
+        if not regressions:
+            print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
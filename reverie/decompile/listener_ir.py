@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/4 14:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: listener_ir.py
+@Description: ScriptListener 块的结构化中间表示（IR）与优化
+
+parse_block 把一个块解析为 Action 列表：
+    TypeID    charIDToTypeID("Opn ") / stringIDToTypeID("select")，块内的 id 变量在解析时直接展开
+    Obj       new ActionDescriptor / ActionReference / ActionList 及其后的 putXxx 调用，参数中的对象按引用保存
+    Action    executeAction(event, descriptor, mode)
+    RawBlock  含无法识别语句（或引用块外变量）的块，原样保留，同时作为优化的屏障
+optimize 线性扫描一遍：
+1.删除空操作：通知类事件（historyStateChanged 等）、选择当前目标（Ordn/Trgt）、被紧随其后的绝对选择覆盖的选择（含历史记录）；
+  makeVisible 为 true 的选择会显示图层，一律保留
+2.合并连续重复：幂等事件（set / select / show / hide）连续出现且完全相同时只保留一次
+emit 重新生成 JSX：出现 min_uses 次及以上的 charIDToTypeID / stringIDToTypeID 提升为脚本顶部的缓存变量，
+没有被 executeAction 用到的对象直接丢弃，对象变量按动作重新编号（desc1 / ref1 / list1）。
+"""
+import re
+from collections import Counter
+
+# 常见 charID 与 stringID 的对应；ScriptListener 两种写法都会产生，识别事件/类别时统一成 stringID
+CHAR_TO_STRING = {
+    "slct": "select", "setd": "set", "Shw ": "show", "Hd  ": "hide", "null": "null",
+    "HstS": "historyState", "SnpS": "snapshotClass", "Lyr ": "layer", "Dcmn": "document", "Chnl": "channel",
+    "Ordn": "ordinal", "Trgt": "targetEnum", "MkVs": "makeVisible",
+}
+
+# 不改变文档的通知/界面事件
+NOOP_EVENTS = {"historyStateChanged", "toolModalStateChanged", "modalStateChanged", "hostFocusChanged"}
+
+# 连续执行两次与一次等价的事件
+IDEMPOTENT_EVENTS = {"set", "select", "show", "hide"}
+
+# 按名称/序号/ID 选择，不依赖当前选择；putOffset、Ordn 的前后移动等相对选择不能被后一次选择覆盖
+ABSOLUTE_REFERENCES = {"putName", "putIndex", "putIdentifier"}
+
+OBJECT_PREFIX = {"ActionDescriptor": "desc", "ActionReference": "ref", "ActionList": "list"}
+
+# 字面量允许的裸标识符；其余裸标识符说明引用了块外变量，无法安全重命名
+LITERAL_NAMES = {"true", "false", "undefined", "null"}
+
+_ID_CALL = re.compile(r'^(charIDToTypeID|stringIDToTypeID)\(\s*"((?:[^"\\]|\\.)*)"\s*\)$')
+_VAR = re.compile(r'^var\s+([A-Za-z_$][\w$]*)\s*=\s*(.+)$', re.S)
+_NEW_OBJ = re.compile(r'^new\s+(ActionDescriptor|ActionReference|ActionList)\(\s*\)$')
+_CALL = re.compile(r'^([A-Za-z_$][\w$]*)\.(put\w+)\((.*)\)$', re.S)
+_EXEC = re.compile(r'^executeAction\((.*)\)$', re.S)
+_IDENTIFIER = re.compile(r'^[A-Za-z_$][\w$]*$')
+
+
+class TypeID:
+    __slots__ = ("func", "key")
+
+    def __init__(self, func, key):
+        self.func = func
+        self.key = key
+
+    @property
+    def name(self):
+        return self.key if self.func == "stringIDToTypeID" else CHAR_TO_STRING.get(self.key, self.key)
+
+    def call(self):
+        return f'{self.func}( "{self.key}" )'
+
+    def __eq__(self, other):
+        return isinstance(other, TypeID) and (self.func, self.key) == (other.func, other.key)
+
+    def __hash__(self):
+        return hash((self.func, self.key))
+
+
+class Literal:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Obj:
+    __slots__ = ("cls", "calls")
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.calls = []  # [(method, [TypeID | Literal | Obj, ...]), ...]
+
+    def keys(self):
+        return {args[0].name for _, args in self.calls if args and isinstance(args[0], TypeID)}
+
+
+class Action:
+    __slots__ = ("event", "desc", "mode")
+
+    def __init__(self, event, desc, mode):
+        self.event = event
+        self.desc = desc
+        self.mode = mode
+
+    @property
+    def name(self):
+        return self.event.name if isinstance(self.event, TypeID) else None
+
+    def type_ids(self):
+        """按出现顺序遍历事件与描述符树中的全部 TypeID（含重复）"""
+        def walk(arg):
+            if isinstance(arg, TypeID):
+                yield arg
+            elif isinstance(arg, Obj):
+                for _, args in arg.calls:
+                    for child in args:
+                        yield from walk(child)
+        yield from walk(self.event)
+        yield from walk(self.desc)
+
+    def target(self):
+        """select 等事件的 null 引用（ActionReference），没有时返回 None"""
+        if not isinstance(self.desc, Obj):
+            return None
+        for method, args in self.desc.calls:
+            if method == "putReference" and len(args) == 2 and isinstance(args[0], TypeID) \
+                    and args[0].name == "null" and isinstance(args[1], Obj):
+                return args[1]
+        return None
+
+
+class RawBlock:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class _Opaque(Exception):
+    """块中有无法识别的语句"""
+
+
+def split_top_level(text, separator):
+    """按不在字符串、括号内的 separator 切分，跳过 // 与 /* */ 注释"""
+    parts, current, depth, quote, i = [], [], 0, None, 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            current.append(ch)
+            if ch == "\\" and i + 1 < len(text):
+                current.append(text[i + 1])
+                i += 1
+            elif ch == quote:
+                quote = None
+        elif text.startswith("//", i):
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end < 0 else end + 2
+            continue
+        elif ch in "\"'":
+            quote = ch
+            current.append(ch)
+        elif ch in "([{":
+            depth += 1
+            current.append(ch)
+        elif ch in ")]}":
+            depth -= 1
+            current.append(ch)
+        elif ch == separator and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    tail = "".join(current).strip()
+    if tail:
+        parts.append(tail)
+    return [part for part in parts if part]
+
+
+def _arg(text, ids, objs, rewrite):
+    text = text.strip()
+    if text in ids:
+        return ids[text]
+    if text in objs:
+        return objs[text]
+    m = _ID_CALL.match(text)
+    if m:
+        return TypeID(*m.groups())
+    if _IDENTIFIER.match(text) and text not in LITERAL_NAMES:
+        raise _Opaque(text)
+    return Literal(rewrite(text) if rewrite else text)
+
+
+def _parse(text, rewrite):
+    ids, objs, actions = {}, {}, []
+    for stmt in split_top_level(text, ";"):
+        m = _VAR.match(stmt)
+        if m:
+            name, expr = m.group(1), m.group(2).strip()
+            id_match, obj_match = _ID_CALL.match(expr), _NEW_OBJ.match(expr)
+            if id_match:
+                ids[name] = TypeID(*id_match.groups())
+            elif obj_match:
+                # 同名变量重新 new 时是新对象，之前 put 进去的引用仍指向旧对象
+                objs[name] = Obj(obj_match.group(1))
+            else:
+                raise _Opaque(stmt)
+            continue
+        m = _CALL.match(stmt)
+        if m and m.group(1) in objs:
+            args = [_arg(arg, ids, objs, rewrite) for arg in split_top_level(m.group(3), ",")]
+            objs[m.group(1)].calls.append((m.group(2), args))
+            continue
+        m = _EXEC.match(stmt)
+        if m:
+            args = split_top_level(m.group(1), ",")
+            if len(args) != 3:
+                raise _Opaque(stmt)
+            actions.append(Action(_arg(args[0], ids, objs, rewrite), _arg(args[1], ids, objs, rewrite),
+                                  args[2].strip()))
+            continue
+        raise _Opaque(stmt)
+    return actions
+
+
+def parse_block(text, rewrite=None):
+    """
+    解析一个块，返回 [Action, ...]；块中有无法识别的语句时返回 [RawBlock]，改写后为空的块返回 []。
+    rewrite 为可选的 str -> str 函数，作用于字面量参数（如路径占位替换）与 RawBlock 的文本。
+    """
+    try:
+        return _parse(text, rewrite)
+    except _Opaque:
+        text = rewrite(text) if rewrite else text
+        return [RawBlock(text)] if text.strip() else []
+
+
+def emit_action(action, names=None):
+    """生成单个动作的 JSX；names 为 {TypeID: 已提升的变量名}"""
+    names = names or {}
+    lines, counters, defined = [], {}, {}
+
+    def render(arg):
+        if isinstance(arg, TypeID):
+            return names.get(arg) or arg.call()
+        if isinstance(arg, Obj):
+            return define(arg)
+        return arg.text
+
+    def define(obj):
+        if id(obj) in defined:
+            return defined[id(obj)]
+        prefix = OBJECT_PREFIX[obj.cls]
+        counters[prefix] = counters.get(prefix, 0) + 1
+        var = defined[id(obj)] = f"{prefix}{counters[prefix]}"
+        lines.append(f"var {var} = new {obj.cls}();")
+        for method, args in obj.calls:
+            # 子对象在父对象 put 之前定义
+            rendered = [render(arg) for arg in args]
+            lines.append(f"{var}.{method}( {', '.join(rendered)} );")
+        return var
+
+    event, desc = render(action.event), render(action.desc)
+    lines.append(f"executeAction( {event}, {desc}, {action.mode} );")
+    return "\n".join(lines)
+
+
+def _makes_visible(action):
+    """select 的 makeVisible 不是字面量 false 时会显示目标图层，有副作用，不能当作空操作删除"""
+    for method, args in action.desc.calls if isinstance(action.desc, Obj) else ():
+        if method == "putBoolean" and len(args) == 2 and isinstance(args[0], TypeID) and args[0].name == "makeVisible":
+            return not (isinstance(args[1], Literal) and args[1].text == "false")
+    return False
+
+
+def _is_noop(action):
+    if action.name in NOOP_EVENTS:
+        return "noop_event"
+    target = action.target()
+    if action.name == "select" and target is not None and len(target.calls) == 1:
+        method, args = target.calls[0]
+        # 选择当前目标（如 layer/ordinal/targetEnum），不改变任何状态
+        if method == "putEnumerated" and len(args) == 3 and isinstance(args[2], TypeID) \
+                and args[2].name == "targetEnum" and action.desc.keys() <= {"null", "makeVisible"} \
+                and not _makes_visible(action):
+            return "select_target"
+    return None
+
+
+def _overrides(later, earlier):
+    """later 是否完全覆盖 earlier：同类对象的两次选择，后一次为绝对选择且不是加选/减选，earlier 不带 makeVisible"""
+    if earlier.name != "select" or later.name != "select" or _makes_visible(earlier):
+        return False
+    earlier_target, later_target = earlier.target(), later.target()
+    if earlier_target is None or later_target is None or not earlier_target.calls or not later_target.calls:
+        return False
+    (earlier_method, earlier_args), (later_method, later_args) = earlier_target.calls[0], later_target.calls[0]
+    return (later_method in ABSOLUTE_REFERENCES and len(later_target.calls) == 1
+            and "selectionModifier" not in later.desc.keys()
+            and earlier_args[:1] == later_args[:1] and isinstance(later_args[0], TypeID))
+
+
+def optimize(items):
+    """返回 (优化后的列表, 统计)；RawBlock 两侧的动作不会被合并或互相覆盖"""
+    out = []
+    stats = Counter(actions_in=sum(isinstance(item, Action) for item in items))
+    for item in items:
+        if isinstance(item, Action):
+            reason = _is_noop(item)
+            if reason:
+                stats[reason] += 1
+                continue
+            previous = out[-1] if out and isinstance(out[-1], Action) else None
+            if previous is not None and item.name in IDEMPOTENT_EVENTS and emit_action(item) == emit_action(previous):
+                stats["merged_duplicate"] += 1
+                continue
+            while out and isinstance(out[-1], Action) and _overrides(item, out[-1]):
+                out.pop()
+                stats["select_overridden"] += 1
+        out.append(item)
+    stats["actions_out"] = sum(isinstance(item, Action) for item in out)
+    return out, dict(stats)
+
+
+def _variable_name(type_id, used):
+    prefix = "cid_" if type_id.func == "charIDToTypeID" else "sid_"
+    base = prefix + re.sub(r"\W", "_", type_id.key)
+    name, n = base, 1
+    while name in used:
+        n += 1
+        name = f"{base}_{n}"
+    used.add(name)
+    return name
+
+
+def emit(items, hoist=True, min_uses=2):
+    """
+    返回 (header, [每个动作/原始块的 JSX, ...])。
+    hoist=True 时 header 为提升后的 id 缓存变量声明，按首次出现顺序排列。
+    """
+    counts = Counter(type_id for item in items if isinstance(item, Action) for type_id in item.type_ids())
+    names, used = {}, set()
+    if hoist:
+        for type_id, count in counts.items():
+            if count >= min_uses:
+                names[type_id] = _variable_name(type_id, used)
+    header = "\n".join(f"var {name} = {type_id.call()};" for type_id, name in names.items())
+    blocks = [emit_action(item, names) if isinstance(item, Action) else item.text for item in items]
+    return header, blocks
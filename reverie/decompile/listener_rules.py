@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/2 10:20
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: listener_rules.py
+@Description: ScriptListener 块过滤/改写规则引擎
+
+把所有规则编译成两条正则，每个块最多扫描两遍：
+1.skip：所有黑名单关键字合并为一个带命名分组的交替式，命中即跳过整块，lastgroup 即命中的规则
+2.rewrite：所有删除/改写规则（executeAction 删除、路径占位替换、引号整理等）合并为一个交替式，一次 sub 完成，
+  回调按 lastgroup 分派到对应规则的替换串
+每条改写规则可声明 contains 字面量作为预筛：块中不含任何预筛字面量时整遍 sub 直接跳过。
+
+规则可从 JSON 文件加载：
+{
+  "skip":    [{"name": "hostFocusChanged", "pattern": "hostFocusChanged", "word": true}],
+  "rewrite": [{"name": "strip_execute_action", "pattern": "executeAction\\(...", "replace": "", "flags": "s",
+               "contains": "executeAction"}]
+}
+flags 取值为 i / m / s / x 的组合；word=true 时两侧加 \\b。
+"""
+import re
+import json
+import time
+from pathlib import Path
+
+# 合并正则中的命名分组前缀：skip 与 rewrite 各自编号，前缀不同以免映射冲突
+_SKIP_PREFIX = "s"
+_REWRITE_PREFIX = "w"
+
+
+def _scoped(pattern, flags="", word=False):
+    """带局部 flag 的非捕获分组，合并后各规则的 flag 互不影响"""
+    if word:
+        pattern = r"\b(?:" + pattern + r")\b"
+    return f"(?{flags}:{pattern})" if flags else f"(?:{pattern})"
+
+
+class Rule:
+    __slots__ = ("kind", "name", "pattern", "replace", "flags", "word", "contains", "regex", "literal")
+
+    def __init__(self, kind, name, pattern, replace="", flags="", word=False, contains=None):
+        self.kind = kind
+        self.name = name
+        self.pattern = pattern
+        self.replace = replace
+        self.flags = flags
+        self.word = word
+        self.contains = contains
+        self.regex = re.compile(_scoped(pattern, flags, word))
+        # 替换串不含反斜杠时无需展开分组引用，直接返回字面量
+        self.literal = "\\" not in replace
+
+    def expand(self, matched):
+        if self.literal:
+            return self.replace
+        m = self.regex.fullmatch(matched)
+        return m.expand(self.replace) if m else self.replace
+
+    def to_dict(self):
+        data = {"name": self.name, "pattern": self.pattern}
+        if self.kind == "rewrite":
+            data["replace"] = self.replace
+        if self.flags:
+            data["flags"] = self.flags
+        if self.word:
+            data["word"] = True
+        if self.contains:
+            data["contains"] = self.contains
+        return data
+
+
+class RuleEngine:
+    """
+    用法：
+        engine = RuleEngine.from_file("rules.json")   # 或 RuleEngine(skip_rules, rewrite_rules)
+        text, fired = engine.apply(block)              # text 为 None 表示整块被跳过，fired 为命中的规则名
+        engine.report()                                # 各规则命中次数与耗时
+    """
+    def __init__(self, skip_rules, rewrite_rules):
+        self.skip_rules = list(skip_rules)
+        self.rewrite_rules = list(rewrite_rules)
+        self._skip_regex = self._combine(self.skip_rules, _SKIP_PREFIX)
+        self._rewrite_regex = self._combine(self.rewrite_rules, _REWRITE_PREFIX)
+        self._by_group = {f"{_SKIP_PREFIX}{i}": rule for i, rule in enumerate(self.skip_rules)}
+        self._by_group.update({f"{_REWRITE_PREFIX}{i}": rule for i, rule in enumerate(self.rewrite_rules)})
+        # 所有改写规则都声明了预筛字面量时才能整体跳过
+        self._prefilter = [rule.contains for rule in self.rewrite_rules] \
+            if all(rule.contains for rule in self.rewrite_rules) else None
+        self.hits = {rule.name: 0 for rule in self.skip_rules + self.rewrite_rules}
+        self.seconds = {"skip": 0.0, "rewrite": 0.0}
+
+    @staticmethod
+    def _combine(rules, prefix):
+        if not rules:
+            return None
+        return re.compile("|".join(f"(?P<{prefix}{i}>{rule.regex.pattern})" for i, rule in enumerate(rules)))
+
+    @classmethod
+    def from_dict(cls, data):
+        skip_rules = [Rule("skip", item.get("name") or item["pattern"], item["pattern"],
+                           flags=item.get("flags", ""), word=item.get("word", False))
+                      for item in data.get("skip", [])]
+        rewrite_rules = [Rule("rewrite", item.get("name") or item["pattern"], item["pattern"], item.get("replace", ""),
+                              flags=item.get("flags", ""), word=item.get("word", False), contains=item.get("contains"))
+                         for item in data.get("rewrite", [])]
+        return cls(skip_rules, rewrite_rules)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.from_dict(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def to_dict(self):
+        return {"skip": [rule.to_dict() for rule in self.skip_rules],
+                "rewrite": [rule.to_dict() for rule in self.rewrite_rules]}
+
+    def match_skip(self, text):
+        """返回命中的跳过规则，未命中返回 None"""
+        if self._skip_regex is None:
+            return None
+        t0 = time.perf_counter()
+        m = self._skip_regex.search(text)
+        self.seconds["skip"] += time.perf_counter() - t0
+        if m is None:
+            return None
+        rule = self._by_group[m.lastgroup]
+        self.hits[rule.name] += 1
+        return rule
+
+    def rewrite(self, text, fired=None):
+        """一次 sub 应用全部改写规则；fired 为列表时追加命中的规则名（去重、按首次命中顺序）"""
+        if self._rewrite_regex is None:
+            return text
+        if self._prefilter is not None and not any(literal in text for literal in self._prefilter):
+            return text
+
+        def dispatch(m):
+            rule = self._by_group[m.lastgroup]
+            self.hits[rule.name] += 1
+            if fired is not None and rule.name not in fired:
+                fired.append(rule.name)
+            return rule.expand(m.group(m.lastgroup))
+
+        t0 = time.perf_counter()
+        text = self._rewrite_regex.sub(dispatch, text)
+        self.seconds["rewrite"] += time.perf_counter() - t0
+        return text
+
+    def apply(self, text):
+        """返回 (改写后的文本或 None, 命中的规则名列表)；None 表示整块命中跳过规则"""
+        rule = self.match_skip(text)
+        if rule is not None:
+            return None, [rule.name]
+        fired = []
+        return self.rewrite(text, fired), fired
+
+    def report(self):
+        return {"hits": dict(self.hits), "seconds": dict(self.seconds)}
+
+    def profile(self, blocks, repeat=1):
+        """
+        诊断用：逐条规则单独跑一遍给定块，返回 {rule_name: 秒}。
+        合并后的单遍扫描无法拆分每条规则的耗时，需要定位慢规则时用此方法。
+        """
+        blocks = list(blocks)
+        timings = {}
+        for rule in self.skip_rules + self.rewrite_rules:
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                for text in blocks:
+                    if rule.kind == "skip":
+                        rule.regex.search(text)
+                    else:
+                        rule.regex.sub(lambda m: rule.expand(m.group(0)), text)
+            timings[rule.name] = time.perf_counter() - t0
+        return timings
@@ -4,13 +4,29 @@
 @Author: Damian
 @Email: zengyuwei1995@163.com
 @File: scriptlistener2jsx.py
-@Description: 
+@Description: 把 ScriptingListenerJS.log 转换为可回放的 jsx
+
+流式处理：按 // ==== 分隔符逐块读取、逐块转换、逐块写出，内存占用与日志大小无关。
+--follow 模式持续跟踪 Photoshop 追加的新块，已处理到的字节偏移保存在状态文件中，重启后不会重复解析。
+过滤/改写规则由 listener_rules.RuleEngine 编译为单遍扫描，默认规则来自下方常量，也可用 --rules 从 JSON 加载；
+--report 输出逐块命中的规则与合并扫描的总耗时，--profile 逐条规则单独计时，用于定位慢规则。
+--optimize 模式把块解析为 listener_ir 的结构化表示，删除空操作、合并连续重复动作、提升重复的 TypeID 查找后重新生成 jsx，
+保留 executeAction 以便直接回放；需要看到全部动作才能提升，所以不能与 --follow 同时使用。
+--logs 模式用进程池并行转换多个日志，按内容哈希跨日志去重动作，输出共享动作库 action_library.jsx 与每个效果一个的薄脚本；
+每个日志的转换结果按 (大小, mtime, 规则) 缓存在 <out_dir>/.cache，未变化的日志不再解析，动作库内容不变时不重写文件。
 """
 #!/usr/bin/env python3
 # convert_listener_to_jsx.py
 import re
+import json
+import time
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from reverie.settings import PATH
+from reverie.decompile import listener_ir
+from reverie.decompile.listener_rules import Rule, RuleEngine
 
 # 配置：修改为你的 log 路径与输出路径
 LOG_PATH = Path(fr"{PATH}\data\decompile\ScriptingListenerJS.log")   # 改为真实路径
@@ -38,16 +54,11 @@ PATH_PATTERNS = [
     (re.compile(r'new File\("([A-Za-z]:/[^"]+)"\)'), r'new File("{TMP_JSX}")'),
 ]
 
-# 读取原始 log
-raw = LOG_PATH.read_text(encoding='utf-8', errors='ignore')
+# ScriptListener 的分隔符通常为 // =======================================================
+BLOCK_DELIMITER = re.compile(rb'//\s*={3,}\s*')
 
-# 1) 把连续的 Listener 分段提取（ScriptListener 的分隔符通常为 // =======================================================）
-blocks = re.split(r'//\s*={3,}\s*', raw)
-
-import re
-from pathlib import Path
-import argparse
-import shutil
+# 块之间的分隔注释
+BLOCK_BOUNDARY = "\n\n// ---- block boundary ----\n\n"
 
 # 正则：匹配 executeAction( <任何非贪婪内容 up to comma> , undefined , DialogModes.NO ) ; 可跨行
 PATTERN = re.compile(
@@ -55,52 +66,6 @@ PATTERN = re.compile(
     flags=re.DOTALL | re.MULTILINE
 )
 
-def process_text(text: str, comment_instead_of_remove: bool = False) -> str:
-    """
-    把匹配的 executeAction(...) 块替换为空或注释。
-    """
-    if comment_instead_of_remove:
-        def repl(m):
-            content = m.group(0)
-            # 保留原文为注释，便于调试
-            return "/* removed executeAction: " + content.replace("*/", "*\\/") + " */"
-        return PATTERN.sub(repl, text)
-    else:
-        return PATTERN.sub('', text)
-
-clean_blocks = []
-for blk in blocks:
-    b = blk.strip()
-    if not b:
-        continue
-    # 如果包含任一黑名单关键词则 skip（认为遥测/状态）
-    skip = False
-    for key in BLACKLIST_KEYS:
-        if re.search(r'\b' + key + r'\b', b):
-            skip = True
-            break
-    if skip:
-        # 记录日志信息而非包含这些块
-        clean_blocks.append("// Skipped telemetry/state block containing: {}".format(key))
-        continue
-
-    # 否则对该块进行路径占位替换与 DialogModes 强制设置
-    text = b
-
-    # 把 DialogModes.* 改为 DialogModes.NO（避免弹窗） debug
-    text = process_text(text, comment_instead_of_remove=False)#True
-    #text = re.sub(r'DialogModes\.\w+', 'DialogModes.NO', text)
-
-    # 把 executeAction(..., undefined, DialogModes.NO) 的 undefined 参数维持（无变动）
-    # 用 PATH_PATTERNS 替换 file path 为占位符 {TMP_JSX}
-    for pat, repl in PATH_PATTERNS:
-        text = pat.sub(repl, text)
-
-    # 将三引号或奇怪的字符串整理为标准 JS 字符串（ScriptListener 某些情况会有额外引号）
-    text = text.replace('"""', '"').replace("'''", "'")
-
-    clean_blocks.append(text)
-
 # 生成 wrapper（含 safeExec helper 和 INPUT/OUTPUT 占位）
 wrapper_preamble = r'''// Auto-generated JSX from ScriptingListenerJS.log
 // NOTE: This file contains extracted ActionManager blocks cleaned.
@@ -132,12 +97,381 @@ wrapper_postamble = '''
 }
 '''
 
-# 合并 clean_blocks，但建议按逻辑顺序排放：open doc -> useful blocks -> save -> close
-# 这里我们简单把所有 clean_blocks 串起来，你可以手动调整顺序
-body = "\n\n// ---- block boundary ----\n\n".join(clean_blocks)
 
-out_text = body#wrapper_preamble + body + wrapper_postamble
+def process_text(text: str, comment_instead_of_remove: bool = False) -> str:
+    """
+    把匹配的 executeAction(...) 块替换为空或注释。
+    """
+    if comment_instead_of_remove:
+        def repl(m):
+            content = m.group(0)
+            # 保留原文为注释，便于调试
+            return "/* removed executeAction: " + content.replace("*/", "*\\/") + " */"
+        return PATTERN.sub(repl, text)
+    else:
+        return PATTERN.sub('', text)
+
+
+def iter_blocks(log_path: Path, offset: int = 0, follow: bool = False, chunk_size: int = 1024 * 1024):
+    """
+    从 offset 开始流式读取日志，逐块产出 (block_text, end_offset)。
+    - 只在下一个分隔符出现后才产出前一个块，分隔符跨越读取边界时等待更多数据
+    - end_offset 为该块（含其后的分隔符）结束处的字节偏移，可保存后用于断点续读
+    - follow=False 时读到文件末尾即把剩余内容作为最后一块产出；follow=True 时未结束的尾块留到下次
+    """
+    with open(log_path, "rb") as f:
+        f.seek(offset)
+        buffer = b""
+        buffer_offset = offset
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                buffer += chunk
+            start = 0
+            for match in BLOCK_DELIMITER.finditer(buffer):
+                # 匹配到缓冲区末尾时，分隔符（及其后的空白）可能还没写完整
+                if match.end() >= len(buffer) and (chunk or follow):
+                    break
+                yield buffer[start:match.start()].decode("utf-8", errors="ignore"), buffer_offset + match.end()
+                start = match.end()
+            buffer = buffer[start:]
+            buffer_offset += start
+            if not chunk:
+                break
+        if buffer and not follow:
+            yield buffer.decode("utf-8", errors="ignore"), buffer_offset + len(buffer)
+
+
+def default_rules() -> RuleEngine:
+    """由模块常量构建默认规则：黑名单跳过、executeAction 删除、路径占位替换、引号整理"""
+    skip_rules = [Rule("skip", key, key, word=True) for key in dict.fromkeys(BLACKLIST_KEYS)]
+    rewrite_rules = [Rule("rewrite", "strip_execute_action", PATTERN.pattern, "", flags="ms", contains="executeAction")]
+    rewrite_rules += [Rule("rewrite", f"path_placeholder_{i}", pat.pattern, repl, contains="File(")
+                      for i, (pat, repl) in enumerate(PATH_PATTERNS)]
+    rewrite_rules += [Rule("rewrite", "triple_double_quote", re.escape('"""'), '"', contains='"""'),
+                      Rule("rewrite", "triple_single_quote", re.escape("'''"), "'", contains="'''")]
+    return RuleEngine(skip_rules, rewrite_rules)
 
-OUT_JSX.write_text(out_text, encoding='utf-8')
-print("Wrote cleaned jsx to:", OUT_JSX)
-print("请手动检查文件：主要确认 open/save/顺序与占位符是否正确，然后再运行。")
+
+DEFAULT_ENGINE = default_rules()
+
+
+def convert_block(blk: str, engine: RuleEngine = None, fired: list = None):
+    """
+    转换单个块：空块（含改写后为空的块）返回 None，命中跳过规则的块返回一行跳过说明，其余返回改写后的文本。
+    fired 为列表时追加命中的规则名。
+    """
+    b = blk.strip()
+    if not b:
+        return None
+    engine = engine or DEFAULT_ENGINE
+    # 如果包含任一黑名单关键词则 skip（认为遥测/状态）；其余块一次扫描完成路径占位替换与 executeAction 清理
+    text, rules = engine.apply(b)
+    if fired is not None:
+        fired.extend(rules)
+    if text is None:
+        # 记录日志信息而非包含这些块
+        return "// Skipped telemetry/state block containing: {}".format(rules[0])
+    return text if text.strip() else None
+
+
+def write_blocks(blocks, out, first=True, engine: RuleEngine = None, report=None):
+    """
+    把转换后的块逐个写入已打开的输出文件，返回 (写入块数, 最后一个 end_offset)。
+    report 为已打开的文件时，每块写一行 JSON：块结束偏移与命中的规则。
+    合并顺序即日志顺序：open doc -> useful blocks -> save -> close，如需调整请手动编辑输出。
+    """
+    count, end_offset = 0, None
+    for blk, end_offset in blocks:
+        fired = []
+        text = convert_block(blk, engine, fired)
+        if text is None:
+            continue
+        if report is not None:
+            report.write(json.dumps({"end_offset": end_offset, "rules": fired}) + "\n")
+        out.write(text if first else BLOCK_BOUNDARY + text)
+        first = False
+        count += 1
+    return count, end_offset
+
+
+def convert_log(log_path: Path, out_path: Path, engine: RuleEngine = None, report_path: Path = None):
+    """一次性流式转换整个日志，返回写入的块数"""
+    with open(out_path, "w", encoding="utf-8") as out:
+        if report_path is None:
+            count, _ = write_blocks(iter_blocks(log_path), out, engine=engine)
+        else:
+            with open(report_path, "w", encoding="utf-8") as report:
+                count, _ = write_blocks(iter_blocks(log_path), out, engine=engine, report=report)
+    return count
+
+
+def profile_rules(log_path: Path, engine: RuleEngine = None, repeat: int = 1) -> dict:
+    """逐条规则在日志的全部非空块上单独计时，返回按耗时降序的 {rule_name: 秒}"""
+    engine = engine or DEFAULT_ENGINE
+    blocks = [blk.strip() for blk, _ in iter_blocks(log_path) if blk.strip()]
+    timings = engine.profile(blocks, repeat=repeat)
+    return {name: round(seconds, 6) for name, seconds in sorted(timings.items(), key=lambda item: -item[1])}
+
+
+def optimize_log(log_path: Path, out_path: Path, engine: RuleEngine = None, hoist: bool = True) -> dict:
+    """
+    解析 -> 优化 -> 重新生成，返回统计。
+    命中跳过规则的块直接丢弃；改写规则只作用于字面量参数与无法解析的块，解析成功的 executeAction 不会被删除。
+    """
+    engine = engine or DEFAULT_ENGINE
+    items, skipped = [], 0
+    for blk, _ in iter_blocks(log_path):
+        b = blk.strip()
+        if not b:
+            continue
+        if engine.match_skip(b) is not None:
+            skipped += 1
+            continue
+        items.extend(listener_ir.parse_block(b, rewrite=engine.rewrite))
+    items, stats = listener_ir.optimize(items)
+    header, blocks = listener_ir.emit(items, hoist=hoist)
+    blocks = [block for block in blocks if block.strip()]
+    with open(out_path, "w", encoding="utf-8") as out:
+        if header:
+            out.write("// cached type ids\n" + header + BLOCK_BOUNDARY)
+        out.write(BLOCK_BOUNDARY.join(blocks))
+    stats.update(skipped_blocks=skipped, raw_blocks=sum(isinstance(item, listener_ir.RawBlock) for item in items),
+                 hoisted_ids=header.count("\n") + 1 if header else 0)
+    return stats
+
+
+# 缓存格式版本，IR/优化逻辑变化时递增，使旧缓存失效
+LIBRARY_CACHE_VERSION = 2
+LIBRARY_NAME = "action_library.jsx"
+
+# 进程池 worker 内按规则 JSON 缓存编译好的 RuleEngine
+_worker_engines = {}
+
+
+def log_actions(log_path: str, rules_json: str) -> list:
+    """进程池 worker：转换单个日志，返回优化后（未提升 id）的动作文本列表"""
+    engine = _worker_engines.get(rules_json)
+    if engine is None:
+        engine = _worker_engines[rules_json] = RuleEngine.from_dict(json.loads(rules_json))
+    items = []
+    for blk, _ in iter_blocks(Path(log_path)):
+        b = blk.strip()
+        if b and engine.match_skip(b) is None:
+            items.extend(listener_ir.parse_block(b, rewrite=engine.rewrite))
+    items, _ = listener_ir.optimize(items)
+    _, blocks = listener_ir.emit(items, hoist=False)
+    return [block for block in blocks if block.strip()]
+
+
+def action_function_name(text: str) -> str:
+    return "act_" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """内容相同时不写，保留 mtime，下游按 mtime/大小判断的缓存（如 main.template_cache）继续有效"""
+    if path.exists() and path.read_text(encoding="utf-8") == text:
+        return False
+    tmp_path = path.with_name(path.name + ".part")
+    tmp_path.write_text(text, encoding="utf-8")
+    tmp_path.replace(path)
+    return True
+
+
+def build_library(log_paths, out_dir: Path, engine: RuleEngine = None, workers: int = None, hoist: bool = True) -> dict:
+    """
+    并行转换多个日志并输出：
+    out_dir/action_library.jsx    所有日志去重后的动作函数 act_<sha1>()，重复的 TypeID 查找提升到库顶部
+    out_dir/<日志名>.jsx           薄脚本：$.evalFile 动作库后按顺序调用动作函数，可直接作为 main.py 的 --jsx_path
+    返回统计。
+    """
+    t0 = time.perf_counter()
+    engine = engine or DEFAULT_ENGINE
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cache_dir = out_dir / ".cache"
+    cache_dir.mkdir(exist_ok=True)
+    rules_json = json.dumps(engine.to_dict(), sort_keys=True, ensure_ascii=False)
+    rules_hash = hashlib.sha1(rules_json.encode("utf-8")).hexdigest()
+
+    log_paths = sorted(dict.fromkeys(Path(p).resolve() for p in log_paths))
+    per_log, pending = {}, {}
+    for log_path in log_paths:
+        stat = log_path.stat()
+        signature = [LIBRARY_CACHE_VERSION, stat.st_size, stat.st_mtime_ns, rules_hash]
+        cache_path = cache_dir / (hashlib.sha1(str(log_path).encode("utf-8")).hexdigest() + ".json")
+        try:
+            cached = json.loads(cache_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            cached = None
+        if cached is not None and cached.get("signature") == signature:
+            per_log[log_path] = cached["actions"]
+        else:
+            pending[log_path] = (signature, cache_path)
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {log_path: pool.submit(log_actions, str(log_path), rules_json) for log_path in pending}
+            for log_path, future in futures.items():
+                per_log[log_path] = future.result()
+                signature, cache_path = pending[log_path]
+                cache_path.write_text(json.dumps({"log": str(log_path), "signature": signature,
+                                                  "actions": per_log[log_path]}, ensure_ascii=False), encoding="utf-8")
+
+    # 按日志顺序、首次出现顺序去重，函数顺序稳定，库内容不变时文件也不变
+    unique = {}
+    for log_path in log_paths:
+        for text in per_log[log_path]:
+            unique.setdefault(action_function_name(text), text)
+    # 动作文本是 emit 的输出，可以重新解析，在整个库范围内统计并提升 TypeID；
+    # 不能解析为单个动作的文本（原始块）整体作为 RawBlock 保留，不按第一个动作截断
+    items = []
+    for text in unique.values():
+        parsed = listener_ir.parse_block(text)
+        items.append(parsed[0] if len(parsed) == 1 else listener_ir.RawBlock(text))
+    header, blocks = listener_ir.emit(items, hoist=hoist)
+    library = [f"// Auto-generated action library: {len(unique)} actions from {len(log_paths)} logs"]
+    if header:
+        library.append(header)
+    for name, block in zip(unique, blocks):
+        body = "\n".join("    " + line if line else line for line in block.splitlines())
+        library.append(f"function {name}() {{\n{body}\n}}")
+    library_path = out_dir / LIBRARY_NAME
+    library_changed = write_if_changed(library_path, "\n\n".join(library) + "\n")
+
+    library_js = library_path.resolve().as_posix()
+    for log_path in log_paths:
+        calls = "\n".join(f"{action_function_name(text)}();" for text in per_log[log_path])
+        write_if_changed(out_dir / (log_path.stem + ".jsx"),
+                         f"// effect: {log_path.name}\n$.evalFile(new File(\"{library_js}\"));\n{calls}\n")
+
+    total = sum(len(actions) for actions in per_log.values())
+    return {"logs": len(log_paths), "converted": len(pending), "cached": len(log_paths) - len(pending),
+            "actions": total, "unique_actions": len(unique), "library_changed": library_changed,
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def collect_logs(paths) -> list:
+    """展开命令行给出的日志路径：文件直接使用，目录取其下所有 *.log"""
+    logs = []
+    for p in map(Path, paths):
+        logs.extend(sorted(p.glob("*.log")) if p.is_dir() else [p])
+    return logs
+
+
+def load_offset(state_path: Path, log_path: Path) -> int:
+    """读取续读偏移；日志被截断或换成新文件（大小小于偏移）时从头开始"""
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return 0
+    offset = int(state.get("offset", 0))
+    return offset if offset <= log_path.stat().st_size else 0
+
+
+def save_offset(state_path: Path, log_path: Path, offset: int):
+    tmp_path = state_path.with_name(state_path.name + ".part")
+    tmp_path.write_text(json.dumps({"log": str(log_path), "offset": offset}), encoding="utf-8")
+    tmp_path.replace(state_path)
+
+
+def restart_output(out_path: Path, state_path: Path, log_path: Path):
+    """从偏移 0 重新开始前：已有输出轮换为 <out>.<时间戳><后缀> 保留，状态文件的偏移归零"""
+    if out_path.exists() and out_path.stat().st_size:
+        rotated = out_path.with_name(f"{out_path.stem}.{time.strftime('%Y%m%d_%H%M%S')}{out_path.suffix}")
+        out_path.replace(rotated)
+        print(f"Rotated {out_path} -> {rotated}")
+    else:
+        out_path.unlink(missing_ok=True)
+    save_offset(state_path, log_path, 0)
+
+
+def follow_log(log_path: Path, out_path: Path, state_path: Path = None, poll_interval: float = 1.0,
+               engine: RuleEngine = None):
+    """
+    tail 模式：持续把 Photoshop 新追加的完整块转换并追加到 out_path。
+    偏移保存在 state_path（默认 out_path + ".offset"），重启后从上次位置继续；
+    从头开始（无状态、日志被截断或轮换）时旧输出先轮换保留，再写新输出。
+    """
+    state_path = state_path or out_path.with_name(out_path.name + ".offset")
+    offset = load_offset(state_path, log_path)
+    if offset == 0:
+        # 从头开始时重建输出，避免与旧内容重复
+        restart_output(out_path, state_path, log_path)
+    print(f"Following {log_path} from offset {offset} -> {out_path}")
+    while True:
+        offset = poll_log(log_path, out_path, state_path, offset, engine)
+        time.sleep(poll_interval)
+
+
+def poll_log(log_path: Path, out_path: Path, state_path: Path, offset: int, engine: RuleEngine = None) -> int:
+    """follow_log 的一次检查：转换并追加 offset 之后的完整块，返回新的偏移"""
+    if not log_path.exists():
+        return offset
+    size = log_path.stat().st_size
+    if size < offset:
+        # 日志被清空/轮换：输出与状态随偏移一起重置，否则新日志中的块会接在旧输出之后
+        print(f"{log_path} was truncated, restarting from offset 0")
+        offset = 0
+        restart_output(out_path, state_path, log_path)
+    if size > offset:
+        with open(out_path, "a", encoding="utf-8") as out:
+            count, end_offset = write_blocks(iter_blocks(log_path, offset, follow=True), out,
+                                             first=out.tell() == 0, engine=engine)
+        if end_offset is not None:
+            offset = end_offset
+            save_offset(state_path, log_path, offset)
+        if count:
+            print(f"Appended {count} blocks, offset {offset}")
+    return offset
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert ScriptingListenerJS.log to a cleaned jsx.")
+    parser.add_argument("--log", default=str(LOG_PATH), help="ScriptingListenerJS.log 路径")
+    parser.add_argument("--out", default=str(OUT_JSX), help="输出 jsx 路径")
+    parser.add_argument("--follow", action="store_true", help="tail 模式：持续转换 Photoshop 新追加的块")
+    parser.add_argument("--state", default="", help="tail 模式的偏移状态文件，默认 <out>.offset")
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="tail 模式的检查间隔（秒）")
+    parser.add_argument("--rules", default="", help="规则 JSON 文件，默认使用内置规则")
+    parser.add_argument("--dump_rules", default="", help="把当前规则写出为 JSON 后退出，可作为自定义规则的起点")
+    parser.add_argument("--optimize", action="store_true", help="解析为结构化表示并优化后生成可直接回放的 jsx")
+    parser.add_argument("--no_hoist", action="store_true", help="--optimize 时不把重复的 TypeID 查找提升为缓存变量")
+    parser.add_argument("--logs", nargs="+", default=[], help="多个日志文件或目录（取 *.log），并行转换为共享动作库与效果脚本")
+    parser.add_argument("--out_dir", default="", help="--logs 模式的输出目录，默认 <第一个日志所在目录>/jsx")
+    parser.add_argument("--workers", type=int, default=None, help="--logs 模式的进程数，默认 CPU 核数")
+    parser.add_argument("--report", default="", help="逐块命中规则报告（JSON Lines），并打印各规则命中次数与耗时")
+    parser.add_argument("--profile", type=int, default=0, metavar="REPEAT",
+                        help="逐条规则在 --log 上单独跑 REPEAT 遍并打印各自耗时后退出，用于定位慢规则")
+    args = parser.parse_args()
+
+    if (args.optimize or args.logs) and args.follow:
+        parser.error("--optimize / --logs 需要完整日志，不能与 --follow 同时使用")
+
+    engine = RuleEngine.from_file(args.rules) if args.rules else DEFAULT_ENGINE
+    if args.dump_rules:
+        Path(args.dump_rules).write_text(json.dumps(engine.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
+        print("Wrote rules to:", args.dump_rules)
+    elif args.profile:
+        print(json.dumps(profile_rules(Path(args.log), engine, args.profile), ensure_ascii=False, indent=2))
+    elif args.follow:
+        try:
+            follow_log(Path(args.log), Path(args.out), Path(args.state) if args.state else None, args.poll_interval, engine)
+        except KeyboardInterrupt:
+            print("Stopped following.")
+    elif args.logs:
+        logs = collect_logs(args.logs)
+        if not logs:
+            parser.error("--logs 中没有找到日志文件")
+        out_dir = Path(args.out_dir) if args.out_dir else logs[0].parent / "jsx"
+        stats = build_library(logs, out_dir, engine, workers=args.workers, hoist=not args.no_hoist)
+        print("Wrote action library and effect scripts to:", out_dir)
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    elif args.optimize:
+        stats = optimize_log(Path(args.log), Path(args.out), engine, hoist=not args.no_hoist)
+        print("Wrote optimized jsx to:", args.out)
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    else:
+        count = convert_log(Path(args.log), Path(args.out), engine, Path(args.report) if args.report else None)
+        print("Wrote cleaned jsx to:", args.out, f"({count} blocks)")
+        if args.report:
+            print(json.dumps(engine.report(), ensure_ascii=False, indent=2))
+        print("请手动检查文件：主要确认 open/save/顺序与占位符是否正确，然后再运行。")
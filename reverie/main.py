@@ -9,13 +9,21 @@
 import os
 import sys
 import time
+import json
+import hashlib
+import random
+import shutil
+import asyncio
+import threading
+import functools
 import argparse
 import tempfile
 import subprocess
 from pathlib import Path
+from collections import namedtuple
 
 from reverie.settings import PATH
-from reverie.utils import utils_data, utils_log, utils_database
+from reverie.utils import utils_data, utils_log, utils_database, utils_spool, utils_watch, utils_ledger, utils_cache, utils_metrics
 
 log_filename = os.path.splitext(os.path.basename(__file__))[0]
 logger = utils_log.logger_config_local(f'{PATH}/log/{log_filename}.log')
@@ -23,24 +31,172 @@ logger = utils_log.logger_config_local(f'{PATH}/log/{log_filename}.log')
 # Photoshop 可执行路径（如需可用 --photoshop 覆盖）
 PS_PATH = r"D:\03_software\adobe\photoshop\Adobe Photoshop 2023\Photoshop.exe"
 
-# 主模板：在这里用特殊标记 __ACTIONS__ / {input} / {output}，后面用 str.replace 注入内容，避免与 JS 大量花括号发生冲突。
+# 进程内共享的完成检测器与 finalize 线程池，见 get_completion_watcher / get_finalizer
+_completion_watcher = None
+_finalizer = None
+# 可选的 Python 端预处理（utils_image.PreStage），启用时交给 Photoshop 的是预处理后的文件，见 photoshop_input
+_prestage = None
+
+# 输出规格：suffix 为附加输出的文件名后缀，fmt 为格式（jpg/png/tif/psd），quality 为 JPEG 质量（0-12），max_side 为最长边上限（0 不限制）
+# 第一项写入 OUTPUT_PATH 本身（格式由其扩展名决定），其余项写入 <OUTPUT_PATH 去掉扩展名><suffix>.<fmt>
+OutputSpec = namedtuple("OutputSpec", ["suffix", "fmt", "quality", "max_side"])
+# 为 None 时使用 default_save_close_action，只保存一个输出；由 --outputs 设置，见 output_paths
+_output_specs = None
+# 执行 jsx 的后端，为 None 时启动 Photoshop；--simulate 时为 utils_simulate.SimulatedPhotoshop，见 run_jsx
+_backend = None
+# 分阶段计时（utils_metrics.Tracer），由 --metrics_file / --metrics_port / --span_log 启用，见 start_span
+_tracer = None
+
+# 公共 JS 函数，注入到各模板的 __HELPERS__ 处：
+# - writeAtomic：先写 .part 再改名，读方只会看到完整文件
+# - writeSentinel：输出保存完毕后写 OUTPUT_PATH.done，出错时写 OUTPUT_PATH.failed，内容为 status\tms\terror
+# - closeNewDocuments：关闭本任务打开但未关闭的文档，避免影响下一个任务
+JSX_HELPERS = r'''
+function writeAtomic(path, text) {
+    var target = new File(path);
+    var part = new File(path + ".part");
+    part.encoding = "UTF-8";
+    part.open("w");
+    part.write(text);
+    part.close();
+    if (target.exists) target.remove();
+    part.rename(target.name);
+}
+
+function writeSentinel(outputPath, status, t0, error) {
+    var stale = new File(outputPath + (status == "done" ? ".failed" : ".done"));
+    if (stale.exists) stale.remove();
+    var ms = new Date().getTime() - t0;
+    var message = error ? String(error).replace(/[\t\r\n]+/g, " ") : "";
+    writeAtomic(outputPath + "." + status, [status, ms, message].join("\t") + "\n");
+}
+
+function closeNewDocuments(docCount) {
+    while (app.documents.length > docCount) {
+        app.activeDocument.close(SaveOptions.DONOTSAVECHANGES);
+    }
+}
+'''
+
+# 单任务参数：独立脚本直接内联；编译缓存模式下由每个任务的小 stub 文件声明后再 $.evalFile 共享脚本
+JSX_PARAMS = r'''
+// input/output tokens will be replaced by Python
+var INPUT_PATH = "{input}";
+var OUTPUT_PATH = "{output}";
+'''
+
+# 主模板：在这里用特殊标记 __ACTIONS__ / __PARAMS__ / {input} / {output}，后面用 str.replace 注入内容，避免与 JS 大量花括号发生冲突。
+# 成功/失败都会写哨兵文件，Python 端据此立即结束等待，而不是等满超时。
 JSX_WRAPPER = r'''
 // Auto-generated JSX wrapper: actions will be executed sequentially
+__HELPERS__
+__PARAMS__
+var docCount = app.documents.length;
+var t0 = new Date().getTime();
 try {
-    // input/output tokens will be replaced by Python
-    var INPUT_PATH = "{input}";
-    var OUTPUT_PATH = "{output}";
-
     // start actions
 __ACTIONS__
 
+    writeSentinel(OUTPUT_PATH, "done", t0, "");
 } catch (e) {
-    if (e && e.toString) {
-        alert("Error in script: " + e.toString());
+    closeNewDocuments(docCount);
+    writeSentinel(OUTPUT_PATH, "failed", t0, e);
+}
+'''
+
+# 批处理模板：一次启动 Photoshop，在同一会话中按 manifest 逐张处理；
+# 每张图的动作包在 runJob(INPUT_PATH, OUTPUT_PATH) 中执行，单张失败只写该图的 .failed 哨兵，不会中断同批次的其余图片。
+JSX_BATCH_WRAPPER = r'''
+// Auto-generated JSX batch wrapper: one Photoshop session, many (input, output) pairs
+__HELPERS__
+
+var MANIFEST = __MANIFEST__;
+
+function runJob(INPUT_PATH, OUTPUT_PATH) {
+    // start actions
+__ACTIONS__
+
+}
+
+for (var i = 0; i < MANIFEST.length; i++) {
+    var docCount = app.documents.length;
+    var t0 = new Date().getTime();
+    try {
+        runJob(MANIFEST[i][0], MANIFEST[i][1]);
+        writeSentinel(MANIFEST[i][1], "done", t0, "");
+    } catch (e) {
+        closeNewDocuments(docCount);
+        writeSentinel(MANIFEST[i][1], "failed", t0, e);
     }
 }
 '''
 
+# 常驻 worker 模板：启动一次后循环读取 spool 目录中的任务，协议见 utils_spool。
+# 只有 spool_dir/stop 出现时才退出，期间 Photoshop 不再冷启动。每轮循环按间隔刷新心跳，每个任务前后各刷新一次。
+JSX_WORKER_WRAPPER = r'''
+// Auto-generated JSX resident worker: takes jobs from a spool directory until a stop file appears
+__HELPERS__
+
+var SPOOL_DIR = "__SPOOL__";
+var POLL_MS = __POLL_MS__;
+var HEARTBEAT_MS = 5000;
+
+function runJob(INPUT_PATH, OUTPUT_PATH) {
+    // start actions
+__ACTIONS__
+
+}
+
+function readText(f) {
+    f.encoding = "UTF-8";
+    f.open("r");
+    var text = f.read();
+    f.close();
+    return text;
+}
+
+var jobsFolder = new Folder(SPOOL_DIR + "/jobs");
+var stopFile = new File(SPOOL_DIR + "/stop");
+var lastBeat = 0;
+
+// 心跳：state 为 idle / busy；busy 表示正在执行一个任务，执行期间无法刷新
+function beat(state) {
+    lastBeat = new Date().getTime();
+    writeAtomic(SPOOL_DIR + "/heartbeat", state + "\t" + lastBeat);
+}
+
+while (!stopFile.exists) {
+    if (new Date().getTime() - lastBeat > HEARTBEAT_MS) {
+        beat("idle");
+    }
+    var jobFiles = jobsFolder.getFiles("*.job");
+    if (jobFiles.length == 0) {
+        $.sleep(POLL_MS);
+        continue;
+    }
+    jobFiles.sort(function (a, b) { return a.name < b.name ? -1 : (a.name > b.name ? 1 : 0); });
+    var jobFile = jobFiles[0];
+    var jobId = decodeURI(jobFile.name).replace(/\.job$/, "");
+    var fields = readText(jobFile).replace(/[\r\n]+$/, "").split("\t");
+    jobFile.remove();
+
+    beat("busy");
+    var docCount = app.documents.length;
+    var t0 = new Date().getTime();
+    var result;
+    try {
+        runJob(fields[0], fields[1]);
+        result = ["done", new Date().getTime() - t0, ""];
+    } catch (e) {
+        closeNewDocuments(docCount);
+        result = ["failed", new Date().getTime() - t0, String(e).replace(/[\t\r\n]+/g, " ")];
+    }
+    writeAtomic(SPOOL_DIR + "/results/" + jobId + ".result", result.join("\t") + "\n");
+    beat("idle");
+}
+stopFile.remove();
+'''
+
 
 def to_photoshop_path(p: Path) -> str:
     # ExtendScript 在 Windows 下接受正斜杠路径更稳健
@@ -86,6 +242,82 @@ def default_save_close_action():
     '''
 
 
+def save_outputs_action(specs):
+    """
+    一次打开、一次滤镜，依次保存全部输出规格后再关闭文档。
+    需要缩小的规格在 duplicate 出的副本上缩放后保存，不影响主文档与后续规格。
+    """
+    specs_js = json.dumps([[spec.suffix, spec.fmt, spec.quality, spec.max_side] for spec in specs])
+    return r'''
+    // Action: save every output spec ([suffix, format, quality, maxSide]) from the same document, then close
+    var saveDocument = function (document, path, quality) {
+        var file = new File(path);
+        var ext = path.toLowerCase().split(".").pop();
+        if (ext == "jpg" || ext == "jpeg") {
+            var jpgOpts = new JPEGSaveOptions();
+            jpgOpts.quality = quality; // 0-12
+            document.saveAs(file, jpgOpts, true, Extension.LOWERCASE);
+        } else if (ext == "png") {
+            document.saveAs(file, new PNGSaveOptions(), true, Extension.LOWERCASE);
+        } else if (ext == "tif" || ext == "tiff") {
+            document.saveAs(file, new TiffSaveOptions(), true, Extension.LOWERCASE);
+        } else {
+            document.saveAs(file, new PhotoshopSaveOptions(), true, Extension.LOWERCASE);
+        }
+    };
+    var outputSpecs = __OUTPUT_SPECS__;
+    var outputBase = OUTPUT_PATH.replace(/\.[^.\/]*$/, "");
+    for (var oi = 0; oi < outputSpecs.length; oi++) {
+        var spec = outputSpecs[oi];
+        var outputPath = oi == 0 ? OUTPUT_PATH : outputBase + spec[0] + "." + spec[1];
+        var variant = doc;
+        var longSide = Math.max(doc.width.as("px"), doc.height.as("px"));
+        if (spec[3] > 0 && longSide > spec[3]) {
+            var k = spec[3] / longSide;
+            variant = doc.duplicate();
+            variant.resizeImage(UnitValue(doc.width.as("px") * k, "px"), UnitValue(doc.height.as("px") * k, "px"),
+                                doc.resolution, ResampleMethod.BICUBICSHARPER);
+        }
+        saveDocument(variant, outputPath, spec[2]);
+        if (variant !== doc) variant.close(SaveOptions.DONOTSAVECHANGES);
+    }
+    app.activeDocument = doc;
+    doc.close(SaveOptions.DONOTSAVECHANGES);
+    '''.replace("__OUTPUT_SPECS__", specs_js)
+
+
+def parse_output_spec(text, index=0):
+    """
+    解析 --outputs 的一项：fmt[:key=value...]，如 "jpg:quality=8:max_side=400:suffix=_thumb"。
+    第一项的 fmt 可省略（由 OUTPUT_PATH 扩展名决定）；其余项未给 suffix 时默认为 "_<fmt>"。
+    """
+    fields = {"suffix": "", "fmt": "", "quality": 10, "max_side": 0}
+    for part in filter(None, text.split(":")):
+        key, sep, value = part.partition("=")
+        if not sep:
+            fields["fmt"] = key.lower().lstrip(".")
+        elif key in ("quality", "max_side"):
+            fields[key] = int(value)
+        elif key in ("suffix", "fmt"):
+            fields[key] = value
+        else:
+            raise ValueError(f"Unknown output spec key: {key} in {text!r}")
+    if index > 0:
+        if not fields["fmt"]:
+            raise ValueError(f"Output spec needs a format: {text!r}")
+        fields["suffix"] = fields["suffix"] or f"_{fields['fmt']}"
+    return OutputSpec(**fields)
+
+
+def output_paths(output_path):
+    """任务的全部输出文件：OUTPUT_PATH 在前，其后为各附加规格（与 save_outputs_action 中的 JS 规则一致）"""
+    output_path = Path(output_path)
+    if not _output_specs:
+        return [output_path]
+    base = output_path.with_suffix("")
+    return [output_path] + [base.with_name(f"{base.name}{spec.suffix}.{spec.fmt}") for spec in _output_specs[1:]]
+
+
 def read_jsx_text_file(path: Path) -> str:
     """
     读取文本 jsx 文件，替换 __INPUT__ / __OUTPUT__ 为 wrapper 的 {input}/{output} token，
@@ -145,62 +377,242 @@ def build_actions_with_optional_resize_jsx(resize_jsx_path: str):
     - save_close
     """
     open_action = default_open_action()
-    save_action = default_save_close_action()
+    save_action = save_outputs_action(_output_specs) if _output_specs else default_save_close_action()
 
     middle_action = build_middle_action_from_path(resize_jsx_path) if resize_jsx_path else default_resize_half_action()
 
     return [open_action, middle_action, save_action]
 
 
-def build_and_run_jsx(temp_jsx, input_path: Path, output_path: Path, photoshop_exe: Path):
-    logger.info("Temporary JSX:", temp_jsx)
-    logger.info("Using Photoshop:", photoshop_exe)
-    logger.info("Input :", input_path)
-    logger.info("Output:", output_path)
-
-    # 4) 调用 Photoshop 执行 jsx（如果找不到指定 exe，会尝试 'Photoshop.exe'）
+def launch_photoshop(temp_jsx, photoshop_exe: Path):
+    """
+    调用 Photoshop 执行 jsx（如果找不到指定 exe，会尝试 'Photoshop.exe'）
+    """
     try:
         exe_cmd = [str(photoshop_exe), "-r", temp_jsx] if photoshop_exe.exists() else ["Photoshop.exe", "-r", temp_jsx]
         proc = subprocess.Popen(exe_cmd, shell=False)
 
         print("Photoshop started (pid {}).".format(proc.pid))
         print("脚本已派发给 Photoshop 执行。")
+        return proc
     except Exception as e:
         print("Failed to start Photoshop:", e, file=sys.stderr)
         # 不强制删除 temp_jsx，便于调试
         sys.exit(1)
 
 
-def poll_move(temp_jsx):
-    start_time = time.time()
-    wait_timeout_seconds = 600  # 等待最大秒数（可根据需要调整或放到参数）
-    poll_interval = 1.0  # 轮询间隔（秒）
-    try:
-        while True:
-            if os.path.exists(output_path):
-                utils_data.move(source_path, finish_path)
-                break
+def build_and_run_jsx(temp_jsx, input_path: Path, output_path: Path, photoshop_exe: Path):
+    logger.info(f"Temporary JSX: {temp_jsx}")
+    logger.info(f"Using Photoshop: {photoshop_exe}")
+    logger.info(f"Input : {input_path}")
+    logger.info(f"Output: {output_path}")
 
-            elapsed = time.time() - start_time
-            if elapsed > wait_timeout_seconds:
-                print(f"Timeout waiting for JSX to finish ({wait_timeout_seconds}s). Not moving file. Check {temp_jsx} and Photoshop.", file=sys.stderr)
-                # 可选：proc.kill()，或把文件移动到错误目录；此处选择不移动以便人工检查
-                break
+    # 4) 调用 Photoshop（或已配置的后端）执行 jsx
+    return run_jsx(temp_jsx, photoshop_exe)
+
+
+class PhotoshopBackend:
+    """
+    jsx 执行后端接口：run(temp_jsx) 派发脚本后立即返回，结果由脚本写出的哨兵 / spool 结果文件返回。
+    默认实现启动 Photoshop.exe -r temp_jsx；utils_simulate.SimulatedPhotoshop 实现同一接口，无需 Photoshop。
+    """
+    name = "photoshop"
+
+    def __init__(self, photoshop_exe: Path):
+        self.photoshop_exe = Path(photoshop_exe)
+
+    def run(self, temp_jsx):
+        return launch_photoshop(temp_jsx, self.photoshop_exe)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def run_jsx(temp_jsx, photoshop_exe: Path):
+    """所有派发点（单任务、批处理、常驻 worker、流水线）统一经此执行 jsx"""
+    backend = _backend if _backend is not None else PhotoshopBackend(photoshop_exe)
+    return backend.run(temp_jsx)
+
+
+def get_completion_watcher():
+    """进程内共享一个 CompletionWatcher：所有在途任务共用一个监听线程（Linux 下为 inotify，其他平台轮询）"""
+    global _completion_watcher
+    if _completion_watcher is None:
+        _completion_watcher = utils_watch.CompletionWatcher().start()
+    return _completion_watcher
+
+
+def get_finalizer():
+    """进程内共享一个 Finalizer：移动输入文件在线程池中进行，不阻塞 watcher 线程与事件循环"""
+    global _finalizer
+    if _finalizer is None:
+        _finalizer = utils_data.Finalizer()
+    return _finalizer
+
+
+def photoshop_input(source_path):
+    """交给 Photoshop 打开的文件：启用预处理且已完成时为预处理文件，否则为源文件"""
+    return _prestage.input_path(source_path) if _prestage is not None else source_path
+
+
+def start_span(source_path):
+    """开始单个任务的计时 span（queued），带图片尺寸；未启用计时时返回空操作的 NULL_SPAN"""
+    if _tracer is None:
+        return utils_metrics.NULL_SPAN
+    width, height = image_size(source_path)
+    return _tracer.start(source_path, width=width, height=height)
+
+
+def finish_span_on_move(span, future):
+    """移动完成后标记 moved 并结束 span；移动失败记为 move_failed"""
+    def done(f):
+        result = f.result()
+        span.mark("moved").finish("done" if result.ok else "move_failed", result.error or "")
+    future.add_done_callback(done)
+    return future
+
+
+def log_move_result(result: utils_data.MoveResult):
+    if result.ok:
+        logger.info(f"Moved ({result.method}, {result.size} bytes, {result.seconds:.3f}s): {result.source} -> {result.target}")
+    else:
+        logger.error(f"Move failed: {result.source} -> {result.target}: {result.error}")
+    return result
+
+
+def finalize_move(source_path, finish_path):
+    """把源文件移动到 finish，返回 Future[MoveResult]；结果（含失败）统一写日志"""
+    future = get_finalizer().submit(source_path, finish_path)
+    future.add_done_callback(lambda f: log_move_result(f.result()))
+    return future
+
+
+class SentinelWait:
+    """单个任务的哨兵等待：done 在结果到达或超时后置位，result 为 (status, ms, error)"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def sentinel_paths(output_path):
+    """返回 (OUTPUT_PATH.done, OUTPUT_PATH.failed)"""
+    output_path = Path(output_path)
+    return output_path.with_name(output_path.name + ".done"), output_path.with_name(output_path.name + ".failed")
+
+
+def clear_sentinels(output_path):
+    """派发前清理上一次运行遗留的哨兵，避免误判为已完成"""
+    for path in sentinel_paths(output_path):
+        path.unlink(missing_ok=True)
 
-            # 心跳输出（每 10 秒刷新一次，避免太多日志）
-            if int(elapsed) % 10 == 0:
-                print(f"Waiting for done file ({output_path})... elapsed: {int(elapsed)}s", end="\r")
-            time.sleep(poll_interval)
+
+def watch_sentinel(output_path, on_result=None, wait_timeout_seconds=600, on_timeout=None, watcher=None):
+    """
+    非阻塞：同时登记 .done 与 .failed 哨兵，先出现者生效并取消另一个；读取后删除哨兵。
+    哨兵在全部输出（见 output_paths）保存完毕后才写入；.done 出现但任一输出缺失或为空时按 failed 处理。
+    on_result(status, ms, error) 在 watcher 线程中调用；超时调用 on_timeout()，result 为 ("timeout", 0, "")。
+    """
+    watcher = watcher or get_completion_watcher()
+    done_path, failed_path = sentinel_paths(output_path)
+    wait = SentinelWait()
+    lock = threading.Lock()
+    claimed = []
+
+    def claim(path):
+        with lock:
+            if claimed:
+                return False
+            claimed.append(path)
+        other = failed_path if os.path.abspath(path) == os.path.abspath(done_path) else done_path
+        watcher.cancel(other)
+        return True
+
+    def on_ready(path):
+        if not claim(path):
+            return
+        try:
+            status, ms, error = utils_spool.parse_result(Path(path).read_text(encoding="utf-8"))
+            Path(path).unlink(missing_ok=True)
+            missing = [str(path) for path in output_paths(output_path)
+                       if not (os.path.exists(path) and os.path.getsize(path) > 0)]
+            if status == "done" and missing:
+                status, error = "failed", f"Output missing after done sentinel: {', '.join(missing)}"
+            wait.result = (status, ms, error)
+            if on_result is not None:
+                on_result(status, ms, error)
+        finally:
+            wait.done.set()
+
+    def on_expired(path):
+        if not claim(path):
+            return
+        try:
+            wait.result = ("timeout", 0, "")
+            if on_timeout is not None:
+                on_timeout()
+        finally:
+            wait.done.set()
+
+    for path in (done_path, failed_path):
+        watcher.watch(path, on_ready, timeout=wait_timeout_seconds, on_timeout=on_expired)
+    return wait
+
+
+def cancel_sentinel(output_path, watcher=None):
+    watcher = watcher or get_completion_watcher()
+    for path in sentinel_paths(output_path):
+        watcher.cancel(path)
+
+
+def watch_move(temp_jsx, output_path, source_path, finish_path, wait_timeout_seconds=600, watcher=None, on_finish=None,
+               span=utils_metrics.NULL_SPAN):
+    """
+    非阻塞：等待 output_path 的哨兵，done 时把 source_path 移动到 finish_path，failed 时立即记录错误。
+    on_finish() 在处理完结果或超时后调用（用于批量等待时感知进度）。span 记录 completed / moved。返回 SentinelWait。
+    """
+    def on_result(status, ms, error):
+        span.mark("completed")
+        if status == "done":
+            finish_span_on_move(span, finalize_move(source_path, finish_path))
+        else:
+            span.finish(status, error)
+            logger.error(f"JSX failed for {source_path} ({ms} ms): {error}. Not moving file. Check {temp_jsx}.")
+        if on_finish is not None:
+            on_finish()
+
+    def on_timeout():
+        # 可选：proc.kill()，或把文件移动到错误目录；此处选择不移动以便人工检查
+        span.finish("timeout")
+        print(f"Timeout waiting for JSX to finish ({wait_timeout_seconds}s). Not moving file. Check {temp_jsx} and Photoshop.", file=sys.stderr)
+        if on_finish is not None:
+            on_finish()
+
+    return watch_sentinel(output_path, on_result, wait_timeout_seconds, on_timeout, watcher)
+
+
+def poll_move(temp_jsx, output_path, source_path, finish_path, wait_timeout_seconds=600, span=utils_metrics.NULL_SPAN):
+    """阻塞等待单个任务的 .done/.failed 哨兵并移动源文件，返回 (status, ms, error)"""
+    start_time = time.time()
+    wait = watch_move(temp_jsx, output_path, source_path, finish_path, wait_timeout_seconds, span=span)
+    try:
+        # 心跳输出（每 10 秒刷新一次，避免太多日志）
+        while not wait.done.wait(10):
+            print(f"Waiting for done file ({output_path})... elapsed: {int(time.time() - start_time)}s", end="\r")
     except KeyboardInterrupt:
+        cancel_sentinel(output_path)
+        span.finish("interrupted")
         print("Interrupted while waiting for JSX completion.", file=sys.stderr)
+    return wait.result
 
 
-def get_jsx(actions, input_path):
+def get_jsx(actions, input_path, output_path):
     # 1) 合并 actions：直接把 actions 列表按顺序串成字符串
     actions_js = "\n".join(actions)
 
     # 2) 将 tokens 注入 wrapper（注意使用 as_posix() 提供正斜杠路径）
-    jsx = JSX_WRAPPER.replace("__ACTIONS__", actions_js) \
+    jsx = JSX_WRAPPER.replace("__HELPERS__", JSX_HELPERS) \
+        .replace("__PARAMS__", JSX_PARAMS) \
+        .replace("__ACTIONS__", actions_js) \
         .replace("{input}", to_photoshop_path(input_path)) \
         .replace("{output}", to_photoshop_path(output_path))
     # 3) 写临时 jsx 文件
@@ -210,6 +622,613 @@ def get_jsx(actions, input_path):
     return temp_jsx
 
 
+def bind_path_tokens(actions_js: str) -> str:
+    """
+    批处理下路径在运行期才确定：把动作中的 {input}/{output} 占位改为引用 JS 变量 INPUT_PATH/OUTPUT_PATH。
+    - "{input}" 整个字符串字面量 -> INPUT_PATH
+    - 字符串内部的 {input} -> " + INPUT_PATH + "
+    """
+    for token, var in (("{input}", "INPUT_PATH"), ("{output}", "OUTPUT_PATH")):
+        actions_js = actions_js.replace(f'"{token}"', var).replace(token, f'" + {var} + "')
+    return actions_js
+
+
+class ActionTemplateCache:
+    """
+    动作模板编译缓存：每个动作文件在一次运行中只读取、拼装一次。
+    - 以动作文件路径为键；文件 mtime/size 变化时重新计算内容哈希，哈希不变则继续复用
+    - 编译结果写入 cache_dir/<action_hash>.jsx，路径相关的占位绑定为 INPUT_PATH/OUTPUT_PATH 变量
+    - 每个任务只写一个几百字节的 stub：声明 INPUT_PATH/OUTPUT_PATH 后 $.evalFile 共享脚本
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir or Path(tempfile.gettempdir()) / "reverie_jsx_cache")
+        self._entries = {}  # key -> (mtime_ns, size, content_hash, actions, compiled_path, action_hash)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(jsx_path):
+        return str(Path(jsx_path).expanduser().resolve()) if jsx_path else ""
+
+    def _load(self, jsx_path):
+        key = self._key(jsx_path)
+        stat = os.stat(key) if key else None
+        signature = (stat.st_mtime_ns, stat.st_size) if stat else (0, 0)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[:2] == signature:
+            return entry
+
+        content_hash = hashlib.sha1(Path(key).read_bytes()).hexdigest() if key else ""
+        if entry is not None and entry[2] == content_hash:
+            # 仅 mtime 变化（如被 touch），内容未变，继续使用已编译结果
+            entry = signature + entry[2:]
+        else:
+            actions = build_actions_with_optional_resize_jsx(jsx_path)
+            compiled = JSX_WRAPPER.replace("__HELPERS__", JSX_HELPERS) \
+                .replace("__PARAMS__", "// INPUT_PATH / OUTPUT_PATH are declared by the per-job stub") \
+                .replace("__ACTIONS__", bind_path_tokens("\n".join(actions)))
+            action_hash = hashlib.sha1(compiled.encode("utf-8")).hexdigest()
+            compiled_path = self.cache_dir / f"{action_hash}.jsx"
+            if not compiled_path.exists():
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                utils_spool.write_atomic(compiled_path, compiled)
+            entry = signature + (content_hash, actions, compiled_path, action_hash)
+            logger.info(f"Compiled action template: {key or '<default>'} -> {compiled_path}")
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def actions(self, jsx_path):
+        """返回动作列表（与 build_actions_with_optional_resize_jsx 相同，但带缓存）"""
+        return self._load(jsx_path)[3]
+
+    def action_hash(self, jsx_path):
+        """编译后脚本的哈希，可作为动作版本标识"""
+        return self._load(jsx_path)[5]
+
+    def job_jsx(self, jsx_path, input_path, output_path):
+        """生成单个任务的 stub jsx，返回其路径"""
+        compiled_path = self._load(jsx_path)[4]
+        stub = JSX_PARAMS.replace("{input}", to_photoshop_path(Path(input_path))) \
+            .replace("{output}", to_photoshop_path(Path(output_path)))
+        stub += f'$.evalFile(new File("{to_photoshop_path(compiled_path)}"));\n'
+        with tempfile.NamedTemporaryFile("w", suffix=".jsx", delete=False, encoding="utf-8") as f:
+            f.write(stub)
+            temp_jsx = f.name
+        return temp_jsx
+
+
+template_cache = ActionTemplateCache()
+
+
+def get_batch_jsx(actions, pairs):
+    """
+    生成批处理 jsx：pairs 为 [(input_path, output_path), ...]，在一个 Photoshop 会话中依次执行。
+    manifest 以 JSON 数组字面量写入（JSON 是合法的 JS 表达式，自动处理引号与中文转义）。
+    """
+    actions_js = bind_path_tokens("\n".join(actions))
+    manifest = json.dumps([[to_photoshop_path(i), to_photoshop_path(o)] for i, o in pairs])
+    jsx = JSX_BATCH_WRAPPER.replace("__HELPERS__", JSX_HELPERS) \
+        .replace("__ACTIONS__", actions_js) \
+        .replace("__MANIFEST__", manifest)
+    with tempfile.NamedTemporaryFile("w", suffix=".jsx", delete=False, encoding="utf-8") as f:
+        f.write(jsx)
+        temp_jsx = f.name
+    return temp_jsx
+
+
+def run_batch(jobs, photoshop_exe: Path, actions, chunk_size: int = 20, wait_timeout_seconds: int = 600):
+    """
+    批处理模式：每 chunk_size 张图只启动一次 Photoshop。
+    jobs 为 [(source_path, output_path, finish_path), ...]；每张图的哨兵到达即移动（done）或记录错误（failed）。
+    wait_timeout_seconds 为两张图之间的最大等待时间，每到达一个哨兵就重新计时。
+    返回 {source_path: (status, ms, error)}。
+    """
+    results = {}
+    spans = {source_path: start_span(source_path) for source_path, *_ in jobs}
+    processed = 0
+    try:
+        for start in range(0, len(jobs), chunk_size):
+            chunk = jobs[start:start + chunk_size]
+            for _, output_path, _ in chunk:
+                clear_sentinels(output_path)
+            temp_jsx = get_batch_jsx(actions, [(photoshop_input(source), output) for source, output, _ in chunk])
+            get_finalizer().prepare_dirs(finish_path for *_, finish_path in chunk)
+            for source_path, *_ in chunk:
+                spans[source_path].mark("built")
+            logger.info(f"Batch {start // chunk_size + 1}: {len(chunk)} images, JSX: {temp_jsx}")
+            run_jsx(temp_jsx, photoshop_exe)
+            for source_path, *_ in chunk:
+                spans[source_path].mark("dispatched")
+
+            progress = threading.Event()
+            waits = [watch_move(temp_jsx, output_path, source_path, finish_path,
+                                wait_timeout_seconds=wait_timeout_seconds * len(chunk), on_finish=progress.set,
+                                span=spans[source_path])
+                     for source_path, output_path, finish_path in chunk]
+            interrupted = False
+            try:
+                while not all(wait.done.is_set() for wait in waits):
+                    if not progress.wait(wait_timeout_seconds):
+                        print(f"Timeout waiting for batch JSX ({wait_timeout_seconds}s without progress). Check {temp_jsx} and Photoshop.", file=sys.stderr)
+                        break
+                    progress.clear()
+            except KeyboardInterrupt:
+                print("Interrupted while waiting for batch JSX completion.", file=sys.stderr)
+                interrupted = True
+            for (source_path, output_path, _), wait in zip(chunk, waits):
+                if not wait.done.is_set():
+                    cancel_sentinel(output_path)
+                    spans[source_path].finish("timeout")
+                results[source_path] = wait.result or ("timeout", 0, "")
+            logger.info(f"Batch {start // chunk_size + 1} finished: "
+                        f"{sum(1 for source, *_ in chunk if results[source][0] == 'done')}/{len(chunk)} done")
+            processed = start + len(chunk)
+            if interrupted:
+                break
+    finally:
+        # span 在开始时为全部任务创建：中断或出错时结束未处理分块的 span，否则 in-flight 指标会一直偏高
+        for source_path, *_ in jobs[processed:]:
+            spans[source_path].finish("interrupted")
+    return results
+
+
+def get_worker_jsx(actions, spool_dir: Path, poll_ms: int = 200):
+    """生成常驻 worker jsx，动作与批处理一样在 runJob 中以 INPUT_PATH/OUTPUT_PATH 变量执行"""
+    actions_js = bind_path_tokens("\n".join(actions))
+    jsx = JSX_WORKER_WRAPPER.replace("__HELPERS__", JSX_HELPERS) \
+        .replace("__ACTIONS__", actions_js) \
+        .replace("__SPOOL__", to_photoshop_path(spool_dir)) \
+        .replace("__POLL_MS__", str(int(poll_ms)))
+    with tempfile.NamedTemporaryFile("w", suffix=".jsx", delete=False, encoding="utf-8") as f:
+        f.write(jsx)
+        temp_jsx = f.name
+    return temp_jsx
+
+
+def start_worker(actions, channel: utils_spool.SpoolChannel, photoshop_exe: Path):
+    """
+    worker 未存活时启动一次常驻 worker；已存活则直接复用，不再启动新进程。
+    启动前清除上次残留的 stop 文件（如上一个 worker 已退出而没有删除），否则新 worker 会立即退出。
+    """
+    if channel.is_worker_alive():
+        logger.info(f"Reusing resident worker on spool: {channel.spool_dir}")
+        return None
+    channel.clear_stop()
+    temp_jsx = get_worker_jsx(actions, channel.spool_dir)
+    logger.info(f"Starting resident worker on spool: {channel.spool_dir}, JSX: {temp_jsx}")
+    return run_jsx(temp_jsx, photoshop_exe)
+
+
+def run_worker_jobs(jobs, channel: utils_spool.SpoolChannel, wait_timeout_seconds: int = 600):
+    """
+    常驻 worker 模式：一次性投递所有任务描述，由共享 watcher 监听结果文件并即时移动输入文件。
+    jobs 为 [(source_path, output_path, finish_path), ...]；wait_timeout_seconds 为结果之间的最大间隔。
+    返回 {source_path: (status, ms, error)}。
+    """
+    watcher = get_completion_watcher()
+    results = {}
+    progress = threading.Event()
+
+    spans = {}
+
+    def on_result(job_id, source_path, finish_path):
+        def callback(path):
+            status, ms, error = results[source_path] = channel.result(job_id)
+            span = spans[source_path].mark("completed")
+            if status == "done":
+                finish_span_on_move(span, finalize_move(source_path, finish_path))
+            else:
+                span.finish(status, error)
+                logger.error(f"Worker job failed: {source_path} ({ms} ms): {error}")
+            progress.set()
+        return callback
+
+    pending = {}
+    for source_path, output_path, finish_path in jobs:
+        span = spans[source_path] = start_span(source_path)
+        job_id = channel.submit(photoshop_input(source_path), output_path)
+        span.mark("dispatched")
+        pending[job_id] = source_path
+        # 排队中的任务也在等待，上限按全部任务计算；真正的超时判断见下方“无进展”检测
+        watcher.watch(channel.result_path(job_id), on_result(job_id, source_path, finish_path),
+                      timeout=wait_timeout_seconds * len(jobs))
+    try:
+        while len(results) < len(pending):
+            if not progress.wait(wait_timeout_seconds):
+                print(f"Timeout waiting for worker ({wait_timeout_seconds}s without progress). Check {channel.spool_dir} and Photoshop.", file=sys.stderr)
+                break
+            progress.clear()
+    except KeyboardInterrupt:
+        print("Interrupted while waiting for worker results.", file=sys.stderr)
+    for job_id, source_path in pending.items():
+        if source_path not in results:
+            watcher.cancel(channel.result_path(job_id))
+            spans[source_path].finish("timeout")
+            results[source_path] = ("timeout", 0, "")
+    return results
+
+
+class PipelineJob:
+    """流水线中的一个任务：prestage 为预处理的 Future，build 阶段填充 temp_jsx，执行阶段填充 result；span 记录各阶段时刻"""
+    __slots__ = ("source_path", "output_path", "finish_path", "prestage", "temp_jsx", "result", "span")
+
+    def __init__(self, source_path, output_path, finish_path):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.finish_path = finish_path
+        self.prestage = None
+        self.temp_jsx = None
+        self.result = None
+        self.span = utils_metrics.NULL_SPAN
+
+
+async def wait_sentinel_async(output_path, wait_timeout_seconds=600):
+    """在事件循环中等待哨兵：由共享 watcher 线程回调唤醒，不为每个任务占用线程"""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def wake(*_):
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    wait = watch_sentinel(output_path, on_result=wake, wait_timeout_seconds=wait_timeout_seconds, on_timeout=wake)
+    await future
+    return wait.result
+
+
+class Executor:
+    """
+    执行器接口：一个执行器即一个执行槽位（一个 Photoshop 实例 / 一台 worker 主机）。
+    run(job) 执行单个任务并返回 (status, ms, error)，不负责移动文件。
+    """
+    name = "executor"
+
+    async def run(self, job: PipelineJob, wait_timeout_seconds=600):
+        raise NotImplementedError
+
+
+class PhotoshopExecutor(Executor):
+    """每个任务派发一次 Photoshop.exe -r temp_jsx，等待哨兵"""
+    name = "photoshop"
+
+    def __init__(self, photoshop_exe: Path):
+        self.photoshop_exe = Path(photoshop_exe)
+
+    async def run(self, job, wait_timeout_seconds=600):
+        clear_sentinels(job.output_path)
+        build_and_run_jsx(job.temp_jsx, photoshop_input(job.source_path), job.output_path, self.photoshop_exe)
+        return await wait_sentinel_async(job.output_path, wait_timeout_seconds)
+
+
+def photoshop_executors(photoshop_exes, slots, instances=None):
+    """
+    直连 Photoshop 的执行槽位，最多 slots 个，且不超过可同时运行的实例数 instances（默认每个 Photoshop.exe 一个，
+    模拟后端为其 concurrency）。
+    Photoshop 是单实例程序：同一个 Photoshop.exe 再次 -r 只会把脚本交给已运行的实例排队执行，吞吐不随槽位增加，
+    排队时间还会计入各任务的超时。真正的并行需要多个独立实例（各自的安装/用户会话/主机），
+    可用逗号分隔传入多个 --photoshop，或每个实例运行一个常驻 worker 并用 --worker_spool 传入各自的 spool 目录。
+    """
+    instances = instances or len(photoshop_exes)
+    if slots > instances:
+        logger.warning(f"--slots {slots} with {instances} Photoshop instance(s): Photoshop is single-instance "
+                       f"and would queue the extra scripts, using {instances} slot(s). "
+                       f"Pass one executable per instance or use --worker_spool for real parallelism.")
+        slots = instances
+    return [PhotoshopExecutor(photoshop_exes[index % len(photoshop_exes)]) for index in range(max(1, slots))]
+
+
+class SpoolExecutor(Executor):
+    """把任务投递给常驻 worker（见 JSX_WORKER_WRAPPER），不启动新进程，无需 temp_jsx"""
+    name = "spool"
+
+    def __init__(self, channel: utils_spool.SpoolChannel):
+        self.channel = channel
+
+    async def run(self, job, wait_timeout_seconds=600):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake(path):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        job_id = self.channel.submit(photoshop_input(job.source_path), job.output_path)
+        get_completion_watcher().watch(self.channel.result_path(job_id), wake,
+                                       timeout=wait_timeout_seconds, on_timeout=wake)
+        await future
+        return self.channel.result(job_id) or ("timeout", 0, "")
+
+
+class FakeExecutor(Executor):
+    """本地替身：等待 latency 秒后复制输入到输出，按 failure_rate 随机失败，用于测试调度逻辑"""
+    name = "fake"
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    async def run(self, job, wait_timeout_seconds=600):
+        t0 = time.time()
+        await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            return "failed", int((time.time() - t0) * 1000), "Simulated failure"
+        Path(job.output_path).parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(shutil.copyfile, photoshop_input(job.source_path), job.output_path)
+        return "done", int((time.time() - t0) * 1000), ""
+
+
+async def run_pipeline(jobs, executors, build=None, wait_timeout_seconds=600, build_ahead=2, on_start=None, on_result=None,
+                       keep_results=True, trace=True):
+    """
+    异步流水线调度：build -> dispatch/wait -> move 三个阶段重叠执行。
+    - build：build(input_path, output_path) 生成 temp_jsx（在线程中执行），最多领先执行槽位 build_ahead 个任务；
+      build 为 None 时跳过（如 SpoolExecutor，worker 自带动作）
+    - prestage：启用预处理时任务到达即提交到进程池，最多再领先 build 阶段 build_ahead × len(executors) 个任务，
+      多张图的预处理并行进行；build 按到达顺序等待各自的预处理完成
+    - dispatch：每个执行器一个协程，空闲即取下一个已 build 的任务，并发数 = len(executors)
+    - move：成功的任务在线程中移动源文件到 finish，不阻塞下一张的派发
+    on_start(source_path) 在派发前、on_result(source_path, result) 在移动后调用（在线程中执行，可做台账等同步 I/O）。
+    jobs 为 [(source_path, output_path, finish_path), ...] 或产出同样元组的异步迭代器（如热文件夹的到达队列），
+    返回 {source_path: (status, ms, error)}；常驻运行时可用 keep_results=False 避免结果无限累积。
+    启用计时时每个任务一个 span：dispatched 为取得执行槽位的时刻，built -> dispatched 即排队等待槽位的时间；
+    trace=False 时不记录（如分块模式的分块任务，由 run_tiled 按整张图记录）。
+    """
+    staged = asyncio.Queue(maxsize=max(1, len(executors) * build_ahead))
+    built = asyncio.Queue(maxsize=max(1, len(executors) * build_ahead))
+    finished = asyncio.Queue()
+    results = {}
+
+    async def stage_one(source_path, output_path, finish_path):
+        job = PipelineJob(source_path, output_path, finish_path)
+        if trace and _tracer is not None:
+            # 读取图片尺寸需要打开文件头，不放在事件循环线程中
+            job.span = await asyncio.to_thread(start_span, source_path)
+        if _prestage is not None:
+            # 只提交不等待：staged 中排队的任务的预处理在进程池中并行执行
+            try:
+                job.prestage = _prestage.submit(source_path)
+            except Exception as e:
+                logger.error(f"Pre-stage failed, using original file: {source_path}: {e}")
+        await staged.put(job)
+
+    async def stager():
+        if hasattr(jobs, "__aiter__"):
+            async for source_path, output_path, finish_path in jobs:
+                await stage_one(source_path, output_path, finish_path)
+        else:
+            # 整批已知：一次性创建全部 finish 目录，移动时不再逐个 makedirs
+            batch = list(jobs)
+            await asyncio.to_thread(get_finalizer().prepare_dirs, [finish_path for *_, finish_path in batch])
+            for source_path, output_path, finish_path in batch:
+                await stage_one(source_path, output_path, finish_path)
+        await staged.put(None)
+
+    async def build_one(job):
+        if job.prestage is not None:
+            try:
+                await asyncio.wrap_future(job.prestage)
+                _prestage.collect(job.source_path, job.prestage)
+                job.span.mark("prestaged")
+            except Exception as e:
+                logger.error(f"Pre-stage failed, using original file: {job.source_path}: {e}")
+            job.prestage = None
+        if build is not None:
+            try:
+                job.temp_jsx = await asyncio.to_thread(build, photoshop_input(job.source_path), job.output_path)
+            except Exception as e:
+                job.result = ("failed", 0, f"Build failed: {e}")
+                await finished.put(job)
+                return
+        job.span.mark("built")
+        await built.put(job)
+
+    async def builder():
+        while True:
+            job = await staged.get()
+            if job is None:
+                break
+            await build_one(job)
+        for _ in executors:
+            await built.put(None)
+
+    async def dispatcher(executor):
+        while True:
+            job = await built.get()
+            if job is None:
+                break
+            if on_start is not None:
+                await asyncio.to_thread(on_start, job.source_path)
+            job.span.mark("dispatched")
+            try:
+                job.result = await executor.run(job, wait_timeout_seconds)
+            except Exception as e:
+                job.result = ("failed", 0, f"{executor.name} executor error: {e}")
+            job.span.mark("completed")
+            await finished.put(job)
+
+    async def finalize(job):
+        status, ms, error = job.result
+        if status == "done":
+            move_result = log_move_result(await asyncio.wrap_future(get_finalizer().submit(job.source_path, job.finish_path)))
+            job.span.mark("moved")
+            if not move_result.ok:
+                # 输出已生成，只是源文件未能归档：单独标记，避免台账按失败重跑 Photoshop
+                job.result = ("move_failed", ms, move_result.error)
+        else:
+            logger.error(f"Job {status}: {job.source_path} ({ms} ms): {error}")
+        job.span.finish(job.result[0], job.result[2])
+        if keep_results:
+            results[job.source_path] = job.result
+        if on_result is not None:
+            await asyncio.to_thread(on_result, job.source_path, job.result)
+
+    async def mover():
+        # 每个完成的任务独立 finalize，多个移动并发进行
+        tasks = set()
+        while True:
+            job = await finished.get()
+            if job is None:
+                break
+            task = asyncio.create_task(finalize(job))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    move_task = asyncio.create_task(mover())
+    await asyncio.gather(stager(), builder(), *(dispatcher(executor) for executor in executors))
+    await finished.put(None)
+    await move_task
+    return results
+
+
+async def run_daemon(input_dir, make_job, executors, build=None, on_start=None, on_result=None,
+                     suffixes=(".jpg", ".png"), settle_seconds=2.0):
+    """
+    热文件夹常驻模式：递归监听 input_dir，文件到达完毕后由 make_job(rel_path) 生成任务并送入流水线。
+    make_job 返回 (source_path, output_path, finish_path)，返回 None 表示跳过（如缓存命中、台账判定已完成）。
+    一直运行直到被中断。
+    """
+    loop = asyncio.get_running_loop()
+    arrivals = asyncio.Queue()
+
+    def on_file(rel_path):
+        # 在监听线程中执行：make_job 可能涉及台账/缓存 I/O，放在这里不会阻塞事件循环
+        try:
+            job = make_job(rel_path)
+        except Exception as e:
+            logger.error(f"Failed to prepare job for {rel_path}: {e}")
+            return
+        if job is not None:
+            loop.call_soon_threadsafe(arrivals.put_nowait, job)
+
+    async def arrival_stream():
+        while True:
+            yield await arrivals.get()
+
+    folder = utils_watch.HotFolder(input_dir, on_file, suffixes=suffixes, settle_seconds=settle_seconds).start()
+    logger.info(f"Watching hot folder ({folder.backend}): {input_dir}")
+    try:
+        await run_pipeline(arrival_stream(), executors, build=build, on_start=on_start, on_result=on_result,
+                           keep_results=False)
+    finally:
+        folder.stop()
+
+
+def image_size(path):
+    """只读文件头获取 (宽, 高)，无法识别（或未安装 Pillow）时返回 (0, 0)"""
+    try:
+        from PIL import Image
+        with Image.open(path) as img:
+            return img.size
+    except Exception:
+        return 0, 0
+
+
+def image_pixels(path):
+    """只读文件头获取像素数，无法识别时返回 0"""
+    width, height = image_size(path)
+    return width * height
+
+
+def stitch_outputs(utils_tile, tiles, tile_dir, width, height, output_path, overlap):
+    """把分块的每个输出规格拼接到对应的最终输出（见 run_tiled）"""
+    from PIL import Image
+    specs = _output_specs or [None]
+    finals = output_paths(output_path)
+    for index, (spec, final_path) in enumerate(zip(specs, finals)):
+        # Photoshop 的 JPEG 质量为 0-12，换算到 Pillow 的 1-95
+        quality = max(1, min(95, round((spec.quality if spec else 12) * 95 / 12)))
+        save_options = {"quality": quality} if final_path.suffix.lower() in (".jpg", ".jpeg") else {}
+        if index > 0 and spec.max_side > 0:
+            with Image.open(finals[0]) as img:
+                img = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+                img.thumbnail((spec.max_side, spec.max_side), Image.LANCZOS)
+                img.save(final_path, **save_options)
+            continue
+        tile_outputs = [(tile, output_paths(tile_dir / "out" / tile_path.name)[index]) for tile, tile_path in tiles]
+        utils_tile.stitch_tiles(tile_outputs, width, height, final_path, overlap, tile_dir, **save_options)
+
+
+async def run_tiled(jobs, executors, build=None, tile_size=4096, overlap=128, work_dir=None, wait_timeout_seconds=600,
+                    on_start=None, on_result=None):
+    """
+    超大图分块模式：逐张把输入切成带重叠的分块，分块作为普通任务经 run_pipeline 在全部执行器上并行处理，
+    全部成功后用 utils_tile.stitch_tiles 羽化拼接到 output_path，再把源文件移动到 finish。
+    任一分块失败则整张图记为 failed；分块的中间文件在每张图结束后删除。
+    多输出时逐个规格拼接；带 max_side 的规格若逐块缩小会错位，改为由拼接后的主输出缩小得到。
+    on_start / on_result 针对整张图（source_path），与 run_pipeline 相同。返回 {source_path: (status, ms, error)}。
+    """
+    # Pillow/NumPy 仅在启用分块时需要
+    from reverie.utils import utils_tile
+    work_dir = Path(work_dir or Path(tempfile.gettempdir()) / "reverie_tiles")
+    results = {}
+    for source_path, output_path, finish_path in jobs:
+        t0 = time.time()
+        tile_dir = work_dir / hashlib.sha1(str(source_path).encode("utf-8")).hexdigest()[:16]
+        span = await asyncio.to_thread(start_span, source_path)
+        if on_start is not None:
+            await asyncio.to_thread(on_start, source_path)
+        try:
+            width, height, tiles = await asyncio.to_thread(utils_tile.split_image, source_path, tile_dir / "in",
+                                                           tile_size, overlap)
+            span.update(tiles=len(tiles)).mark("built")
+            tile_jobs = [(tile_path, tile_dir / "out" / tile_path.name, tile_dir / "done" / tile_path.name)
+                         for _, tile_path in tiles]
+            (tile_dir / "out").mkdir(parents=True, exist_ok=True)
+            logger.info(f"Tiled {source_path}: {width}x{height} -> {len(tiles)} tiles")
+            span.mark("dispatched")
+            tile_results = await run_pipeline(tile_jobs, executors, build=build, wait_timeout_seconds=wait_timeout_seconds,
+                                              trace=False)
+            span.mark("completed")
+            failed = [(path, result) for path, result in tile_results.items() if result[0] != "done"]
+            if failed:
+                result = ("failed", int((time.time() - t0) * 1000),
+                          f"{len(failed)}/{len(tiles)} tiles failed, first: {failed[0][0]}: {failed[0][1][2]}")
+            else:
+                await asyncio.to_thread(stitch_outputs, utils_tile, tiles, tile_dir, width, height, output_path, overlap)
+                move_result = log_move_result(await asyncio.wrap_future(get_finalizer().submit(source_path, finish_path)))
+                span.mark("moved")
+                result = ("done", int((time.time() - t0) * 1000), "") if move_result.ok \
+                    else ("move_failed", int((time.time() - t0) * 1000), move_result.error)
+        except Exception as e:
+            result = ("failed", int((time.time() - t0) * 1000), f"Tiling failed: {e}")
+        finally:
+            await asyncio.to_thread(shutil.rmtree, tile_dir, True)
+        if result[0] != "done":
+            logger.error(f"Tiled job {result[0]}: {source_path} ({result[1]} ms): {result[2]}")
+        span.finish(result[0], result[2])
+        results[source_path] = result
+        if on_result is not None:
+            await asyncio.to_thread(on_result, source_path, result)
+    return results
+
+
+def split_cache_hits(jobs, cache: utils_cache.ResultCache, action_hash, ledger=None):
+    """
+    派发前查询输出缓存：全部输出（见 output_paths）都命中的任务直接物化输出并移动源文件，不再进入 Photoshop；
+    部分命中不物化任何输出，整体按未命中处理。
+    返回 (未命中的 jobs, 命中的 source_path 列表, {source_path: [(cache_key, output_path), ...]})，最后一项用于成功后入库。
+    每个输出以“后缀 + 扩展名”区分缓存键，只有一个输出时与单输出的键相同。
+    """
+    misses, hits, keys = [], [], {}
+    for source_path, output_path, finish_path in jobs:
+        # 台账中已有内容哈希时直接复用，避免重复读取输入
+        input_hash = (ledger.content_hash(source_path, action_hash) if ledger is not None else None) \
+            or utils_data.file_hash(source_path)
+        stem = Path(output_path).stem
+        outputs = [(utils_cache.cache_key(input_hash, action_hash, path.name[len(stem):]), path)
+                   for path in output_paths(output_path)]
+        if cache.get_all(outputs):
+            logger.info(f"Cache hit: {source_path} -> {output_path}")
+            finalize_move(source_path, finish_path)
+            hits.append(source_path)
+        else:
+            misses.append((source_path, output_path, finish_path))
+            keys[source_path] = outputs
+    return misses, hits, keys
+
+
 def do_work(file_path, output_path, finish_path):
     input_path = Path(file_path).expanduser().resolve()
     if not input_path.exists():
@@ -222,10 +1241,11 @@ def do_work(file_path, output_path, finish_path):
     else:
         output_path = input_path.with_name(input_path.stem + "_resized" + input_path.suffix)
 
-    photoshop_exe = Path(args.photoshop)
+    photoshop_exe = photoshop_exes[0]
 
+    span = start_span(input_path)
     try:
-        actions = build_actions_with_optional_resize_jsx(args.jsx_path)
+        temp_jsx = template_cache.job_jsx(args.jsx_path, photoshop_input(file_path), output_path)
     except FileNotFoundError as e:
         print("Error:", e, file=sys.stderr)
         sys.exit(1)
@@ -233,9 +1253,11 @@ def do_work(file_path, output_path, finish_path):
         print("Error building actions:", e, file=sys.stderr)
         sys.exit(1)
 
-    temp_jsx = get_jsx(actions, input_path)
+    span.mark("built")
+    clear_sentinels(output_path)
     build_and_run_jsx(temp_jsx, input_path, output_path, photoshop_exe)
-    poll_move(temp_jsx)
+    span.mark("dispatched")
+    return poll_move(temp_jsx, output_path, input_path, finish_path, span=span)
 
 
 if __name__ == "__main__":
@@ -243,18 +1265,225 @@ if __name__ == "__main__":
     parser.add_argument("--input", default=fr"{PATH}\tests\input", help="输入图片路径")
     parser.add_argument("--finish", default=fr"{PATH}\tests\finish", help="输出图片路径（可选）")
     parser.add_argument("--output", default=fr"{PATH}\tests\output", help="输出图片路径（可选）")
-    parser.add_argument("--photoshop", default=r"D:\03_software\adobe\photoshop\Adobe Photoshop 2023\Photoshop.exe", help="Photoshop.exe 路径")
+    parser.add_argument("--photoshop", default=r"D:\03_software\adobe\photoshop\Adobe Photoshop 2023\Photoshop.exe", help="Photoshop.exe 路径；--slots 并行时可逗号分隔多个独立实例，每个一个槽位")
     parser.add_argument("--jsx_path", default=fr"{PATH}\data\action\Real-Paint-FX-subject.jsx", help="可选：用本地 jsx 或 jsxbin 文件替换默认的 resize_half_action（文本 jsx 可使用 __INPUT__ / __OUTPUT__ 占位）")
+    parser.add_argument("--batch_size", type=int, default=0, help="批处理：每次启动 Photoshop 处理的图片数量，0 表示逐张启动")
+    parser.add_argument("--worker_spool", default="", help="常驻 worker 模式：spool 目录，worker 未运行时自动启动一次")
+    parser.add_argument("--stop_worker", action="store_true", help="常驻 worker 模式：处理完后通知 worker 退出")
+    parser.add_argument("--ledger", default="", help="任务台账 SQLite 路径：重启后只执行未完成/失败的任务")
+    parser.add_argument("--max_attempts", type=int, default=3, help="任务台账：单个任务最多尝试次数")
+    parser.add_argument("--ledger_report", action="store_true", help="任务台账：输出状态统计、每小时吞吐量与失败率后退出")
+    parser.add_argument("--cache_dir", default="", help="输出缓存目录：输入内容 + 动作脚本相同时直接复用历史输出，跳过 Photoshop")
+    parser.add_argument("--cache_max_gb", type=float, default=50.0, help="输出缓存：容量上限（GB），超出按 LRU 淘汰")
+    parser.add_argument("--cache_report", action="store_true", help="输出缓存：输出统计与最近条目后退出")
+    parser.add_argument("--cache_prune_days", type=float, default=None, help="输出缓存：删除指定天数未访问的条目并按容量淘汰后退出")
+    parser.add_argument("--daemon", action="store_true", help="热文件夹常驻模式：递归监听 --input，子目录结构同步到 --output/--finish，文件到达完毕即处理")
+    parser.add_argument("--settle_seconds", type=float, default=2.0, help="热文件夹：文件大小/修改时间保持不变多少秒后视为到达完毕")
+    parser.add_argument("--outputs", nargs="+", default=[], help="多输出：一次打开、一次滤镜保存多个规格，每项为 fmt[:quality=N][:max_side=N][:suffix=S]，第一项写入输出路径本身，如 quality=12 png jpg:quality=8:max_side=400:suffix=_thumb")
+    parser.add_argument("--prestage", action="store_true", help="Python 端预处理：解码、缩放、色彩模式与格式归一化后再交给 Photoshop（需 Pillow/NumPy），动作脚本中的缩放步骤需相应去掉")
+    parser.add_argument("--prestage_scale", type=float, default=1.0, help="预处理：缩放比例，如 0.5")
+    parser.add_argument("--prestage_max_side", type=int, default=0, help="预处理：最长边上限（像素），0 表示不限制")
+    parser.add_argument("--prestage_mode", default="RGB", help="预处理：色彩模式 RGB / L，空字符串表示保持原模式（高位深仍压到 8 位）")
+    parser.add_argument("--prestage_format", default="tif", choices=["tif", "jpg", "png"], help="预处理：中间文件格式，默认无压缩 TIFF")
+    parser.add_argument("--prestage_workers", type=int, default=None, help="预处理：进程数，默认 CPU 核数")
+    parser.add_argument("--tile_size", type=int, default=0, help="分块模式（配合 --slots）：超大图切成该边长的分块并行处理后羽化拼接，0 表示不启用")
+    parser.add_argument("--tile_overlap", type=int, default=128, help="分块模式：相邻分块的重叠像素（每侧），不超过 tile_size 的四分之一")
+    parser.add_argument("--tile_min_mp", type=float, default=100.0, help="分块模式：像素数（百万）不小于该值的图才分块")
+    parser.add_argument("--simulate", action="store_true", help="模拟后端：不启动 Photoshop，读取生成的 jsx 用 Pillow 做简单变换并写哨兵，用于在 Linux/CI 上测试与压测")
+    parser.add_argument("--sim_latency", default="0", help="模拟后端：每张图耗时（秒），可写区间如 0.2,0.5")
+    parser.add_argument("--sim_failure_rate", type=float, default=0.0, help="模拟后端：随机失败比例")
+    parser.add_argument("--sim_concurrency", type=int, default=4, help="模拟后端：同时运行的模拟 Photoshop 实例数")
+    parser.add_argument("--metrics_file", default="", help="指标：Prometheus 文本格式输出文件（如 node_exporter textfile collector 目录下的 reverie.prom）")
+    parser.add_argument("--metrics_port", type=int, default=0, help="指标：在该端口提供 /metrics HTTP 端点，0 表示不启用")
+    parser.add_argument("--metrics_interval", type=float, default=10.0, help="指标：写 --metrics_file 的最短间隔（秒），退出时总会写一次")
+    parser.add_argument("--span_log", default="", help="指标：每个任务的分阶段计时 span 另写入该 JSON Lines 文件")
+    parser.add_argument("--slots", type=int, default=0, help="异步流水线：执行槽位数，0 表示不启用；Photoshop 为单实例程序，直连时槽位数不超过 --photoshop 的实例数，配合 --worker_spool 时每个 spool 目录（逗号分隔）即一个槽位")
     args = parser.parse_args()
+    photoshop_exes = [Path(path.strip()) for path in args.photoshop.split(",") if path.strip()]
+    sim_instances = None
+
+    if args.simulate:
+        from reverie.utils import utils_simulate
+        latency = [float(value) for value in args.sim_latency.split(",")]
+        _backend = utils_simulate.SimulatedPhotoshop(latency=latency if len(latency) > 1 else latency[0],
+                                                     failure_rate=args.sim_failure_rate,
+                                                     concurrency=args.sim_concurrency)
+        sim_instances = args.sim_concurrency
+
+    if args.outputs:
+        # 需在编译动作模板之前设置；规格写入动作脚本，因此也体现在动作哈希中
+        _output_specs = [parse_output_spec(text, index) for index, text in enumerate(args.outputs)]
+
+    ledger = utils_ledger.JobLedger(args.ledger) if args.ledger else None
+    if ledger is not None and args.ledger_report:
+        print(json.dumps(ledger.summary(), ensure_ascii=False, indent=2))
+        sys.exit(0)
 
-    files = utils_data.find_file(args.input)
+    cache = utils_cache.ResultCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 1024 ** 3)) if args.cache_dir else None
+    if cache is not None and (args.cache_report or args.cache_prune_days is not None):
+        if args.cache_prune_days is not None:
+            print(f"Pruned {cache.prune(older_than_days=args.cache_prune_days)} cache entries")
+        print(json.dumps({"stats": cache.stats(), "recent": cache.entries(20)}, ensure_ascii=False, indent=2))
+        sys.exit(0)
+
+    if args.daemon:
+        files = []
+    else:
+        files = utils_data.find_file(args.input)
     # logger.info(files)
+    jobs = []
     for file in files:
-        source_path = Path(fr"{args.input}\{file}")  # 源文件
-        finish_path = Path(fr"{args.finish}\{file}")  # 目标路径
-        output_path = Path(fr"{args.output}\{file}")  # 目标路径
+        source_path = Path(args.input) / file  # 源文件
+        finish_path = Path(args.finish) / file  # 目标路径
+        output_path = Path(args.output) / file  # 目标路径
         if source_path.suffix.lower() in ['.jpg', '.png']:
-            print(file)
-            do_work(source_path, output_path, finish_path)
+            jobs.append((source_path, output_path, finish_path))
+
+    if args.prestage:
+        # Pillow/NumPy 仅在启用预处理时需要
+        from reverie.utils import utils_image
+        _prestage = utils_image.PreStage(scale=args.prestage_scale, max_side=args.prestage_max_side,
+                                         mode=args.prestage_mode, fmt=args.prestage_format,
+                                         workers=args.prestage_workers)
+
+    action_hash = template_cache.action_hash(args.jsx_path) if ledger is not None or cache is not None else ""
+    if action_hash and _prestage is not None:
+        # 预处理参数影响输出，计入动作哈希
+        action_hash = hashlib.sha1(f"{action_hash}:{_prestage.signature()}".encode("utf-8")).hexdigest()
+    if ledger is not None:
+        jobs = ledger.register(jobs, action_hash, max_attempts=args.max_attempts)
+        logger.info(f"Ledger: {len(jobs)} runnable jobs, status: {ledger.status_counts()}")
 
+    if args.metrics_file or args.metrics_port or args.span_log:
+        metrics = None
+        if args.metrics_file or args.metrics_port:
+            metrics = utils_metrics.Metrics(textfile=args.metrics_file or None, interval=args.metrics_interval)
+            if args.metrics_port:
+                metrics.serve(args.metrics_port)
+                logger.info(f"Serving metrics on :{args.metrics_port}/metrics")
+        if args.span_log:
+            utils_log.logger_config_spans(args.span_log)
+        _tracer = utils_metrics.Tracer(metrics, action_hash=action_hash or template_cache.action_hash(args.jsx_path))
+
+    cache_keys = {}
+    if cache is not None:
+        jobs, cache_hits, cache_keys = split_cache_hits(jobs, cache, action_hash, ledger)
+        logger.info(f"Cache: {len(cache_hits)} hits, {len(jobs)} jobs left")
+        if ledger is not None:
+            ledger.record_results({source_path: ("done", 0, "") for source_path in cache_hits}, action_hash)
+
+    def ledger_start(source_path):
+        if ledger is not None:
+            ledger.mark_started([(source_path,)], action_hash)
+
+    def on_job_result(source_path, result):
+        if _prestage is not None:
+            _prestage.release(source_path)
+        if ledger is not None:
+            ledger.record(source_path, action_hash, result)
+        if result[0] == "done" and source_path in cache_keys:
+            for key, output_path in cache_keys[source_path]:
+                cache.put(key, output_path)
+
+    def prestage_jobs(jobs):
+        """非流水线模式：派发前在进程池中并行预处理全部输入"""
+        if _prestage is None or not jobs:
+            return
+        t0 = time.time()
+        prepared, errors = _prestage.prepare_all([source_path for source_path, *_ in jobs])
+        for source_path, error in errors.items():
+            logger.error(f"Pre-stage failed, using original file: {source_path}: {error}")
+        logger.info(f"Pre-stage: {len(prepared)}/{len(jobs)} images in {time.time() - t0:.2f}s")
+
+    if args.daemon:
+        def make_job(rel_path):
+            # 子目录结构同步到 output / finish
+            job = (Path(args.input) / rel_path, Path(args.output) / rel_path, Path(args.finish) / rel_path)
+            job[1].parent.mkdir(parents=True, exist_ok=True)
+            runnable = [job]
+            if ledger is not None:
+                runnable = ledger.register(runnable, action_hash, max_attempts=args.max_attempts)
+            if cache is not None and runnable:
+                runnable, hits, keys = split_cache_hits(runnable, cache, action_hash, ledger)
+                cache_keys.update(keys)
+                if hits and ledger is not None:
+                    ledger.record(job[0], action_hash, ("done", 0, ""))
+            return runnable[0] if runnable else None
+
+        if args.worker_spool:
+            actions = template_cache.actions(args.jsx_path)
+            executors = []
+            for index, spool_dir in enumerate(args.worker_spool.split(",")):
+                channel = utils_spool.SpoolChannel(spool_dir)
+                start_worker(actions, channel, photoshop_exes[index % len(photoshop_exes)])
+                executors.append(SpoolExecutor(channel))
+            build = None
+        else:
+            executors = photoshop_executors(photoshop_exes, args.slots or len(photoshop_exes), instances=sim_instances)
+            build = functools.partial(template_cache.job_jsx, args.jsx_path)
+        try:
+            asyncio.run(run_daemon(args.input, make_job, executors, build=build, on_start=ledger_start,
+                                   on_result=on_job_result, settle_seconds=args.settle_seconds))
+        except KeyboardInterrupt:
+            print("Hot folder daemon stopped.", file=sys.stderr)
+    elif args.batch_size > 0 or args.worker_spool or args.slots > 0:
+        try:
+            actions = template_cache.actions(args.jsx_path)
+        except Exception as e:
+            print("Error building actions:", e, file=sys.stderr)
+            sys.exit(1)
+        Path(args.output).mkdir(parents=True, exist_ok=True)
+        if args.slots > 0:
+            if args.worker_spool:
+                executors = []
+                for index, spool_dir in enumerate(args.worker_spool.split(",")):
+                    channel = utils_spool.SpoolChannel(spool_dir)
+                    start_worker(actions, channel, photoshop_exes[index % len(photoshop_exes)])
+                    executors.append(SpoolExecutor(channel))
+                build = None
+            else:
+                executors = photoshop_executors(photoshop_exes, args.slots, instances=sim_instances)
+                build = functools.partial(template_cache.job_jsx, args.jsx_path)
+            tiled_jobs = []
+            if args.tile_size > 0:
+                tiled_jobs = [job for job in jobs if image_pixels(job[0]) >= args.tile_min_mp * 1e6]
+                jobs = [job for job in jobs if job not in tiled_jobs]
+            asyncio.run(run_pipeline(jobs, executors, build=build, on_start=ledger_start, on_result=on_job_result))
+            if tiled_jobs:
+                asyncio.run(run_tiled(tiled_jobs, executors, build=build, tile_size=args.tile_size,
+                                      overlap=args.tile_overlap, on_start=ledger_start, on_result=on_job_result))
+            if args.worker_spool and args.stop_worker:
+                for executor in executors:
+                    executor.channel.stop_worker()
+        else:
+            prestage_jobs(jobs)
+            # 批处理/常驻 worker 在一次调用中跑完全部任务，台账按整体登记开始与结果
+            if ledger is not None:
+                ledger.mark_started(jobs, action_hash)
+            if args.worker_spool:
+                channel = utils_spool.SpoolChannel(args.worker_spool)
+                start_worker(actions, channel, photoshop_exes[0])
+                results = run_worker_jobs(jobs, channel)
+                if args.stop_worker:
+                    channel.stop_worker()
+            else:
+                results = run_batch(jobs, photoshop_exes[0], actions, chunk_size=args.batch_size)
+            for source_path, result in results.items():
+                on_job_result(source_path, result)
+    else:
+        prestage_jobs(jobs)
+        for source_path, output_path, finish_path in jobs:
+            print(source_path.name)
+            ledger_start(source_path)
+            on_job_result(source_path, do_work(source_path, output_path, finish_path) or ("timeout", 0, ""))
 
+    if _prestage is not None:
+        _prestage.shutdown()
+    if _backend is not None:
+        _backend.shutdown()
+    if _finalizer is not None:
+        _finalizer.shutdown(wait=True)
+        logger.info(f"Finalize summary: {_finalizer.summary()}")
+    if _tracer is not None and _tracer.metrics is not None:
+        # 在 finalizer 之后：移动完成回调中结束的 span 已计入
+        _tracer.metrics.shutdown()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/1/26 09:48
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_cache.py
+@Description: 内容寻址的输出缓存
+
+键 = sha1(输入文件内容哈希 + 编译后动作脚本哈希 + 输出后缀)。动作脚本中已包含保存选项（格式、质量），
+所以同一张图、同一套动作、同一种输出格式必然得到同一个结果，命中时直接物化输出，完全跳过 Photoshop。
+
+目录结构：
+cache_dir/
+    index.sqlite                索引：key、大小、创建时间、最近访问时间
+    objects/ab/<key><suffix>    缓存的输出文件
+
+物化/入库一律复制到临时文件再 os.replace：缓存对象与输出文件互不共享数据，输出被原地覆盖时缓存不受影响。
+总大小超过 max_bytes 时按最近访问时间（LRU）淘汰。
+"""
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key          TEXT PRIMARY KEY,
+    suffix       TEXT,
+    size         INTEGER NOT NULL,
+    created_at   REAL,
+    last_access  REAL,
+    hits         INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+"""
+
+
+def cache_key(input_hash, action_hash, output_suffix):
+    return hashlib.sha1(f"{input_hash}:{action_hash}:{output_suffix.lower()}".encode("utf-8")).hexdigest()
+
+
+def copy_atomic(source_path, target_path):
+    """复制到同目录临时文件再 os.replace；不用硬链接，避免输出与缓存对象共享 inode"""
+    target_path = Path(target_path)
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target_path.with_name(f".{target_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+class ResultCache:
+    """
+    用法：
+        cache = ResultCache(cache_dir, max_bytes=50 * 1024 ** 3)
+        key = cache_key(input_hash, action_hash, output_path.suffix)
+        if not cache.get(key, output_path):
+            ... 执行 ...
+            cache.put(key, output_path)
+    """
+    def __init__(self, cache_dir, max_bytes=50 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.objects_dir = self.cache_dir / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._conn = sqlite3.connect(str(self.cache_dir / "index.sqlite"), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def object_path(self, key, suffix):
+        return self.objects_dir / key[:2] / f"{key}{suffix.lower()}"
+
+    def get(self, key, output_path):
+        """命中时把缓存对象物化到 output_path 并返回 True"""
+        with self._lock:
+            row = self._conn.execute("SELECT suffix FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        object_path = self.object_path(key, row[0])
+        if not object_path.exists():
+            # 对象被外部删除，索引失效
+            with self._lock:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return False
+        copy_atomic(object_path, output_path)
+        with self._lock:
+            self._conn.execute("UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return True
+
+    def contains(self, key):
+        """只读查询：索引中有该键且对象文件存在；不物化、不更新访问时间"""
+        with self._lock:
+            row = self._conn.execute("SELECT suffix FROM entries WHERE key = ?", (key,)).fetchone()
+        return row is not None and self.object_path(key, row[0]).exists()
+
+    def get_all(self, outputs):
+        """
+        多输出任务：outputs 为 [(key, output_path), ...]，全部命中时才物化并返回 True。
+        先逐个 contains 确认，部分命中时输出目录不留下任何文件；物化过程中对象被淘汰时删除已物化的输出。
+        """
+        if not all(self.contains(key) for key, _ in outputs):
+            return False
+        materialized = []
+        for key, output_path in outputs:
+            if not self.get(key, output_path):
+                for path in materialized:
+                    Path(path).unlink(missing_ok=True)
+                return False
+            materialized.append(output_path)
+        return True
+
+    def put(self, key, output_path):
+        """把成功的输出入库，随后按容量上限淘汰"""
+        output_path = Path(output_path)
+        suffix = output_path.suffix.lower()
+        object_path = self.object_path(key, suffix)
+        copy_atomic(output_path, object_path)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries (key, suffix, size, created_at, last_access) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET size = excluded.size, last_access = excluded.last_access",
+                (key, suffix, object_path.stat().st_size, now, now))
+        self.evict()
+
+    def total_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self, max_bytes=None):
+        """按 LRU 淘汰直到总大小不超过 max_bytes，返回淘汰的条目数"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total = self.total_bytes()
+        if total <= max_bytes:
+            return 0
+        removed = 0
+        with self._lock:
+            rows = self._conn.execute("SELECT key, suffix, size FROM entries ORDER BY last_access").fetchall()
+            for key, suffix, size in rows:
+                if total <= max_bytes:
+                    break
+                self.object_path(key, suffix).unlink(missing_ok=True)
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def prune(self, max_bytes=None, older_than_days=None):
+        """清理：先删除 older_than_days 天未访问的条目，再按容量淘汰"""
+        removed = 0
+        if older_than_days is not None:
+            since = time.time() - older_than_days * 86400
+            with self._lock:
+                rows = self._conn.execute("SELECT key, suffix FROM entries WHERE last_access < ?", (since,)).fetchall()
+                for key, suffix in rows:
+                    self.object_path(key, suffix).unlink(missing_ok=True)
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            removed += len(rows)
+        return removed + self.evict(max_bytes)
+
+    def stats(self):
+        with self._lock:
+            entries, total, hits = self._conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0), coalesce(sum(hits), 0) FROM entries").fetchone()
+        return {"entries": entries, "total_bytes": total, "max_bytes": self.max_bytes, "hits": hits}
+
+    def entries(self, limit=100):
+        """按最近访问时间倒序列出条目：[(key, suffix, size, created_at, last_access, hits), ...]"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, suffix, size, created_at, last_access, hits FROM entries "
+                "ORDER BY last_access DESC LIMIT ?", (limit,)).fetchall()
@@ -7,7 +7,12 @@
 @Description: 数据/文件管理
 """
 import os
+import time
 import shutil
+import hashlib
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 
 def find_file(path):
@@ -20,17 +25,153 @@ def find_file(path):
 
 
 def move(source_path, target_path):
+    """
+    功能：移动单个文件（兼容旧调用，打印结果）；需要结构化结果请用 move_file / Finalizer
+    """
+    if not os.path.exists(source_path):  # 先检查源文件是否存在
+        print(f"源文件不存在：{source_path}")
+        return
+    result = move_file(source_path, target_path)
+    if result.ok:
+        print(f"文件移动成功：{source_path} -> {target_path}")
+    else:
+        print(f"文件移动失败：{result.error}")
+
+
+MoveResult = namedtuple("MoveResult", ["source", "target", "ok", "method", "size", "seconds", "error"])
+
+
+def same_device(source_path, target_dir):
+    """源文件与目标目录是否在同一设备/卷上（同一卷内可用 os.replace 原子改名）"""
     try:
-        # 检查目标文件夹是否存在，不存在则创建
-        target_dir = os.path.dirname(target_path)
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
+        return os.stat(source_path).st_dev == os.stat(target_dir).st_dev
+    except OSError:
+        return False
+
 
-        # 移动文件
-        if os.path.exists(source_path):  # 先检查源文件是否存在
-            shutil.move(source_path, target_path)
-            print(f"文件移动成功：{source_path} -> {target_path}")
+def move_file(source_path, target_path, verify="size", made_dirs=None):
+    """
+    功能：移动单个文件并返回 MoveResult，不打印
+    - 同一设备：os.replace，原子且不拷贝数据
+    - 跨设备：先复制到 target.part，按 verify（"size" / "sha1" / None）校验后再 os.replace 到目标并删除源文件，
+      任一步失败都不会留下半个目标文件，源文件也保持不动
+    made_dirs 为已创建目录的集合，批量调用时用于避免重复 makedirs
+    """
+    source_path, target_path = os.fspath(source_path), os.fspath(target_path)
+    t0 = time.time()
+    part_path = target_path + ".part"
+    method = "replace"
+    try:
+        target_dir = os.path.dirname(target_path)
+        if made_dirs is None or target_dir not in made_dirs:
+            os.makedirs(target_dir, exist_ok=True)
+            if made_dirs is not None:
+                made_dirs.add(target_dir)
+        size = os.path.getsize(source_path)
+        if same_device(source_path, target_dir):
+            os.replace(source_path, target_path)
         else:
-            print(f"源文件不存在：{source_path}")
+            method = "copy"
+            shutil.copy2(source_path, part_path)
+            if verify and os.path.getsize(part_path) != size:
+                raise IOError(f"size mismatch after copy: {os.path.getsize(part_path)} != {size}")
+            if verify == "sha1" and file_hash(part_path) != file_hash(source_path):
+                raise IOError("checksum mismatch after copy")
+            os.replace(part_path, target_path)
+            os.remove(source_path)
+        return MoveResult(source_path, target_path, True, method, size, time.time() - t0, "")
     except Exception as e:
-        print(f"文件移动失败：{e}")
\ No newline at end of file
+        if method == "copy" and os.path.exists(part_path):
+            os.remove(part_path)
+        return MoveResult(source_path, target_path, False, method, 0, time.time() - t0, str(e))
+
+
+class Finalizer:
+    """
+    finalize 阶段：在线程池中并发移动文件，等待/调度线程不再被跨盘复制阻塞。
+    - submit 逐个提交，任务完成即移动，不等整批结束
+    - prepare_dirs 在批次开始时一次性创建整批的目标目录，移动时不再逐个 makedirs；
+      已创建的目录会被记住，同一目录只 makedirs 一次
+    - summary() 返回累计的移动/复制/失败数量与字节数
+    """
+    def __init__(self, workers=8, verify="size"):
+        self.verify = verify
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Finalizer")
+        self._made_dirs = set()
+        self._lock = threading.Lock()
+        self._summary = {"replace": 0, "copy": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+
+    def _move(self, source_path, target_path):
+        result = move_file(source_path, target_path, verify=self.verify, made_dirs=self._made_dirs)
+        with self._lock:
+            self._summary["failed" if not result.ok else result.method] += 1
+            self._summary["bytes"] += result.size
+            self._summary["seconds"] += result.seconds
+        return result
+
+    def prepare_dirs(self, target_paths):
+        """按去重后的目录批量创建 target_paths 的父目录，返回新建的目录数；失败的目录留给移动时重试并报告"""
+        target_dirs = {os.path.dirname(os.fspath(target_path)) for target_path in target_paths} - self._made_dirs
+        created = 0
+        for target_dir in target_dirs:
+            try:
+                os.makedirs(target_dir, exist_ok=True)
+            except OSError:
+                continue
+            self._made_dirs.add(target_dir)
+            created += 1
+        return created
+
+    def submit(self, source_path, target_path):
+        """异步移动单个文件，返回 concurrent.futures.Future[MoveResult]"""
+        return self._pool.submit(self._move, source_path, target_path)
+
+    def summary(self):
+        with self._lock:
+            return dict(self._summary)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def file_hash(path, algorithm="sha1", chunk_size=1024 * 1024):
+    """
+    功能：分块计算文件内容哈希，避免一次性读入大文件
+    输出：十六进制摘要
+    """
+    digest = hashlib.new(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_files(path, suffixes=None):
+    """
+    功能：递归扫描目录下的所有文件（os.scandir，直接复用目录项自带的 stat 信息，Windows 下无需额外系统调用）
+    输入：suffixes 为小写后缀元组，如 ('.jpg', '.png')，None 表示不过滤
+    输出：生成器，逐个产出 (相对路径, size, mtime_ns)
+    """
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            iterator = os.scandir(os.path.join(path, rel_dir))
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            continue
+        with iterator:
+            for entry in iterator:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(rel_path)
+                        continue
+                    if not entry.is_file():
+                        continue
+                    if suffixes and os.path.splitext(entry.name)[1].lower() not in suffixes:
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # 扫描过程中被移走
+                    continue
+                yield rel_path, stat.st_size, stat.st_mtime_ns
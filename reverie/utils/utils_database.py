@@ -19,41 +19,233 @@ CREATE INDEX idx_alpha101_date_code ON dwd_technical_stock_incr_alpha101 (primar
 CREATE INDEX idx_alpha158_date_code ON dwd_technical_stock_incr_alpha158 (primary_key);   50秒
 DROP INDEX IF EXISTS dwd_technical_stock_incr_alpha101_primary_key_idx;
 DROP INDEX IF EXISTS dwd_technical_stock_incr_alpha158_primary_key_idx;
+
+engine 注册表（get_engine）：
+进程内按 (数据库类型, URL) 缓存 engine，engine_conn / table_exists / drop_table 等反复调用共用同一个连接池，
+不再每次调用都重新建立 TCP 连接、认证和连接池。
+- 连接池参数：默认值见 POOL_OPTIONS，可在 settings 中按类型覆盖（如 POSTGRES_POOL_SIZE、POSTGRES_POOL_RECYCLE），
+  也可在 get_engine 中显式传入
+- fork 安全：子进程（multiprocessing worker）继承的连接不能与父进程共用，fork 后在子进程中
+  dispose(close=False) 丢弃继承的连接池（不关闭父进程仍在使用的 socket），子进程首次使用时重新建池
+- 连接池统计：checkout/checkin/新建/失效次数、取连接的等待时间与超时次数，见 pool_stats
+
+批量写入（copy_dataframe）：
+按 chunk_rows 分块编码后经 psycopg2 copy_expert 流式送入 COPY ... FROM STDIN，不落临时文件，数据库服务器也无需访问本机磁盘；
+内存峰值只与单个分块的编码结果有关。
+- csv（默认）：DataFrame.to_csv 整块编码，NULL 为 \\N
+- binary：COPY BINARY 格式，按目标表的列类型整列编码（int2/int4/int8/float4/float8/bool/date/timestamp/text），
+  再按行偏移用 NumPy 一次性散布到输出缓冲；numeric 等其他类型不支持，需用 csv
+
+增量写入（upsert_dataframe）：
+替代每次写入后对整张 dwd_* 表做 ROW_NUMBER() 去重（remove_duplicate_rows）：批次在 pandas 中按主键去重（保留最后一行），
+COPY 进事务内的临时暂存表，再 INSERT ... ON CONFLICT (主键) DO UPDATE 合并进目标表，依赖主键上的唯一索引。
+写入成本只与批次大小有关，与历史数据量无关；值未变化的行不做 UPDATE，避免无谓的行版本与 WAL。
+
+流式读取（read_chunks / read_to_parquet）：
+替代对整张表 pd.read_sql：命名（服务端）游标按 fetch_size 从服务端拉取，每 chunk_rows 行产出一个分块，
+只 SELECT 需要的列，过滤条件（如 full_code）下推到 SQL；分块的列类型由结果集的列类型决定，各分块一致。
+read_to_parquet 把分块直接写成按列分区的 Parquet 数据集（需 pyarrow），内存占用与表大小无关。
+
+水位线（WatermarkRegistry）：
+增量加载的起点记录在元数据表 etl_watermark（表名, 字段, 键, 水位）中，键可为空（整表）或如 full_code 的分组值。
+copy_dataframe / upsert_dataframe 传入 watermark 时，在写入数据的同一事务中推进水位（只增不减），提交后更新进程内缓存；
+database_maximum_date 由此 O(1) 得到起始日期，不再每次 SELECT max() 扫表；查询失败直接抛出，不再回退到 1990-01-01 触发全量重载。
 """
+import io
 import os
+import json
+import time
+import itertools
+import threading
 from urllib import parse
 from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import create_engine, event, exc, inspect, text
 import psycopg2
 #import logger
+import numpy as np
 import pandas as pd
 
 from reverie.settings import PATH
 from reverie import settings
-from reverie.utils import utils_log, utils_database
+from reverie.utils import utils_log
 
 log_filename = os.path.splitext(os.path.basename(__file__))[0]
 logger = utils_log.logger_config_local(f'{PATH}/log/{log_filename}.log')
 
+# 连接池默认参数；settings 中的 {数据库类型}_{参数名大写}（如 POSTGRES_POOL_SIZE）优先
+POOL_OPTIONS = {
+    "pool_size": 5,         # 常驻连接数
+    "max_overflow": 10,     # 高峰时允许额外创建的连接数
+    "pool_timeout": 30,     # 连接全部占用时等待的秒数，超时抛出 sqlalchemy.exc.TimeoutError
+    "pool_recycle": 1800,   # 连接存活超过该秒数后重建，避免被服务端/防火墙断开的空闲连接
+    "pool_pre_ping": True,  # checkout 前先 ping，自动替换已断开的连接
+}
+
+_engines = {}  # (database_type, db_url) -> engine
+_pool_stats = {}  # id(engine) -> PoolStats，按 engine 直接查找，不必遍历 _engines
+_engines_lock = threading.Lock()
+_engines_pid = os.getpid()
+
+
+class PoolStats:
+    """单个 engine 的连接池统计，由 pool 事件与 DatabaseConnection 更新"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0        # 新建的 DBAPI 连接
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0        # 等待连接超时
+        self.wait_seconds = 0.0  # 取连接的累计等待时间（含新建连接）
+        self.wait_max = 0.0
+        self.waits = 0
+
+    def record_wait(self, seconds):
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def incr(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self.lock:
+            return {"connects": self.connects, "checkouts": self.checkouts, "checkins": self.checkins,
+                    "invalidations": self.invalidations, "timeouts": self.timeouts,
+                    "wait_avg_ms": round(self.wait_seconds / self.waits * 1000, 3) if self.waits else 0.0,
+                    "wait_max_ms": round(self.wait_max * 1000, 3)}
+
+
+def pool_options(database_type, **overrides):
+    """连接池参数：POOL_OPTIONS < settings 中的 {database_type}_{NAME} < overrides"""
+    options = {name: getattr(settings, f"{database_type}_{name.upper()}", value) for name, value in POOL_OPTIONS.items()}
+    options.update(overrides)
+    return options
+
+
+def _reset_after_fork():
+    """子进程中丢弃继承的连接池：dispose(close=False) 不会关闭父进程仍在使用的连接"""
+    global _engines_pid
+    with _engines_lock:
+        if _engines_pid == os.getpid():
+            return
+        for engine in _engines.values():
+            engine.dispose(close=False)
+        _engines.clear()
+        _pool_stats.clear()
+        # 水位缓存绑定在父进程的 engine 上
+        _watermark_registries.clear()
+        _engines_pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    # 注册表的锁可能在 fork 时被其他线程持有，子进程中换一把新锁再清理
+    def _after_fork_in_child():
+        global _engines_lock
+        _engines_lock = threading.Lock()
+        _reset_after_fork()
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def _attach_pool_stats(engine, stats):
+    event.listen(engine, "connect", lambda *args: stats.incr("connects"))
+    event.listen(engine, "checkout", lambda *args: stats.incr("checkouts"))
+    event.listen(engine, "checkin", lambda *args: stats.incr("checkins"))
+    event.listen(engine, "invalidate", lambda *args: stats.incr("invalidations"))
+
+
+def get_engine(database_type="POSTGRES", db_url=None, **options):
+    """
+    返回进程内共享的 engine，按 (database_type, db_url) 缓存；首次创建时使用 pool_options 的参数。
+    db_url 为空时由 engine_url(database_type) 生成。
+    """
+    if _engines_pid != os.getpid():
+        # 非 fork 方式（或 register_at_fork 不可用）进入子进程时的兜底
+        _reset_after_fork()
+    db_url = db_url or engine_url(database_type)
+    key = (database_type, db_url)
+    engine = _engines.get(key)
+    if engine is not None:
+        return engine
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_engine(db_url, **pool_options(database_type, **options))
+            stats = _pool_stats[id(engine)] = PoolStats()
+            _attach_pool_stats(engine, stats)
+            _engines[key] = engine
+            logger.info(f"Created engine for {database_type or engine.url.get_backend_name()}: "
+                        f"{engine.url.render_as_string(hide_password=True)}")
+    return engine
+
+
+def _stats_for(engine):
+    # 单次 dict 查找无需加锁；已被 dispose_engines 移除的 engine 返回 None
+    return _pool_stats.get(id(engine))
+
+
+def pool_stats(database_type=None):
+    """各 engine 的连接池统计：事件计数、等待时间，以及当前 checkedout / overflow / 空闲连接数"""
+    result = {}
+    with _engines_lock:
+        items = list(_engines.items())
+    for (db_type, db_url), engine in items:
+        if database_type is not None and db_type != database_type:
+            continue
+        stats = _stats_for(engine)
+        if stats is None:  # 快照之后已被 dispose_engines 移除
+            continue
+        pool = engine.pool
+        stats = stats.to_dict()
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        result[f"{db_type}:{engine.url.render_as_string(hide_password=True)}"] = stats
+    return result
+
+
+def dispose_engines():
+    """关闭并移除全部缓存的 engine（如进程退出前、数据库切换后）"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _pool_stats.clear()
+
+
 class DatabaseConnection:
-    def __init__(self, db_url):
-        self.engine = create_engine(db_url)
+    def __init__(self, db_url, database_type=""):
+        self.engine = get_engine(database_type, db_url)
+        self.conn = None
 
     def __enter__(self):
-        self.conn = self.engine.connect()
+        stats = _stats_for(self.engine)
+        t0 = time.perf_counter()
+        try:
+            self.conn = self.engine.connect()
+        except exc.TimeoutError:
+            if stats is not None:
+                stats.incr("timeouts")
+            raise
+        if stats is not None:
+            stats.record_wait(time.perf_counter() - t0)
         return self.conn
 
     def __exit__(self, exc_type, exc_value, traceback):
         if self.conn:
             self.conn.close()
 
-    def _generate_create_table_sql(self, data_df, table_name):
+    @staticmethod
+    def _generate_create_table_sql(data_df, table_name):
         # 生成 CREATE TABLE 语句，基于 DataFrame 的列名和数据类型
         columns = []
         for col, dtype in data_df.dtypes.items():
             if pd.api.types.is_integer_dtype(dtype):
-                sql_type = 'INTEGER'
+                # int64/uint32 的取值范围超出 INTEGER（如成交量 volume），按 BIGINT 建列
+                sql_type = 'INTEGER' if np.can_cast(getattr(dtype, "numpy_dtype", dtype), np.int32) else 'BIGINT'
             elif pd.api.types.is_float_dtype(dtype):
                 sql_type = 'FLOAT'
             elif pd.api.types.is_datetime64_any_dtype(dtype):
@@ -66,47 +258,492 @@ class DatabaseConnection:
         create_table_sql = f"CREATE TABLE IF NOT EXISTS {table_name} ({columns_sql});"
         return create_table_sql
     
-    def large_data_output_database(self, data_df, table_name):
+    def large_data_output_database(self, data_df, table_name, fmt="csv", chunk_rows=100_000, primary_key=None,
+                                   watermark=None):
+        """
+        建表（如不存在）后以 COPY FROM STDIN 流式写入，见 copy_dataframe；
+        给出 primary_key 时改为按主键合并（见 upsert_dataframe），写入后无需再 remove_duplicate_rows；
+        watermark 见 WatermarkRegistry
+        """
         # 1. 添加时间戳
         data_df['insert_timestamp'] = datetime.now().strftime("%F %T")
-        
-        # 2. 动态创建表的 SQL 语句
-        create_table_sql = self._generate_create_table_sql(data_df, table_name)
-        with self.conn.engine.connect() as connection:
-            connection.execute(create_table_sql)
-        
-        # 3. 将 DataFrame 写入 CSV 文件
-        csv_file = f'{PATH}/cache/{table_name}.csv'
-        data_df.to_csv(csv_file, index=False, sep='\t')
 
-        # 4. 使用 COPY 命令将数据导入 PostgreSQL
-        with self.conn.engine.raw_connection() as raw_conn:
+        # 2. 建表并流式 COPY，不再经过 {PATH}/cache 下的临时 CSV
+        if primary_key:
+            return upsert_dataframe(data_df, table_name, primary_key, fmt=fmt, chunk_rows=chunk_rows, engine=self.engine,
+                                    watermark=watermark)
+        return copy_dataframe(data_df, table_name, fmt=fmt, chunk_rows=chunk_rows, engine=self.engine,
+                              watermark=watermark)
+
+
+# COPY BINARY：文件头（签名 + flags + 扩展区长度）与结束标记
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + np.array([0, 0], dtype=">i4").tobytes()
+PGCOPY_TRAILER = np.array([-1], dtype=">i2").tobytes()
+PG_EPOCH = np.datetime64("2000-01-01T00:00:00", "us")
+# 目标列类型 -> 大端定长表示；TEXT_TYPES 的值为 UTF-8 字节，长度可变
+BINARY_TYPES = {"smallint": ">i2", "integer": ">i4", "bigint": ">i8", "real": ">f4", "double precision": ">f8",
+                "boolean": "?", "date": ">i4",
+                "timestamp without time zone": ">i8", "timestamp with time zone": ">i8"}
+TEXT_TYPES = ("text", "character varying", "character")
+
+
+class ChunkStream(io.RawIOBase):
+    """把逐块产生的 bytes 包装成可读文件，供 copy_expert 按需拉取；同一时刻只持有当前分块"""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._offset >= len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._buffer, self._offset = memoryview(chunk), 0
+        size = min(len(b), len(self._buffer) - self._offset)
+        b[:size] = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+
+def iter_csv_chunks(data_df, chunk_rows=100_000):
+    """逐块编码为 COPY csv 格式（无表头，NULL 为 \\N）"""
+    for start in range(0, len(data_df), chunk_rows):
+        yield data_df.iloc[start:start + chunk_rows].to_csv(index=False, header=False, na_rep="\\N").encode("utf-8")
+
+
+def _lossless_cast(values, pg_type, column):
+    """
+    转为目标列的大端定长表示；不能无损表示的值（超出范围、带小数、NaN/inf、非 0/1 的布尔）抛出 ValueError，
+    与 csv COPY 由服务端拒绝这些行的行为一致，而不是像 astype 那样静默溢出或截断
+    """
+    target = np.dtype(BINARY_TYPES[pg_type])
+    if values.dtype == object:
+        # 可空整数等扩展类型去掉空值后仍可能是 object
+        values = np.asarray(values.tolist())
+    if values.dtype.kind not in "biuf":
+        raise ValueError(f"Column {column!r}: {values.dtype} values cannot be encoded as {pg_type}")
+    with np.errstate(invalid="ignore", over="ignore"):
+        if target.kind == "i":
+            bad = np.zeros(len(values), dtype=bool)
+            if values.dtype.kind == "f":
+                bad = ~np.isfinite(values) | (values != np.trunc(values))
+            bound = 2 ** (target.itemsize * 8 - 1)
+            # 上界用 >= 2^(n-1) 比较：float 表示不了 2^63 - 1
+            bad |= (values < -bound) | (values >= bound)
+        elif target.kind == "b":
+            bad = ~np.isin(values, (0, 1)) if values.dtype.kind != "b" else np.zeros(len(values), dtype=bool)
+        else:
+            bad = np.isfinite(values) & ~np.isfinite(values.astype(target))
+    if bad.any():
+        raise ValueError(f"Column {column!r}: {int(bad.sum())} values cannot be stored losslessly as {pg_type}, "
+                         f"e.g. {values[bad][0]!r}; fix the data or use fmt='csv'")
+    return values.astype(target)
+
+
+def _binary_cells(series, pg_type):
+    """单列编码为 (每行值的字节数（空值为 -1）, 全部非空值拼接的字节)"""
+    nulls = series.isna().to_numpy()
+    if pg_type in TEXT_TYPES:
+        encoded = [value.encode("utf-8") for value in series[~nulls].astype(str)]
+        lengths = np.full(len(series), -1, dtype=np.int64)
+        lengths[~nulls] = [len(value) for value in encoded]
+        return lengths, np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+    if pg_type == "date" or pg_type.startswith("timestamp"):
+        values = pd.to_datetime(series)
+        if values.dt.tz is not None:
+            values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+        unit = "D" if pg_type == "date" else "us"
+        offsets = values[~nulls].to_numpy(dtype=f"datetime64[{unit}]") - PG_EPOCH.astype(f"datetime64[{unit}]")
+        values = offsets.astype(np.int64).astype(BINARY_TYPES[pg_type])
+    else:
+        values = _lossless_cast(series[~nulls].to_numpy(), pg_type, series.name)
+    size = values.dtype.itemsize
+    return np.where(nulls, -1, size).astype(np.int64), values.view(np.uint8).ravel()
+
+
+def _scatter(out, starts, lengths, data):
+    """把 data 中按 lengths 依次排列的各段写入 out[starts[i]:starts[i] + lengths[i]]"""
+    if not len(data):
+        return
+    source_starts = np.cumsum(lengths) - lengths
+    out[np.repeat(starts - source_starts, lengths) + np.arange(len(data))] = data
+
+
+def encode_binary_rows(chunk, column_types):
+    """一个分块编码为 COPY BINARY 的行：int16 字段数 + 每个字段 (int32 长度, 值)，空值长度为 -1 且没有值字节"""
+    cells = [_binary_cells(chunk[column], pg_type) for column, pg_type in zip(chunk.columns, column_types)]
+    row_sizes = 2 + sum(4 + np.maximum(lengths, 0) for lengths, _ in cells)
+    row_starts = np.cumsum(row_sizes) - row_sizes
+    out = np.empty(int(row_sizes.sum()), dtype=np.uint8)
+    field_count = np.array([len(cells)], dtype=">i2").view(np.uint8)
+    out[row_starts[:, None] + np.arange(2)] = field_count
+    position = row_starts + 2
+    for lengths, data in cells:
+        out[position[:, None] + np.arange(4)] = lengths.astype(">i4").view(np.uint8).reshape(-1, 4)
+        position = position + 4
+        present = lengths > 0
+        _scatter(out, position[present], lengths[present], data)
+        position = position + np.maximum(lengths, 0)
+    return out.tobytes()
+
+
+def iter_binary_chunks(data_df, column_types, chunk_rows=100_000):
+    """
+    逐块编码为 COPY BINARY 格式。column_types 为与 data_df 列一一对应的目标列类型（information_schema 的 data_type）。
+    各列整列编码后按行偏移一次性散布到输出缓冲，不逐行拼接。
+    """
+    unsupported = {column: pg_type for column, pg_type in zip(data_df.columns, column_types)
+                   if pg_type not in BINARY_TYPES and pg_type not in TEXT_TYPES}
+    if unsupported:
+        raise ValueError(f"Binary COPY does not support column types {unsupported}, use fmt='csv'")
+    yield PGCOPY_HEADER
+    for start in range(0, len(data_df), chunk_rows):
+        yield encode_binary_rows(data_df.iloc[start:start + chunk_rows], column_types)
+    yield PGCOPY_TRAILER
+
+
+def table_column_types(cursor, table_name, columns):
+    """查询目标表各列的 data_type，顺序与 columns 一致"""
+    schema, _, name = table_name.rpartition(".")
+    cursor.execute("SELECT column_name, data_type FROM information_schema.columns "
+                   "WHERE table_name = %s AND table_schema = COALESCE(NULLIF(%s, ''), current_schema())",
+                   (name, schema))
+    types = dict(cursor.fetchall())
+    missing = [column for column in columns if str(column).lower() not in types]
+    if missing:
+        raise ValueError(f"Columns not found in {table_name}: {missing}")
+    return [types[str(column).lower()] for column in columns]
+
+
+def copy_to_cursor(cursor, data_df, table_name, fmt="csv", chunk_rows=100_000, buffer_size=1 << 20):
+    """在已有游标（事务由调用方控制）上把 data_df 流式 COPY 进 table_name，返回写入行数"""
+    columns = ", ".join(str(column) for column in data_df.columns)
+    if fmt == "binary":
+        chunks = iter_binary_chunks(data_df, table_column_types(cursor, table_name, data_df.columns), chunk_rows)
+        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT binary)"
+    elif fmt == "csv":
+        chunks = iter_csv_chunks(data_df, chunk_rows)
+        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    else:
+        raise ValueError(f"Unsupported COPY format: {fmt}")
+    cursor.copy_expert(sql, ChunkStream(chunks), size=buffer_size)
+    return len(data_df)
+
+
+def copy_dataframe(data_df, table_name, database_type="POSTGRES", fmt="csv", chunk_rows=100_000, create_table=True,
+                   engine=None, watermark=None):
+    """
+    把 data_df 以 COPY FROM STDIN 流式写入 table_name（一个事务，失败整体回滚），返回写入行数。
+    create_table 为 True 时先按 DataFrame 的列类型建表（如不存在）。
+    watermark 为字段名或 (字段名, 键列名)，在同一事务中按本批最大值推进水位线，见 WatermarkRegistry。
+    """
+    engine = engine or get_engine(database_type)
+    registry = get_watermarks(engine=engine) if watermark else None
+    t0 = time.time()
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        if create_table:
+            cursor.execute(DatabaseConnection._generate_create_table_sql(data_df, table_name))
+        rows = copy_to_cursor(cursor, data_df, table_name, fmt, chunk_rows)
+        marks = registry.advance(cursor, table_name, data_df, *_watermark_args(watermark)) if registry else None
+        raw_conn.commit()
+        if registry:
+            registry.apply(marks)
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+    logger.info(f"COPY {rows} rows into {table_name} ({fmt}) in {time.time() - t0:.2f}s")
+    return rows
+
+
+_unique_indexes = set()  # 本进程已确认存在唯一索引的 (engine url, 表, 主键)
+
+
+def unique_index_name(table_name, primary_key):
+    return f"{table_name.rpartition('.')[2]}_{'_'.join(primary_key)}_uidx"
+
+
+def ensure_unique_index(cursor, table_name, primary_key):
+    """
+    ON CONFLICT 需要主键上的唯一索引（或主键约束），不存在时创建。
+    表中已有重复数据时创建会失败，需先执行一次 remove_duplicate_rows。
+    """
+    cursor.execute("""SELECT 1 FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisunique
+        GROUP BY i.indexrelid
+        HAVING array_agg(a.attname::text ORDER BY a.attname::text) = %s""", (table_name, sorted(primary_key)))
+    if cursor.fetchone():
+        return
+    try:
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {unique_index_name(table_name, primary_key)} "
+                       f"ON {table_name} ({', '.join(primary_key)})")
+    except psycopg2.errors.UniqueViolation as e:
+        raise RuntimeError(f"{table_name} already has duplicate rows on {primary_key}; "
+                           f"run remove_duplicate_rows once before using upsert: {e}") from e
+
+
+def upsert_dataframe(data_df, table_name, primary_key=('date', 'full_code'), database_type="POSTGRES", fmt="csv",
+                     chunk_rows=100_000, create_table=True, engine=None, watermark=None):
+    """
+    按主键合并写入（一个事务），返回 (新增行数, 更新行数)。
+    1.批次内按 primary_key 去重，保留最后一行
+    2.COPY 进 ON COMMIT DROP 的临时暂存表（结构同目标表）
+    3.INSERT ... SELECT ... ON CONFLICT (primary_key) DO UPDATE，只更新值有变化的行
+    4.给出 watermark 时在同一事务中推进水位线（同 copy_dataframe）
+    """
+    primary_key = list(primary_key)
+    engine = engine or get_engine(database_type)
+    registry = get_watermarks(engine=engine) if watermark else None
+    t0 = time.time()
+    batch_df = data_df.drop_duplicates(subset=primary_key, keep="last")
+    columns = [str(column) for column in batch_df.columns]
+    missing = [key for key in primary_key if key not in columns]
+    if missing:
+        raise ValueError(f"Primary key columns not in DataFrame: {missing}")
+    update_columns = [column for column in columns if column not in primary_key]
+    stage_table = f"stage_{table_name.rpartition('.')[2]}"
+    column_sql = ", ".join(columns)
+    if update_columns:
+        excluded = ", ".join(f"EXCLUDED.{column}" for column in update_columns)
+        conflict_sql = f"DO UPDATE SET ({', '.join(update_columns)}) = ROW({excluded})"
+        # insert_timestamp 每批都不同，不参与“是否有变化”的比较
+        compare_columns = [column for column in update_columns if column != "insert_timestamp"]
+        if compare_columns:
+            conflict_sql += (f" WHERE ({', '.join(f'{table_name}.{column}' for column in compare_columns)}) "
+                             f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in compare_columns)})")
+    else:
+        conflict_sql = "DO NOTHING"
+    merge_sql = f"""WITH merged AS (
+        INSERT INTO {table_name} ({column_sql})
+        SELECT {column_sql} FROM {stage_table}
+        ON CONFLICT ({', '.join(primary_key)}) {conflict_sql}
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged"""
+
+    raw_conn = engine.raw_connection()
+    try:
+        cursor = raw_conn.cursor()
+        if create_table:
+            cursor.execute(DatabaseConnection._generate_create_table_sql(batch_df, table_name))
+        index_key = (engine.url.render_as_string(hide_password=True), table_name, tuple(primary_key))
+        if index_key not in _unique_indexes:
+            ensure_unique_index(cursor, table_name, primary_key)
+        cursor.execute(f"CREATE TEMP TABLE {stage_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP")
+        copy_to_cursor(cursor, batch_df, stage_table, fmt, chunk_rows)
+        cursor.execute(merge_sql)
+        inserted, updated = cursor.fetchone()
+        marks = registry.advance(cursor, table_name, batch_df, *_watermark_args(watermark)) if registry else None
+        raw_conn.commit()
+        _unique_indexes.add(index_key)
+        if registry:
+            registry.apply(marks)
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+    logger.info(f"Upsert {len(data_df)} rows ({len(data_df) - len(batch_df)} duplicates in batch) into {table_name}: "
+                f"{inserted} inserted, {updated} updated in {time.time() - t0:.2f}s")
+    return inserted, updated
+
+
+class WatermarkNotFound(LookupError):
+    """表（或键）尚无水位线：需先 bootstrap，或为空表显式给出起点"""
+
+
+def _watermark_args(watermark):
+    """watermark 参数：字段名，或 (字段名, 键列名)"""
+    return (watermark, None) if isinstance(watermark, str) else tuple(watermark)
+
+
+def _watermark_text(value):
+    """水位统一存为文本：日期为 YYYY-MM-DD，时间为 YYYY-MM-DD HH:MM:SS[.ffffff]，ISO 格式的文本比较即时间先后"""
+    if isinstance(value, str):
+        return value
+    value = pd.Timestamp(value)
+    return value.strftime("%Y-%m-%d") if value == value.normalize() else value.isoformat(sep=" ")
+
+
+class WatermarkRegistry:
+    """
+    增量加载水位线，存于元数据表 etl_watermark，按 (表名, 字段) 整组缓存在进程内。
+    用法：
+        registry = get_watermarks()
+        registry.get("dwd_ohlc_stock_incr", "date")                       # 整表水位
+        registry.get("dwd_ohlc_stock_incr", "date", key="300588.sz")      # 按键的水位
+        registry.bootstrap("dwd_ohlc_stock_incr", "date", key_column="full_code")  # 一次性由 max() 初始化
+        copy_dataframe(df, "dwd_ohlc_stock_incr", watermark=("date", "full_code"))  # 写入时同事务推进
+    """
+    TABLE = "etl_watermark"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._cache = {}  # (table_name, field_name) -> {key: watermark}
+        self._bootstrapped = set()  # 本进程已 bootstrap 过的 (table_name, field_name, key_column)
+        self._lock = threading.Lock()
+        self._created = False  # 建表语句所在事务已提交后才置位，回滚后会重新建表
+
+    def _ensure_table(self, cursor):
+        if not self._created:
+            cursor.execute(f"""CREATE TABLE IF NOT EXISTS {self.TABLE} (
+                table_name TEXT NOT NULL,
+                field_name TEXT NOT NULL,
+                watermark_key TEXT NOT NULL DEFAULT '',
+                watermark TEXT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT now(),
+                PRIMARY KEY (table_name, field_name, watermark_key))""")
+
+    def _load(self, table_name, field_name):
+        raw_conn = self.engine.raw_connection()
+        try:
             cursor = raw_conn.cursor()
-            cursor.execute(f"""
-                COPY {table_name} FROM '{csv_file}' DELIMITER '\t' CSV HEADER;
-            """)
+            self._ensure_table(cursor)
+            cursor.execute(f"SELECT watermark_key, watermark FROM {self.TABLE} WHERE table_name = %s AND field_name = %s",
+                           (table_name, field_name))
+            marks = dict(cursor.fetchall())
             raw_conn.commit()
+            self._created = True
+        finally:
+            raw_conn.close()
+        with self._lock:
+            self._cache[(table_name, field_name)] = marks
+        return marks
 
-        # 5. 删除临时 CSV 文件
-        os.remove(csv_file)
+    def marks(self, table_name, field_name):
+        """{键: 水位}，首次访问查询一次，之后读缓存"""
+        with self._lock:
+            marks = self._cache.get((table_name, field_name))
+        return dict(marks if marks is not None else self._load(table_name, field_name))
 
-        
-def database_maximum_date(table_name, field_name):
+    def get(self, table_name, field_name, key=""):
+        """返回水位文本；不存在时抛出 WatermarkNotFound"""
+        value = self.marks(table_name, field_name).get(key)
+        if value is None:
+            raise WatermarkNotFound(f"No watermark for {table_name}.{field_name}"
+                                    f"{f' key={key}' if key else ''}; run bootstrap() or pass an explicit start")
+        return value
+
+    def advance(self, cursor, table_name, data_df, field_name, key_column=None):
+        """
+        在调用方的事务中按本批最大值推进水位（只增不减），返回合并后的 {(表, 字段): {键: 水位}}；
+        提交成功后调用 apply 更新缓存，回滚时缓存不受影响。
+        """
+        if data_df.empty:
+            return {}
+        if key_column:
+            maxima = data_df.groupby(key_column)[field_name].max().dropna()
+            rows = [(table_name, field_name, str(key), _watermark_text(value)) for key, value in maxima.items()]
+        else:
+            value = data_df[field_name].max()
+            rows = [] if pd.isna(value) else [(table_name, field_name, "", _watermark_text(value))]
+        if not rows:
+            return {}
+        self._ensure_table(cursor)
+        from psycopg2.extras import execute_values
+        merged = execute_values(cursor, f"""INSERT INTO {self.TABLE} (table_name, field_name, watermark_key, watermark)
+            VALUES %s
+            ON CONFLICT (table_name, field_name, watermark_key) DO UPDATE
+            SET watermark = GREATEST({self.TABLE}.watermark, EXCLUDED.watermark), updated_at = now()
+            RETURNING watermark_key, watermark""", rows, page_size=1000, fetch=True)
+        return {(table_name, field_name): dict(merged)}
+
+    def apply(self, marks):
+        """事务提交后把 advance 的结果写入缓存（未加载过的 (表, 字段) 不缓存，下次访问时整组加载）"""
+        if marks:
+            self._created = True
+        with self._lock:
+            for cache_key, values in (marks or {}).items():
+                if cache_key in self._cache:
+                    self._cache[cache_key].update(values)
+
+    def bootstrap(self, table_name, field_name, key_column=None):
+        """由 max(field_name) 一次性初始化水位（全表扫描，只在首次接入时执行），返回 {键: 水位}"""
+        select = f"SELECT {key_column}, max({field_name}) FROM {table_name} GROUP BY {key_column}" if key_column \
+            else f"SELECT '', max({field_name}) FROM {table_name}"
+        raw_conn = self.engine.raw_connection()
+        try:
+            cursor = raw_conn.cursor()
+            cursor.execute(select)
+            maxima = pd.DataFrame(cursor.fetchall(), columns=["key", field_name]).dropna()
+            marks = self.advance(cursor, table_name, maxima, field_name, "key") if not maxima.empty else {}
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+        self.invalidate(table_name)
+        with self._lock:
+            self._bootstrapped.add((table_name, field_name, key_column))
+        logger.info(f"Bootstrapped {len(maxima)} watermarks for {table_name}.{field_name}")
+        return marks.get((table_name, field_name), {})
+
+    def bootstrapped(self, table_name, field_name, key_column=None):
+        """本进程是否已 bootstrap 过：之后仍缺失的键（空表、无数据的键）不再重复全表扫描"""
+        with self._lock:
+            return (table_name, field_name, key_column) in self._bootstrapped
+
+    def invalidate(self, table_name=None):
+        """丢弃缓存（如其他进程推进了水位）与 bootstrap 记录，下次访问时重新加载"""
+        with self._lock:
+            for cache_key in [k for k in self._cache if table_name is None or k[0] == table_name]:
+                del self._cache[cache_key]
+            self._bootstrapped = {k for k in self._bootstrapped if table_name is not None and k[0] != table_name}
+
+
+_watermark_registries = {}  # engine url -> WatermarkRegistry
+
+
+def get_watermarks(database_type="POSTGRES", engine=None):
+    """进程内按 engine 共享一个 WatermarkRegistry"""
+    engine = engine or get_engine(database_type)
+    key = engine.url.render_as_string(hide_password=False)
+    with _engines_lock:
+        registry = _watermark_registries.get(key)
+        if registry is None:
+            registry = _watermark_registries[key] = WatermarkRegistry(engine)
+    return registry
+
+
+def database_maximum_date(table_name, field_name, key="", key_column=None, default_start=None):
+    """
+    增量加载的起始日期：水位线的下一天（进程内缓存，不再每次 SELECT max()）。
+    尚无水位线时由 max(field_name) 初始化一次（每进程每组只扫描一次）；表为空或键没有数据时返回 default_start，
+    未给出则抛出 WatermarkNotFound。key 与 key_column 须同时给出或同时省略。
+    数据库错误直接抛出，不再回退到 1990-01-01 触发全量重载。
+    """
+    if bool(key) != bool(key_column):
+        raise ValueError(f"key and key_column must be given together: key={key!r}, key_column={key_column!r}")
+    registry = get_watermarks()
     try:
-        with engine_conn('POSTGRES') as conn:
-            max_date_df = pd.read_sql(f"SELECT max({field_name}) FROM {table_name}", con=conn.engine)
-        max_date = max_date_df.values[0][0]
-        logger.info(f'max_date: {max_date}')
-    except:
-        logger.error('Exception in querying database maximum date')
-        max_date = '1990-01-01'
-    finally:
-        next_day = datetime.strptime(max_date, '%Y-%m-%d') + timedelta(days=1)
-        date_start = next_day.strftime('%Y-%m-%d')
-        logger.info(f'date_start: {date_start}')
-        return date_start
+        max_date = registry.get(table_name, field_name, key)
+    except WatermarkNotFound:
+        if not registry.bootstrapped(table_name, field_name, key_column):
+            registry.bootstrap(table_name, field_name, key_column)
+        try:
+            max_date = registry.get(table_name, field_name, key)
+        except WatermarkNotFound:
+            if default_start is None:
+                raise
+            logger.info(f'No data in {table_name}{f" for {key}" if key else ""}, date_start: {default_start}')
+            return default_start
+    logger.info(f'max_date: {max_date}')
+    next_day = datetime.strptime(max_date[:10], '%Y-%m-%d') + timedelta(days=1)
+    date_start = next_day.strftime('%Y-%m-%d')
+    logger.info(f'date_start: {date_start}')
+    return date_start
+
 
-        
 def psycopg2_conn():
     try:
         user = getattr(settings, "POSTGRES_USER")
@@ -147,7 +784,7 @@ def engine_url(database_type):
     user_password_host_port_database_str = f"{user}:{password}@{host}:{port}/{database}"
 
     if database_type == 'HIVE':
-        auth = getattr(config, "HIVE_AUTH")
+        auth = getattr(settings, "HIVE_AUTH")
         db_url = f"hive://{user}:{password}@{host}:{port}/{database}?auth={auth}"
     elif database_type in ['POSTGRES', 'ORACLE', 'MYSQL']:
         db_url = f"{database_name}://{user_password_host_port_database_str}"
@@ -155,19 +792,170 @@ def engine_url(database_type):
 
 
 def table_exists(tablename):
-    db_url = engine_url('POSTGRES')
-    engine = create_engine(db_url)
-    inspector = inspect(engine)
+    inspector = inspect(get_engine('POSTGRES'))
     return inspector.has_table(tablename)
 
 
+# 结果集列类型 OID -> (pandas dtype, pyarrow 类型名)；未列出的类型（uuid、time、json 等）按文本处理，numeric 转为 float64
+PG_TYPE_OIDS = {
+    16: ("boolean", "bool_"), 17: ("object", "binary"),
+    20: ("Int64", "int64"), 21: ("Int64", "int16"), 23: ("Int64", "int32"),
+    700: ("float64", "float32"), 701: ("float64", "float64"), 1700: ("float64", "float64"),
+    1082: ("datetime64[s]", "date32"),
+    1114: ("datetime64[us]", "timestamp_us"), 1184: ("datetime64[us]", "timestamp_us_utc"),
+}
+
+
+def _select_sql(table_name, columns=None, filters=None, where=None, params=None, order_by=None):
+    """拼装 SELECT：columns 下推，filters 为 {列: 值或值列表}，where 为额外的 SQL 条件（参数见 params）"""
+    conditions, values = [], []
+    for column, value in (filters or {}).items():
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} = ANY(%s)")
+            values.append(list(value))
+        else:
+            conditions.append(f"{column} = %s")
+            values.append(value)
+    if where:
+        conditions.append(f"({where})")
+        values.extend(params or [])
+    sql = f"SELECT {', '.join(columns) if columns else '*'} FROM {table_name}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    return sql, values
+
+
+def _arrow_type(name):
+    import pyarrow as pa
+    if name == "timestamp_us":
+        return pa.timestamp("us")
+    if name == "timestamp_us_utc":
+        return pa.timestamp("us", tz="UTC")
+    return getattr(pa, name)()
+
+
+def _arrow_text(value):
+    """未列出类型的值转为文本：json/jsonb 解析后的 dict/list 按 JSON 序列化，其余（UUID、time、interval 等）用 str"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def _typed_chunk(rows, description, as_arrow=False):
+    names = [column.name for column in description]
+    types = [PG_TYPE_OIDS.get(column.type_code, ("object", "string")) for column in description]
+    if as_arrow:
+        import pyarrow as pa
+        arrays = []
+        for values, (_, arrow_type) in zip(zip(*rows), types):
+            if arrow_type == "float64" or arrow_type == "float32":
+                # numeric 返回 Decimal，先转 float
+                values = [None if value is None else float(value) for value in values]
+            elif arrow_type == "binary":
+                # bytea 返回 memoryview
+                values = [None if value is None else bytes(value) for value in values]
+            elif arrow_type == "string":
+                # 固定为 string 而不是推断，各分块的 schema 保持一致
+                values = [_arrow_text(value) for value in values]
+            arrays.append(pa.array(values, type=_arrow_type(arrow_type)))
+        return pa.Table.from_arrays(arrays, names=names)
+    chunk_df = pd.DataFrame.from_records(rows, columns=names)
+    for name, description_column, (dtype, _) in zip(names, description, types):
+        if dtype == "object":
+            continue
+        if description_column.type_code == 1184:
+            chunk_df[name] = pd.to_datetime(chunk_df[name], utc=True)
+        elif dtype.startswith("datetime64"):
+            chunk_df[name] = pd.to_datetime(chunk_df[name]).astype(dtype)
+        else:
+            chunk_df[name] = chunk_df[name].astype("float64" if description_column.type_code == 1700 else dtype)
+    return chunk_df
+
+
+def read_chunks(table_name, columns=None, filters=None, where=None, params=None, order_by=None, chunk_rows=100_000,
+                fetch_size=None, as_arrow=False, database_type="POSTGRES", engine=None):
+    """
+    流式读取，逐块产出 DataFrame（as_arrow=True 时为 pyarrow.Table）。
+    命名游标由服务端保存结果集，迭代时每次往返取 fetch_size 行（默认 chunk_rows），按 chunk_rows 行攒成一个分块产出，
+    客户端只持有当前分块。
+    用法：
+        for chunk_df in read_chunks("ods_ohlc_stock_incr_baostock_sh_sz_minute", columns=["date", "time", "close"],
+                                    filters={"full_code": "300588.sz"}):
+            ...
+    """
+    engine = engine or get_engine(database_type)
+    sql, values = _select_sql(table_name, columns, filters, where, params, order_by)
+    raw_conn = engine.raw_connection()
+    try:
+        # 命名游标须在事务内使用，结束后回滚即释放服务端资源
+        cursor = raw_conn.cursor(name=f"read_{table_name.rpartition('.')[2]}_{os.getpid()}_{threading.get_ident()}")
+        cursor.itersize = fetch_size or chunk_rows
+        cursor.execute(sql, values)
+        # 迭代命名游标才按 itersize 分批往返；fetchmany(n) 每次往返 n 行，会忽略 fetch_size
+        rows_iter = iter(cursor)
+        while True:
+            rows = list(itertools.islice(rows_iter, chunk_rows))
+            if not rows:
+                break
+            yield _typed_chunk(rows, cursor.description, as_arrow)
+        cursor.close()
+    finally:
+        raw_conn.rollback()
+        raw_conn.close()
+
+
+def read_to_parquet(table_name, out_dir, partition_cols=None, columns=None, filters=None, where=None, params=None,
+                    chunk_rows=500_000, fetch_size=None, compression="zstd", database_type="POSTGRES", engine=None):
+    """
+    流式读取并写成 Parquet 数据集（hive 风格分区目录，如 date=2024-01-02/part-0-0.parquet），返回写入行数。
+    每个分块写独立的文件；本次写入过的分区目录中残留的旧 part 文件（如上次运行分块更多）在结束时删除。
+    """
+    chunks = read_chunks(table_name, columns, filters, where, params, chunk_rows=chunk_rows, fetch_size=fetch_size,
+                         as_arrow=True, database_type=database_type, engine=engine)
+    rows = write_parquet_chunks(chunks, out_dir, partition_cols, compression)
+    logger.info(f"Wrote {rows} rows from {table_name} to {out_dir}")
+    return rows
+
+
+def write_parquet_chunks(tables, out_dir, partition_cols=None, compression="zstd"):
+    """
+    把 pyarrow.Table 分块依次写入 Parquet 数据集，返回行数。
+    各分块的文件名为 part-<分块序号>-<i>.parquet，不会互相覆盖；不能用 existing_data_behavior="delete_matching"，
+    它会在每次写入时清空分区目录，删掉前面分块刚写的文件。所以全部写完后，再删除本次写入过的目录中不是本次写出的 part 文件。
+    """
+    import pyarrow.dataset as ds
+    rows, written = 0, set()
+
+    def visit(written_file):
+        written.add(os.path.normpath(written_file.path))
+
+    for index, table in enumerate(tables):
+        ds.write_dataset(table, out_dir, format="parquet", partitioning=list(partition_cols) if partition_cols else None,
+                         partitioning_flavor="hive" if partition_cols else None,
+                         basename_template=f"part-{index}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+                         file_options=ds.ParquetFileFormat().make_write_options(compression=compression),
+                         file_visitor=visit)
+        rows += table.num_rows
+    for directory in {os.path.dirname(path) for path in written}:
+        for name in os.listdir(directory):
+            path = os.path.normpath(os.path.join(directory, name))
+            if name.startswith("part-") and name.endswith(".parquet") and path not in written:
+                os.remove(path)
+    return rows
+
+
 def engine_conn(database_type):
     """
     功能：连接数据库
     备注：输出至数据库：to_csv()  if_exists:['append','replace','fail']#追加、删除原表后新增、啥都不干抛出一个 ValueError
+          engine 来自 get_engine 的缓存，with 块结束时连接归还连接池而不是关闭
     """
     db_url = engine_url(database_type)
-    return DatabaseConnection(db_url)
+    return DatabaseConnection(db_url, database_type)
 
 
 def drop_table(table_name):
@@ -178,7 +966,7 @@ def drop_table(table_name):
 
 
 def find_remove_duplicate_rows(filename, primary_key=('date', 'full_code')):
-    """找到表中的重复数据"""
+    """找到表中的重复数据（全表扫描排序；增量写入请用 upsert_dataframe，从源头避免重复）"""
     sql = f""" SELECT *
 FROM (
     SELECT 
@@ -188,13 +976,13 @@ FROM (
     FROM {filename}
 ) t
 WHERE rn > 1; -- rn>1 即为重复行"""
-    with utils_database.engine_conn("POSTGRES") as conn:
+    with engine_conn("POSTGRES") as conn:
         result_df = pd.read_sql(sql, con=conn.engine)
     return result_df
 
 
 def remove_duplicate_rows(filename, primary_key=('date', 'full_code')):
-    """删除表中的重复数据"""
+    """删除表中的重复数据（全表扫描排序；改用 upsert_dataframe 前对存量表执行一次即可）"""
     sql = f"""DELETE FROM {filename} t
             USING (
               SELECT ctid
@@ -216,8 +1004,8 @@ def remove_duplicate_rows(filename, primary_key=('date', 'full_code')):
 
 if __name__ == '__main__':
     print(settings.PATH)
-    with engine_conn('POSTGRES') as pg_conn:
-        sql = f"SELECT * FROM ods_ohlc_stock_incr_baostock_sh_sz_minute where full_code='300588.sz'"
-        df = pd.read_sql('ods_ohlc_stock_incr_baostock_sh_sz_minute', con=pg_conn.engine)
+    # 分块流式读取，不再把整张分钟线表读进一个 DataFrame
+    df = pd.concat(read_chunks('ods_ohlc_stock_incr_baostock_sh_sz_minute', filters={'full_code': '300588.sz'}),
+                   ignore_index=True)
     print(df)
     # remove_duplicate_rows()
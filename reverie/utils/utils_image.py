@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/6 10:40
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_image.py
+@Description: Photoshop 之前的 Python 端预处理（解码、缩放、色彩模式与格式归一化）
+
+Photoshop 的脚本路径是单线程的，app.open 全分辨率 JPEG 后再 resizeImage 很慢；滤镜耗时又与像素数成正比。
+这里用 Pillow/NumPy 在进程池中完成：
+1.JPEG 用 draft 模式解码：libjpeg 直接按 1/2、1/4、1/8 的 DCT 缩放解码，只解出不小于目标尺寸的像素
+2.按 EXIF 方向旋转，缩放到目标尺寸（LANCZOS）
+3.色彩模式归一化：16 位/浮点灰度用 NumPy 压到 8 位，CMYK/调色板/带透明通道的图转换为 RGB（透明处铺白）
+4.默认存为无压缩 TIFF：Photoshop 打开最快，也不会再引入一次有损压缩；保留 ICC 配置文件与 DPI
+Photoshop 拿到的是已缩放好的小图，动作脚本中对应的缩放/转换步骤应去掉。
+"""
+import os
+import hashlib
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+
+FORMATS = {"tif": ("TIFF", ".tif"), "jpg": ("JPEG", ".jpg"), "png": ("PNG", ".png")}
+
+
+def target_size(width, height, scale=1.0, max_side=0):
+    """按比例缩放，再限制最长边；不放大"""
+    factor = min(scale, 1.0)
+    if max_side and max(width, height) * factor > max_side:
+        factor = max_side / max(width, height)
+    return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+def normalize_mode(img, mode="RGB"):
+    """转换到 mode（RGB 或 L）；mode 为空时只把 Photoshop 脚本处理不便的高位深图压到 8 位"""
+    if img.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        arr = np.asarray(img, dtype=np.float32)
+        if img.mode != "F":
+            # I;16 的满量程是 65535，I 模式多数也来自 16 位 PNG/TIFF
+            arr = arr / 257.0
+        img = Image.fromarray(np.clip(arr + 0.5, 0, 255).astype(np.uint8), "L")
+    if not mode or img.mode == mode:
+        return img
+    if img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, rgba)
+    return img.convert(mode)
+
+
+def prepare_image(source_path, target_path, scale=1.0, max_side=0, mode="RGB", fmt="tif", quality=95):
+    """进程池 worker：预处理单张图，写入 target_path（先写临时文件再改名），返回 (原尺寸, 新尺寸)"""
+    with Image.open(source_path) as img:
+        original = img.size
+        size = target_size(*original, scale=scale, max_side=max_side)
+        if img.format == "JPEG" and size != original:
+            img.draft(img.mode, size)
+        info = {"icc_profile": img.info.get("icc_profile"), "dpi": img.info.get("dpi")}
+        # EXIF 方向 5~8 含 90° 旋转，旋转后宽高互换
+        if img.getexif().get(0x0112) in (5, 6, 7, 8):
+            size = size[::-1]
+        img = ImageOps.exif_transpose(img)
+        img = normalize_mode(img, mode)
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        format_name, _ = FORMATS[fmt]
+        options = {key: value for key, value in info.items() if value}
+        if format_name == "JPEG":
+            options.update(quality=quality, subsampling=0)
+        tmp_path = f"{target_path}.{os.getpid()}.part"
+        img.save(tmp_path, format_name, **options)
+    os.replace(tmp_path, target_path)
+    return original, size
+
+
+class PreStage:
+    """
+    用法：
+        prestage = PreStage(scale=0.5, workers=8)
+        prepared, errors = prestage.prepare_all(source_paths)   # 或逐张 prestage.prepare(source_path)
+        input_path = prestage.input_path(source_path)            # 交给 Photoshop 的文件，未预处理时为原文件
+        prestage.release(source_path)                            # 任务结束后删除预处理文件
+    """
+    def __init__(self, work_dir=None, scale=1.0, max_side=0, mode="RGB", fmt="tif", quality=95, workers=None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported pre-stage format: {fmt}")
+        self.work_dir = Path(work_dir or Path(tempfile.gettempdir()) / "reverie_prestage")
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.scale = scale
+        self.max_side = max_side
+        self.mode = mode
+        self.fmt = fmt
+        self.quality = quality
+        self._pool = ProcessPoolExecutor(max_workers=workers)
+        self._prepared = {}
+
+    def signature(self):
+        """预处理参数，拼入动作哈希：参数变化时输出缓存/台账视为新任务"""
+        return f"prestage:{self.scale}:{self.max_side}:{self.mode}:{self.fmt}:{self.quality}"
+
+    def target_path(self, source_path):
+        name = hashlib.sha1(str(Path(source_path).resolve()).encode("utf-8")).hexdigest()[:16]
+        return self.work_dir / (name + FORMATS[self.fmt][1])
+
+    def submit(self, source_path):
+        """提交单张图，返回 Future；需经 collect 登记后 input_path 才指向预处理文件"""
+        return self._pool.submit(prepare_image, str(source_path), str(self.target_path(source_path)), self.scale,
+                                 self.max_side, self.mode, self.fmt, self.quality)
+
+    def collect(self, source_path, future):
+        """等待 future 完成并登记，返回预处理文件路径；失败时抛出异常"""
+        future.result()
+        target_path = self._prepared[str(source_path)] = self.target_path(source_path)
+        return target_path
+
+    def prepare(self, source_path):
+        """阻塞预处理单张图（在进程池中执行），返回预处理文件路径"""
+        return self.collect(source_path, self.submit(source_path))
+
+    def prepare_all(self, source_paths):
+        """并行预处理，返回 ({source_path: target_path}, {source_path: error})；失败的图仍按原文件交给 Photoshop"""
+        futures = {source_path: self.submit(source_path) for source_path in source_paths}
+        prepared, errors = {}, {}
+        for source_path, future in futures.items():
+            try:
+                prepared[source_path] = self.collect(source_path, future)
+            except Exception as e:
+                errors[source_path] = str(e)
+        return prepared, errors
+
+    def input_path(self, source_path):
+        return self._prepared.get(str(source_path), source_path)
+
+    def release(self, source_path):
+        target_path = self._prepared.pop(str(source_path), None)
+        if target_path is not None:
+            Path(target_path).unlink(missing_ok=True)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
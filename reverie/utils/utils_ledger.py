@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/1/23 11:05
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_ledger.py
+@Description: 批处理任务台账（SQLite）
+
+记录每个输入文件的路径、大小、mtime、内容哈希、动作哈希、状态、耗时与尝试次数，用于：
+1.崩溃/中断后重启只跑 pending / failed / timeout / 残留 running 的任务，已完成的直接跳过
+2.输入文件内容或动作脚本变化时自动重新排队
+3.统计每小时吞吐量、失败率
+
+状态流转：pending -> running -> done / failed / timeout；失败类状态在 attempts < max_attempts 时重新执行。
+主键为 (source_path, action_hash)：同一张图换了动作脚本视为新任务。
+"""
+import os
+import time
+import sqlite3
+import threading
+
+from reverie.utils import utils_data
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    source_path  TEXT    NOT NULL,
+    action_hash  TEXT    NOT NULL,
+    output_path  TEXT,
+    finish_path  TEXT,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    content_hash TEXT,
+    status       TEXT    NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    error        TEXT,
+    duration_ms  INTEGER,
+    created_at   REAL,
+    started_at   REAL,
+    finished_at  REAL,
+    PRIMARY KEY (source_path, action_hash)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs (finished_at);
+"""
+
+RETRYABLE_STATUSES = ("pending", "failed", "timeout", "running")
+
+
+class JobLedger:
+    """
+    用法：
+        ledger = JobLedger("ledger.sqlite")
+        runnable = ledger.register(jobs, action_hash, max_attempts=3)
+        ledger.mark_started(runnable, action_hash)
+        ... 执行 ...
+        ledger.record(source_path, action_hash, (status, ms, error))
+    """
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # 回调可能来自 watcher 线程或 asyncio 的线程池，统一加锁串行写入
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def register(self, jobs, action_hash, max_attempts=3):
+        """
+        登记扫描到的任务并返回需要执行的子集。
+        jobs 为 [(source_path, output_path, finish_path), ...]。
+        size/mtime 未变时沿用台账中的内容哈希，变化时重新计算；内容哈希变化则重置为 pending、attempts 清零。
+        """
+        runnable = []
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for source_path, output_path, finish_path in jobs:
+                    stat = os.stat(source_path)
+                    row = self._conn.execute(
+                        "SELECT size, mtime_ns, content_hash, status, attempts FROM jobs "
+                        "WHERE source_path = ? AND action_hash = ?", (str(source_path), action_hash)).fetchone()
+                    if row is not None and (row[0], row[1]) == (stat.st_size, stat.st_mtime_ns):
+                        content_hash, status, attempts = row[2], row[3], row[4]
+                    else:
+                        content_hash = utils_data.file_hash(source_path)
+                        if row is not None and row[2] == content_hash:
+                            status, attempts = row[3], row[4]
+                        else:
+                            status, attempts = "pending", 0
+                    self._conn.execute(
+                        "INSERT INTO jobs (source_path, action_hash, output_path, finish_path, size, mtime_ns, "
+                        "content_hash, status, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (source_path, action_hash) DO UPDATE SET output_path = excluded.output_path, "
+                        "finish_path = excluded.finish_path, size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                        "content_hash = excluded.content_hash, status = excluded.status, attempts = excluded.attempts",
+                        (str(source_path), action_hash, str(output_path), str(finish_path), stat.st_size,
+                         stat.st_mtime_ns, content_hash, status, attempts, now))
+                    # done 但源文件仍在输入目录（如移动失败）时不重跑，交给人工或 finalize 处理
+                    if status in RETRYABLE_STATUSES and attempts < max_attempts:
+                        runnable.append((source_path, output_path, finish_path))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return runnable
+
+    def content_hash(self, source_path, action_hash):
+        rows = self._execute("SELECT content_hash FROM jobs WHERE source_path = ? AND action_hash = ?",
+                             (str(source_path), action_hash))
+        return rows[0][0] if rows else None
+
+    def mark_started(self, jobs, action_hash):
+        """派发前调用：状态置为 running 并累加尝试次数；进程崩溃后残留的 running 在下次启动时会被重新执行"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL "
+                "WHERE source_path = ? AND action_hash = ?",
+                [(now, str(source_path), action_hash) for source_path, *_ in jobs])
+
+    def record(self, source_path, action_hash, result):
+        """记录单个任务结果，result 为 (status, ms, error)"""
+        status, ms, error = result
+        self._execute(
+            "UPDATE jobs SET status = ?, duration_ms = ?, error = ?, finished_at = ? "
+            "WHERE source_path = ? AND action_hash = ?",
+            (status, ms, error or None, time.time(), str(source_path), action_hash))
+
+    def record_results(self, results, action_hash):
+        """批量记录 {source_path: (status, ms, error)}"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, duration_ms = ?, error = ?, finished_at = ? "
+                "WHERE source_path = ? AND action_hash = ?",
+                [(status, ms, error or None, now, str(source_path), action_hash)
+                 for source_path, (status, ms, error) in results.items()])
+
+    def status_counts(self):
+        return dict(self._execute("SELECT status, count(*) FROM jobs GROUP BY status"))
+
+    def throughput_per_hour(self, hours=24):
+        """最近 hours 小时内每小时完成的任务数，返回 [(hour_start_epoch, done_count), ...]"""
+        since = time.time() - hours * 3600
+        return self._execute(
+            "SELECT CAST(finished_at / 3600 AS INTEGER) * 3600 AS hour, count(*) FROM jobs "
+            "WHERE status = 'done' AND finished_at >= ? GROUP BY hour ORDER BY hour", (since,))
+
+    def failure_rate(self, hours=24):
+        """最近 hours 小时内结束的任务中 failed/timeout 的占比"""
+        since = time.time() - hours * 3600
+        finished, failed = self._execute(
+            "SELECT count(*), coalesce(sum(status IN ('failed', 'timeout')), 0) FROM jobs "
+            "WHERE finished_at >= ? AND status IN ('done', 'failed', 'timeout')", (since,))[0]
+        return failed / finished if finished else 0.0
+
+    def summary(self, hours=24):
+        return {
+            "status": self.status_counts(),
+            "throughput_per_hour": self.throughput_per_hour(hours),
+            "failure_rate": self.failure_rate(hours),
+        }
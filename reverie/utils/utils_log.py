@@ -15,11 +15,13 @@ critical: 最严重的错误，可能导致程序崩溃或终止
 """
 import sys
 import os
+import json
 from loguru import logger
 
 # 全局保存 sink id，保证重复调用不会重复添加
 _CONSOLE_SINK_ID = None
 _FILE_SINK_ID = None
+_SPAN_SINK_ID = None
 
 def logger_config_local(
     file_path: str,
@@ -83,6 +85,34 @@ def logger_remove_console():
         _CONSOLE_SINK_ID = None
 
 
+def logger_config_spans(file_path: str, rotation: str = "100 MB", retention: str = "10 days"):
+    """
+    把 log_span 输出的结构化 span 单独写入 JSON Lines 文件（每行一个 JSON），便于导入分析工具；
+    span 同时仍按普通 info 日志出现在 console / file sink 中。
+    """
+    global _SPAN_SINK_ID
+    if _SPAN_SINK_ID is None:
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        _SPAN_SINK_ID = logger.add(
+            file_path,
+            format="{extra[span_json]}",
+            filter=lambda record: "span_json" in record["extra"],
+            level="DEBUG",
+            rotation=rotation,
+            retention=retention,
+            enqueue=True,
+        )
+    return logger
+
+
+def log_span(name: str, **fields):
+    """
+    输出一条结构化 span：fields 序列化为 JSON 写入消息，同时绑定到 extra 中供 logger_config_spans 的 sink 使用。
+    """
+    payload = json.dumps({"span": name, **fields}, ensure_ascii=False, default=str)
+    logger.bind(span=name, span_json=payload).opt(depth=1).info(f"span {payload}")
+
+
 # def logger_config_local(file_path, level="DEBUG", rotation="10 MB", retention="10 days"):
 #     """
 #     添加文件日志输出。
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/14 10:20
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_metrics.py
+@Description: 任务流水线的分阶段计时与 Prometheus 指标导出
+
+JobSpan 记录单个任务依次到达各阶段的时刻：
+    queued -> prestaged（可选）-> built -> dispatched -> completed -> moved
+finish 时计算每个阶段相对上一阶段的耗时，经 utils_log.log_span 输出一条结构化 span（含图片尺寸、动作哈希），
+并把耗时累加到 Metrics 的直方图与计数器中。
+Metrics 按 Prometheus 文本格式导出：写入文件（node_exporter textfile collector，按间隔节流、原子替换）
+或以 HTTP 端点提供（/metrics）。无第三方依赖。
+"""
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from reverie.utils import utils_log, utils_spool
+
+# 秒；覆盖 jsx 拼装的毫秒级到 Photoshop 滤镜的分钟级
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _labels(pairs, extra=()):
+    pairs = tuple(pairs) + tuple(extra)
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}" if pairs else ""
+
+
+class Metrics:
+    """
+    线程安全的计数器 / gauge / 直方图集合。
+    用法：
+        metrics = Metrics(textfile="/var/lib/node_exporter/reverie.prom", interval=10)
+        metrics.histogram("reverie_stage_seconds", "Seconds spent reaching each stage")
+        metrics.observe("reverie_stage_seconds", 1.2, stage="completed")
+        metrics.inc("reverie_jobs_total", status="done")
+        metrics.maybe_flush()       # 距上次写入超过 interval 才写
+        metrics.serve(9108)         # 可选：HTTP 端点
+    """
+    def __init__(self, textfile=None, interval=10.0):
+        self.textfile = textfile
+        self.interval = interval
+        self._families = {}  # name -> [type, help, buckets, {labels: value}]
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        self._server = None
+
+    def _family(self, name, kind, help_text="", buckets=None):
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = [kind, help_text, tuple(buckets or DEFAULT_BUCKETS), {}]
+        return family
+
+    def counter(self, name, help_text=""):
+        with self._lock:
+            self._family(name, "counter", help_text)
+
+    def gauge(self, name, help_text=""):
+        with self._lock:
+            self._family(name, "gauge", help_text)
+
+    def histogram(self, name, help_text="", buckets=None):
+        with self._lock:
+            self._family(name, "histogram", help_text, buckets)
+
+    def inc(self, name, value=1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._family(name, "counter")[3]
+            values[key] = values.get(key, 0.0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._family(name, "gauge")[3][tuple(sorted(labels.items()))] = value
+
+    def add(self, name, value, **labels):
+        """gauge 增减（如在途任务数）"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._family(name, "gauge")[3]
+            values[key] = values.get(key, 0.0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, _, buckets, values = self._family(name, "histogram")
+            state = values.get(key)
+            if state is None:
+                state = values[key] = [[0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        """Prometheus 文本格式（exposition format 0.0.4）"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets, values) in sorted(self._families.items()):
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in sorted(values.items()):
+                    if kind != "histogram":
+                        lines.append(f"{name}{_labels(key)} {_number(value)}")
+                        continue
+                    counts, total, count = value
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{_labels(key, [('le', f'{bound:g}')])} {bucket_count}")
+                    lines.append(f"{name}_bucket{_labels(key, [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """写入 textfile（原子替换，collector 不会读到半个文件）"""
+        if self.textfile:
+            utils_spool.write_atomic(self.textfile, self.render())
+        self._flushed_at = time.time()
+
+    def maybe_flush(self):
+        if self.textfile and time.time() - self._flushed_at >= self.interval:
+            self.flush()
+
+    def serve(self, port, host="0.0.0.0"):
+        """在后台线程中提供 http://host:port/metrics，返回 server"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        return self._server
+
+    def shutdown(self):
+        self.flush()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class JobSpan:
+    """单个任务的阶段时刻；mark 可在任意线程调用，finish 只生效一次"""
+    __slots__ = ("tracer", "job", "fields", "marks", "_done", "_lock")
+
+    def __init__(self, tracer, job, **fields):
+        self.tracer = tracer
+        self.job = str(job)
+        self.fields = fields
+        self.marks = [("queued", time.time())]
+        self._done = False
+        self._lock = threading.Lock()
+
+    def mark(self, stage):
+        with self._lock:
+            self.marks.append((stage, time.time()))
+        return self
+
+    def update(self, **fields):
+        self.fields.update(fields)
+        return self
+
+    def durations(self):
+        """{stage: 从上一阶段到该阶段的秒数}"""
+        with self._lock:
+            marks = list(self.marks)
+        return {stage: t - prev_t for (_, prev_t), (stage, t) in zip(marks, marks[1:])}
+
+    def finish(self, status, error=""):
+        with self._lock:
+            if self._done:
+                return
+            self._done = True
+        self.tracer.finish(self, status, error)
+
+
+class NullSpan:
+    """未启用计时时的占位，接口与 JobSpan 相同"""
+    def mark(self, stage):
+        return self
+
+    def update(self, **fields):
+        return self
+
+    def finish(self, status, error=""):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Tracer:
+    """
+    创建 JobSpan，结束时输出 span 日志并累加指标。fields 为每个 span 都带上的公共字段（如 action_hash）。
+    用法：
+        tracer = Tracer(Metrics(textfile=...), action_hash=action_hash)
+        span = tracer.start(source_path, width=w, height=h)
+        span.mark("built"); span.mark("dispatched"); span.mark("completed"); span.mark("moved")
+        span.finish("done")
+    """
+    def __init__(self, metrics=None, log_spans=True, **fields):
+        self.metrics = metrics
+        self.log_spans = log_spans
+        self.fields = fields
+        if metrics is not None:
+            metrics.histogram("reverie_stage_seconds", "Seconds from the previous stage to this stage")
+            metrics.histogram("reverie_job_seconds", "Seconds from queued to finished, by status")
+            metrics.counter("reverie_jobs_total", "Finished jobs by status")
+            metrics.counter("reverie_pixels_total", "Input pixels of successfully processed jobs")
+            metrics.gauge("reverie_jobs_in_flight", "Jobs queued or running")
+            metrics.gauge("reverie_last_success_timestamp_seconds", "Unix time of the last successful job")
+
+    def start(self, job, **fields):
+        if self.metrics is not None:
+            self.metrics.add("reverie_jobs_in_flight", 1)
+        return JobSpan(self, job, **{**self.fields, **fields})
+
+    def finish(self, span, status, error=""):
+        durations = span.durations()
+        total = span.marks[-1][1] - span.marks[0][1]
+        if self.log_spans:
+            utils_log.log_span("job", job=span.job, status=status, error=error, total_seconds=round(total, 4),
+                               stages={stage: round(seconds, 4) for stage, seconds in durations.items()},
+                               **span.fields)
+        metrics = self.metrics
+        if metrics is None:
+            return
+        for stage, seconds in durations.items():
+            metrics.observe("reverie_stage_seconds", seconds, stage=stage)
+        metrics.observe("reverie_job_seconds", total, status=status)
+        metrics.inc("reverie_jobs_total", status=status)
+        metrics.add("reverie_jobs_in_flight", -1)
+        if status == "done":
+            width, height = span.fields.get("width") or 0, span.fields.get("height") or 0
+            metrics.inc("reverie_pixels_total", width * height)
+            metrics.set("reverie_last_success_timestamp_seconds", time.time())
+        metrics.maybe_flush()
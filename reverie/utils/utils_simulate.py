@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/12 11:20
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_simulate.py
+@Description: 无需 Photoshop 的模拟执行后端，用于在 Linux/CI 上测试与压测调度、完成检测和 finalize
+
+读取 main 生成的 jsx，按模板类型模拟 Photoshop 的行为：
+- 单任务（JSX_WRAPPER 或编译缓存的 stub）：取 INPUT_PATH / OUTPUT_PATH，stub 中 $.evalFile 的共享脚本也会读取
+- 批处理（JSX_BATCH_WRAPPER）：取 MANIFEST，在同一个“会话”中逐张处理
+- 常驻 worker（JSX_WORKER_WRAPPER）：取 SPOOL_DIR，启动遵循同一协议的 LocalSpoolWorker
+每张图做一个廉价的 Pillow 变换（按 scale 缩放），按脚本中的 outputSpecs 写出全部输出，再写 .done / .failed 哨兵。
+latency 为每张图的耗时（秒，或 (最小, 最大) 区间内均匀分布），failure_rate 为随机失败的比例；
+concurrency 为同时运行的“Photoshop 实例”数，超过的脚本排队，与多开 Photoshop 的资源竞争近似。
+"""
+import re
+import json
+import time
+import random
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from reverie.utils import utils_spool
+
+_INPUT = re.compile(r'var INPUT_PATH = "(.*)";')
+_OUTPUT = re.compile(r'var OUTPUT_PATH = "(.*)";')
+_MANIFEST = re.compile(r'var MANIFEST = (\[.*\]);')
+_SPOOL = re.compile(r'var SPOOL_DIR = "(.*)";')
+_EVAL_FILE = re.compile(r'\$\.evalFile\(new File\("(.*)"\)\);')
+_OUTPUT_SPECS = re.compile(r'var outputSpecs = (\[.*\]);')
+
+# 与 JS 中的 saveDocument 一致：jpg/png/tif 以外的扩展名在 Photoshop 中存为 PSD，这里以 PNG 内容代替
+_SAVE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".tif": "TIFF", ".tiff": "TIFF"}
+
+
+def variant_paths(output_path, specs):
+    """按 outputSpecs（[[suffix, fmt, quality, maxSide], ...]）推算全部输出，规则与 main.save_outputs_action 的 JS 一致"""
+    output_path = Path(output_path)
+    if not specs:
+        return [(output_path, 10, 0)]
+    base = output_path.with_suffix("")
+    paths = [(output_path, specs[0][2], specs[0][3])]
+    paths += [(base.with_name(f"{base.name}{suffix}.{fmt}"), quality, max_side) for suffix, fmt, quality, max_side in specs[1:]]
+    return paths
+
+
+def write_sentinel(output_path, status, ms, error=""):
+    """与 JSX_HELPERS 中的 writeSentinel 相同：先删除相反状态的旧哨兵，再原子写入"""
+    stale = Path(f"{output_path}.{'failed' if status == 'done' else 'done'}")
+    stale.unlink(missing_ok=True)
+    utils_spool.write_atomic(f"{output_path}.{status}", f"{status}\t{ms}\t{' '.join(str(error).split())}\n")
+
+
+class SimulatedPhotoshop:
+    """
+    用法：
+        backend = SimulatedPhotoshop(latency=(0.2, 0.5), failure_rate=0.05, concurrency=4)
+        backend.run(temp_jsx)      # 立即返回 Future，结果通过哨兵 / spool 结果文件返回，与真实 Photoshop 相同
+        backend.shutdown()
+    """
+    name = "simulated"
+
+    def __init__(self, latency=0.0, failure_rate=0.0, scale=0.5, concurrency=4, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.scale = scale
+        self.random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="SimulatedPhotoshop")
+        self._workers = []
+
+    def _draw(self):
+        """返回 (本张耗时, 是否失败)"""
+        with self._random_lock:
+            latency = self.random.uniform(*self.latency) if isinstance(self.latency, (tuple, list)) else self.latency
+            return latency, self.random.random() < self.failure_rate
+
+    @staticmethod
+    def _read_script(temp_jsx):
+        script = Path(temp_jsx).read_text(encoding="utf-8")
+        included = _EVAL_FILE.search(script)
+        if included and Path(included.group(1)).exists():
+            script += "\n" + Path(included.group(1)).read_text(encoding="utf-8")
+        return script
+
+    def process(self, input_path, output_path, specs=None):
+        """模拟一张图的动作：注入的延迟与失败、Pillow 变换、保存全部输出；失败时抛出异常"""
+        latency, fail = self._draw()
+        time.sleep(latency)
+        if fail:
+            raise RuntimeError("Simulated Photoshop failure")
+        with Image.open(input_path) as img:
+            img = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+            if self.scale != 1.0:
+                img = img.resize((max(1, round(img.size[0] * self.scale)), max(1, round(img.size[1] * self.scale))),
+                                 Image.BILINEAR)
+            for path, quality, max_side in variant_paths(output_path, specs):
+                variant = img
+                if max_side and max(img.size) > max_side:
+                    variant = img.copy()
+                    variant.thumbnail((max_side, max_side), Image.BILINEAR)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                file_format = _SAVE_FORMATS.get(path.suffix.lower(), "PNG")
+                options = {"quality": max(1, min(95, round(quality * 95 / 12)))} if file_format == "JPEG" else {}
+                variant.save(path, file_format, **options)
+
+    def _run_job(self, input_path, output_path, specs):
+        t0 = time.time()
+        try:
+            self.process(input_path, output_path, specs)
+            status, error = "done", ""
+        except Exception as e:
+            status, error = "failed", e
+        write_sentinel(output_path, status, int((time.time() - t0) * 1000), error)
+
+    def _run_script(self, script):
+        specs_match = _OUTPUT_SPECS.search(script)
+        specs = json.loads(specs_match.group(1)) if specs_match else None
+        manifest = _MANIFEST.search(script)
+        spool = _SPOOL.search(script)
+        if manifest:
+            for input_path, output_path in json.loads(manifest.group(1)):
+                self._run_job(input_path, output_path, specs)
+        elif spool:
+            worker = utils_spool.LocalSpoolWorker(spool.group(1), handler=lambda i, o: self.process(i, o, specs))
+            self._workers.append(worker.start())
+        else:
+            self._run_job(_INPUT.search(script).group(1), _OUTPUT.search(script).group(1), specs)
+
+    def run(self, temp_jsx):
+        """与 launch_photoshop 对应：异步执行脚本，立即返回"""
+        return self._pool.submit(self._run_script, self._read_script(temp_jsx))
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
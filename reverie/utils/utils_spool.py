@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/1/20 10:12
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_spool.py
+@Description: 常驻 worker 的 spool 目录任务通道
+
+协议（所有文件均为 UTF-8，先写 .part 再改名，保证读方看到的都是完整文件）：
+spool_dir/
+    jobs/<job_id>.job          一行：input_path\toutput_path
+    results/<job_id>.result    一行：status\tms\terror    status 为 done / failed
+    heartbeat                  一行：state\t毫秒时间戳，state 为 idle / busy；worker 每轮循环按间隔刷新、每个任务前后各刷新一次，
+                               mtime 用于判断 worker 是否存活。busy 表示正在执行单个任务（期间无法刷新），存活判断放宽
+    stop                       存在时 worker 处理完当前任务后退出，并删除该文件；启动新 worker 前由 clear_stop 清除残留
+
+job_id 以纳秒时间戳开头，worker 按文件名排序取任务即为先进先出。
+Photoshop 端的实现见 main.JSX_WORKER_WRAPPER，LocalSpoolWorker 是遵循同一协议的本地替身，便于脱离 Photoshop 测试 Python 端。
+"""
+import os
+import time
+import uuid
+import shutil
+import threading
+from pathlib import Path
+
+
+def write_atomic(path, text):
+    """先写 .part 再 os.replace，读方不会读到半个文件"""
+    path = Path(path)
+    part_path = path.with_name(path.name + ".part")
+    with open(part_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(part_path, path)
+
+
+def parse_result(text):
+    """解析结果行，返回 (status, ms, error)"""
+    status, ms, error = (text.rstrip("\r\n").split("\t", 2) + ["", "", ""])[:3]
+    return status, int(ms or 0), error
+
+
+class SpoolChannel:
+    """
+    Python 端：投递任务、读取结果、控制 worker
+    """
+    def __init__(self, spool_dir):
+        self.spool_dir = Path(spool_dir)
+        self.jobs_dir = self.spool_dir / "jobs"
+        self.results_dir = self.spool_dir / "results"
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+
+    def submit(self, input_path, output_path):
+        """投递一个任务，返回 job_id"""
+        job_id = f"{time.time_ns()}_{uuid.uuid4().hex[:8]}"
+        write_atomic(self.jobs_dir / f"{job_id}.job", f"{Path(input_path).as_posix()}\t{Path(output_path).as_posix()}\n")
+        return job_id
+
+    def result_path(self, job_id):
+        return self.results_dir / f"{job_id}.result"
+
+    def result(self, job_id, remove=True):
+        """返回 (status, ms, error)，任务未完成时返回 None"""
+        path = self.result_path(job_id)
+        try:
+            text = path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        if remove:
+            path.unlink(missing_ok=True)
+        return parse_result(text)
+
+    def wait(self, job_id, timeout=600, poll_interval=0.2):
+        """阻塞等待单个任务完成，超时返回 None"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            result = self.result(job_id)
+            if result is not None:
+                return result
+            time.sleep(poll_interval)
+        return None
+
+    def pending_count(self):
+        return sum(1 for _ in self.jobs_dir.glob("*.job"))
+
+    def is_worker_alive(self, max_age=30, busy_max_age=600):
+        """worker 在 max_age 秒内刷新过心跳则视为存活；心跳为 busy（单个任务执行中）时放宽到 busy_max_age"""
+        path = self.spool_dir / "heartbeat"
+        try:
+            age = time.time() - path.stat().st_mtime
+            state = path.read_text(encoding="utf-8").split("\t", 1)[0]
+        except FileNotFoundError:
+            return False
+        return age < (busy_max_age if state == "busy" else max_age)
+
+    def stop_worker(self):
+        write_atomic(self.spool_dir / "stop", "")
+
+    def clear_stop(self):
+        """删除残留的 stop 文件；只能在确认没有存活 worker 后、启动新 worker 前调用"""
+        (self.spool_dir / "stop").unlink(missing_ok=True)
+
+
+def copy_handler(input_path, output_path):
+    """LocalSpoolWorker 默认处理函数：直接复制输入到输出"""
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(input_path, output_path)
+
+
+class LocalSpoolWorker:
+    """
+    本地替身 worker：在后台线程中按 spool 协议取任务，调用 handler(input_path, output_path) 处理。
+    handler 抛出的异常会被记录为 failed 结果，与 Photoshop 端 catch 的行为一致。
+    """
+    def __init__(self, spool_dir, handler=copy_handler, poll_interval=0.05, heartbeat_interval=5.0):
+        self.channel = SpoolChannel(spool_dir)
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._thread = None
+        self._last_beat = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="LocalSpoolWorker", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def beat(self, state):
+        self._last_beat = time.time()
+        write_atomic(self.channel.spool_dir / "heartbeat", f"{state}\t{int(self._last_beat * 1000)}")
+
+    def run(self):
+        stop_path = self.channel.spool_dir / "stop"
+        self._last_beat = 0.0
+        while not stop_path.exists():
+            if time.time() - self._last_beat > self.heartbeat_interval:
+                self.beat("idle")
+            job_files = sorted(self.channel.jobs_dir.glob("*.job"))
+            if not job_files:
+                time.sleep(self.poll_interval)
+                continue
+            self.beat("busy")
+            self.process(job_files[0])
+            self.beat("idle")
+        stop_path.unlink(missing_ok=True)
+
+    def process(self, job_file):
+        job_id = job_file.stem
+        input_path, output_path = job_file.read_text(encoding="utf-8").rstrip("\r\n").split("\t", 1)
+        job_file.unlink()
+        t0 = time.time()
+        try:
+            self.handler(input_path, output_path)
+            status, error = "done", ""
+        except Exception as e:
+            status, error = "failed", " ".join(str(e).split())
+        ms = int((time.time() - t0) * 1000)
+        write_atomic(self.channel.result_path(job_id), f"{status}\t{ms}\t{error}\n")
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/9 16:05
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_tile.py
+@Description: 超大图分块处理：切分为带重叠的分块，处理后用 NumPy 羽化拼接
+
+1.plan_tiles：按 tile_size 把宽高均分为若干核心区域，每块向相邻方向各外扩 overlap 像素
+2.split_image：按计划裁出分块文件，作为普通任务送入流水线并行处理
+3.stitch_tiles：每块乘以羽化权重累加到磁盘上的 memmap，最后按权重归一化
+  权重在重叠区内线性过渡（左块 1 -> 0、右块 0 -> 1），二维权重为行列权重的外积；
+  累加缓冲与权重和都是 memmap，拼接过程中内存只与单个分块大小相关，最终保存时 Pillow 需要一份 8 位整图
+动作若改变了尺寸（如缩放 50%），按第一块输出与输入的比例推算整图输出尺寸。
+"""
+import os
+import math
+import tempfile
+from pathlib import Path
+from collections import namedtuple
+
+import numpy as np
+from PIL import Image
+
+# 分块模式处理的就是超大图，关闭 Pillow 的解压炸弹保护
+Image.MAX_IMAGE_PIXELS = None
+
+# core 为不重叠的核心区域，box 为外扩 overlap 后实际裁出的区域，均为 (x0, y0, x1, y1)
+Tile = namedtuple("Tile", ["index", "core", "box"])
+
+
+def _bounds(length, tile_size):
+    """把 [0, length) 均分为不超过 tile_size 的若干段，返回边界列表"""
+    count = max(1, math.ceil(length / tile_size))
+    return [round(i * length / count) for i in range(count + 1)]
+
+
+def plan_tiles(width, height, tile_size=4096, overlap=128):
+    """返回 Tile 列表（行优先）；重叠区过渡需要每块核心区域不小于 2 * overlap"""
+    xs, ys = _bounds(width, tile_size), _bounds(height, tile_size)
+    if min(b - a for a, b in zip(xs, xs[1:])) < 2 * overlap and len(xs) > 2 \
+            or min(b - a for a, b in zip(ys, ys[1:])) < 2 * overlap and len(ys) > 2:
+        raise ValueError(f"overlap {overlap} is too large for tile_size {tile_size}")
+    tiles = []
+    for y0, y1 in zip(ys, ys[1:]):
+        for x0, x1 in zip(xs, xs[1:]):
+            box = (max(0, x0 - overlap), max(0, y0 - overlap), min(width, x1 + overlap), min(height, y1 + overlap))
+            tiles.append(Tile(len(tiles), (x0, y0, x1, y1), box))
+    return tiles
+
+
+def split_image(source_path, tile_dir, tile_size=4096, overlap=128, suffix=".png"):
+    """切分输入，返回 (width, height, [(Tile, tile_path), ...])"""
+    tile_dir = Path(tile_dir)
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    with Image.open(source_path) as img:
+        img = img.convert("RGB") if img.mode not in ("RGB", "L") else img
+        width, height = img.size
+        tiles = []
+        for tile in plan_tiles(width, height, tile_size, overlap):
+            tile_path = tile_dir / f"tile_{tile.index:04d}{suffix}"
+            img.crop(tile.box).save(tile_path)
+            tiles.append((tile, tile_path))
+    return width, height, tiles
+
+
+def _ramp(start, end, core_start, core_end, overlap, lower_edge, upper_edge):
+    """一维羽化权重：在 [core_start - overlap, core_start + overlap) 内由 0 升到 1，在核心末端对称下降；图像边缘不过渡"""
+    positions = np.arange(start, end, dtype=np.float32) + 0.5
+    weights = np.ones(end - start, dtype=np.float32)
+    if overlap > 0 and not lower_edge:
+        weights = np.minimum(weights, (positions - (core_start - overlap)) / (2 * overlap))
+    if overlap > 0 and not upper_edge:
+        weights = np.minimum(weights, ((core_end + overlap) - positions) / (2 * overlap))
+    return np.clip(weights, 0.0, 1.0)
+
+
+def feather_weights(tile, width, height, overlap):
+    """分块 box 范围内的二维权重（行权重与列权重的外积），相邻分块的权重在重叠区内相加为 1"""
+    x0, y0, x1, y1 = tile.box
+    cx0, cy0, cx1, cy1 = tile.core
+    wx = _ramp(x0, x1, cx0, cx1, overlap, cx0 == 0, cx1 == width)
+    wy = _ramp(y0, y1, cy0, cy1, overlap, cy0 == 0, cy1 == height)
+    return np.outer(wy, wx)
+
+
+def stitch_tiles(tiles, width, height, output_path, overlap=128, work_dir=None, strip_rows=1024, **save_options):
+    """
+    tiles 为 [(Tile, processed_tile_path), ...]，拼接后写入 output_path，返回输出尺寸。
+    累加缓冲为 work_dir 下的临时 memmap，完成后删除。
+    """
+    with Image.open(tiles[0][1]) as first:
+        box = tiles[0][0].box
+        scale = first.size[0] / (box[2] - box[0])
+        channels = len(first.getbands()) if first.mode in ("RGB", "L") else 3
+    out_width, out_height = max(1, round(width * scale)), max(1, round(height * scale))
+    mode = "RGB" if channels == 3 else "L"
+
+    work_dir = Path(work_dir or tempfile.gettempdir())
+    work_dir.mkdir(parents=True, exist_ok=True)
+    acc_path = work_dir / f"stitch_{os.getpid()}_{id(tiles)}.acc"
+    weight_path = work_dir / f"stitch_{os.getpid()}_{id(tiles)}.weight"
+    acc = np.memmap(acc_path, dtype=np.float32, mode="w+", shape=(out_height, out_width, channels))
+    weight_sum = np.memmap(weight_path, dtype=np.float32, mode="w+", shape=(out_height, out_width))
+    try:
+        for tile, tile_path in tiles:
+            with Image.open(tile_path) as img:
+                pixels = np.asarray(img.convert(mode), dtype=np.float32)
+            if pixels.ndim == 2:
+                pixels = pixels[:, :, None]
+            weights = feather_weights(tile, width, height, overlap)
+            if scale != 1.0 or weights.shape != pixels.shape[:2]:
+                # 动作改变了尺寸：权重按输出分块大小重采样
+                weights = np.asarray(Image.fromarray(weights).resize(pixels.shape[1::-1], Image.BILINEAR))
+            ox, oy = round(tile.box[0] * scale), round(tile.box[1] * scale)
+            h, w = min(pixels.shape[0], out_height - oy), min(pixels.shape[1], out_width - ox)
+            acc[oy:oy + h, ox:ox + w] += pixels[:h, :w] * weights[:h, :w, None]
+            weight_sum[oy:oy + h, ox:ox + w] += weights[:h, :w]
+
+        # 逐条带归一化并转为 8 位，原地写回累加缓冲的前半部分视图，避免再申请整图的 float 数组
+        result = np.memmap(acc_path, dtype=np.uint8, mode="r+", shape=(out_height, out_width, channels))
+        for top in range(0, out_height, strip_rows):
+            strip = acc[top:top + strip_rows] / np.maximum(weight_sum[top:top + strip_rows], 1e-6)[:, :, None]
+            result[top:top + strip_rows] = np.clip(strip + 0.5, 0, 255).astype(np.uint8)
+        result.flush()
+        image = Image.fromarray(result[:, :, 0] if channels == 1 else result)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(output_path).with_name(Path(output_path).name + ".part")
+        image.save(tmp_path, Image.registered_extensions().get(Path(output_path).suffix.lower()), **save_options)
+        os.replace(tmp_path, output_path)
+        del image, result
+    finally:
+        del acc, weight_sum
+        acc_path.unlink(missing_ok=True)
+        weight_path.unlink(missing_ok=True)
+    return out_width, out_height
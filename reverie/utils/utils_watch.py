@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/1/21 16:40
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: utils_watch.py
+@Description: 文件完成检测
+
+一个 CompletionWatcher 在单个后台线程中同时跟踪任意多个“等待出现的文件”，文件出现后触发回调。
+- Linux 下使用 inotify（ctypes 调用 libc，无第三方依赖），按父目录合并 watch，文件写完关闭或被改名进来时立即触发
+- 其他平台、目录不存在或 inotify 不可用时退回轮询，所有轮询条目共享同一个线程
+- 超时的条目触发 on_timeout 回调
+
+回调在 watcher 线程中执行，应尽量简短（如移动文件），耗时操作请自行投递到线程池。
+
+HotFolder 递归监听一个输入目录树（热文件夹），新文件“到达完毕”（大小与 mtime 在 settle_seconds 内不再变化）后回调。
+没有 inotify 时（Windows）每次轮询只 stat 已知目录，mtime 变化的目录才重扫其直接内容，完整递归重扫按 rescan_interval 进行。
+"""
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from reverie.utils import utils_data
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_EVENT_STRUCT = struct.Struct("iIII")
+
+# 目录 mtime 距扫描时刻不足该秒数时，同一时间粒度内可能还有未看到的变化（FAT/SMB 的粒度可达 2 秒），下次轮询仍重扫
+RACY_SECONDS = 2.0
+
+
+def _load_inotify():
+    """返回 libc（支持 inotify 时），否则返回 None"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class WatchEntry:
+    __slots__ = ("path", "on_ready", "on_timeout", "deadline", "done")
+
+    def __init__(self, path, on_ready, on_timeout, deadline):
+        self.path = path
+        self.on_ready = on_ready
+        self.on_timeout = on_timeout
+        self.deadline = deadline
+        self.done = threading.Event()
+
+
+class CompletionWatcher:
+    """
+    用法：
+        watcher = CompletionWatcher().start()
+        entry = watcher.watch(output_path, lambda path: utils_data.move(source, finish), timeout=600)
+        entry.done.wait()
+    """
+    def __init__(self, poll_interval=1.0, use_inotify=True, mask=IN_CLOSE_WRITE | IN_MOVED_TO):
+        self.poll_interval = poll_interval
+        self.mask = mask
+        self._lock = threading.Lock()
+        self._entries = {}          # path -> [WatchEntry, ...]
+        self._polled = set()        # 需要轮询的 path
+        self._dir_wd = {}           # dir -> wd
+        self._wd_dir = {}           # wd -> dir
+        self._thread = None
+        self._running = False
+        self._wakeup = threading.Event()
+        self._wake_r = self._wake_w = -1
+        self._libc = _load_inotify() if use_inotify else None
+        self._fd = -1
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self._fd >= 0:
+                # inotify 模式下用 pipe 打断 select；Windows 的 select 不支持 pipe，轮询模式只用 Event
+                self._wake_r, self._wake_w = os.pipe()
+
+    @property
+    def backend(self):
+        return "inotify" if self._fd >= 0 else "poll"
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="CompletionWatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd >= 0:
+            os.close(self._fd)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            self._fd = -1
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(entries) for entries in self._entries.values())
+
+    def watch(self, path, on_ready, timeout=600, on_timeout=None):
+        """
+        登记一个等待出现的文件。文件已存在时立即触发 on_ready(path)。
+        返回 WatchEntry，entry.done 在触发回调（成功或超时）后置位。
+        """
+        path = os.path.abspath(os.fspath(path))
+        entry = WatchEntry(path, on_ready, on_timeout, time.time() + timeout)
+        with self._lock:
+            self._entries.setdefault(path, []).append(entry)
+            if not self._add_dir_watch(os.path.dirname(path)):
+                self._polled.add(path)
+        # 先登记 watch 再检查是否已存在，避免文件恰好在两步之间出现而漏掉事件
+        if os.path.exists(path):
+            self._fire(path)
+        self._wake()
+        return entry
+
+    def cancel(self, path):
+        """取消某个文件的等待，不触发任何回调"""
+        path = os.path.abspath(os.fspath(path))
+        with self._lock:
+            entries = self._entries.pop(path, [])
+            self._polled.discard(path)
+        for entry in entries:
+            entry.done.set()
+
+    def wait_all(self, timeout=None):
+        """等待所有条目完成，返回是否全部完成"""
+        deadline = None if timeout is None else time.time() + timeout
+        while self.pending_count():
+            if deadline is not None and time.time() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _add_dir_watch(self, directory):
+        if self._fd < 0:
+            return False
+        if directory in self._dir_wd:
+            return True
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.mask)
+        if wd < 0:
+            # 目录不存在或 watch 数量达到上限，退回轮询
+            return False
+        self._dir_wd[directory] = wd
+        self._wd_dir[wd] = directory
+        return True
+
+    def _wake(self):
+        self._wakeup.set()
+        if self._wake_w >= 0:
+            try:
+                os.write(self._wake_w, b"\0")
+            except OSError:
+                pass
+
+    def _fire(self, path, timed_out=False):
+        with self._lock:
+            entries = self._entries.pop(path, [])
+            self._polled.discard(path)
+        for entry in entries:
+            callback = entry.on_timeout if timed_out else entry.on_ready
+            try:
+                if callback is not None:
+                    callback(path)
+            finally:
+                entry.done.set()
+
+    def _next_timeout(self):
+        with self._lock:
+            deadlines = [entry.deadline for entries in self._entries.values() for entry in entries]
+            polled = bool(self._polled)
+        timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+        if polled:
+            timeout = self.poll_interval if timeout is None else min(timeout, self.poll_interval)
+        return timeout
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        ready = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_STRUCT.unpack_from(data, offset)
+            offset += _EVENT_STRUCT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # 事件队列溢出：逐一检查所有条目
+                with self._lock:
+                    ready.extend(self._entries)
+                continue
+            if mask & IN_IGNORED:
+                with self._lock:
+                    directory = self._wd_dir.pop(wd, None)
+                    self._dir_wd.pop(directory, None)
+                    # 目录被删除/卸载后，其下的条目改为轮询
+                    self._polled.update(p for p in self._entries if os.path.dirname(p) == directory)
+                continue
+            directory = self._wd_dir.get(wd)
+            if directory is not None and name:
+                ready.append(os.path.join(directory, os.fsdecode(name)))
+        for path in ready:
+            with self._lock:
+                known = path in self._entries
+            if known and os.path.exists(path):
+                self._fire(path)
+
+    def _check_polled_and_timeouts(self):
+        now = time.time()
+        with self._lock:
+            polled = list(self._polled)
+            expired = [path for path, entries in self._entries.items()
+                       if entries and min(entry.deadline for entry in entries) <= now]
+        for path in polled:
+            if os.path.exists(path):
+                self._fire(path)
+        for path in expired:
+            with self._lock:
+                still_pending = path in self._entries
+            if still_pending:
+                self._fire(path, timed_out=True)
+
+    def _run(self):
+        while self._running:
+            if self._fd >= 0:
+                readable, _, _ = select.select([self._wake_r, self._fd], [], [], self._next_timeout())
+                if self._wake_r in readable:
+                    os.read(self._wake_r, 4096)
+                if self._fd in readable:
+                    self._read_events()
+            else:
+                self._wakeup.wait(self._next_timeout())
+            self._wakeup.clear()
+            self._check_polled_and_timeouts()
+
+
+
+class HotFolder:
+    """
+    热文件夹：递归监听 root，文件到达完毕后回调 on_file(rel_path)。
+    - 启动时用 utils_data.scan_files 建立初始索引，已存在的文件同样会被回调
+    - Linux 下为每个子目录添加 inotify watch，新建/移入的子目录自动加入监听
+    - 其他平台每 poll_interval 秒 stat 一遍已知目录，只重扫 mtime 变化（有文件新建/删除/改名）的目录，新子目录递归加入；
+      原地改写已有文件不改变目录 mtime，由 rescan_interval 的完整重扫兜底
+    - 两种模式都每 rescan_interval 秒做一次完整的增量重扫，兜底网络盘等收不到事件的情况
+    - 同一文件只回调一次；文件被移走后从索引删除，之后若再次出现（或内容变化）会再次回调
+    on_file 在监听线程中执行，应尽快返回（如把任务投递到队列）。
+    """
+    def __init__(self, root, on_file, suffixes=None, settle_seconds=2.0, poll_interval=1.0,
+                 rescan_interval=60.0, use_inotify=True):
+        self.root = os.path.abspath(os.fspath(root))
+        self.on_file = on_file
+        self.suffixes = tuple(suffix.lower() for suffix in suffixes) if suffixes else None
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self._index = {}        # rel_path -> (size, mtime_ns)，已回调过的文件
+        self._candidates = {}   # rel_path -> (size, mtime_ns, changed_at)，尚在写入/待稳定的文件
+        self._wd_dir = {}       # wd -> rel_dir
+        self._dirs = {}         # 轮询模式：rel_dir -> 上次重扫时的目录 mtime_ns，None 表示下次必须重扫
+        self._dir_files = {}    # 轮询模式：rel_dir -> 上次重扫时其中的文件（rel_path 集合）
+        self._last_rescan = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._libc = _load_inotify() if use_inotify else None
+        self._fd = -1
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+    @property
+    def backend(self):
+        return "inotify" if self._fd >= 0 else "poll"
+
+    def start(self):
+        if self._fd >= 0:
+            self._watch_tree("")
+            self._rescan()
+        else:
+            # 首次轮询时所有目录都未知，等同一次完整扫描
+            self._poll_dirs()
+            self._last_rescan = time.time()
+        self._thread = threading.Thread(target=self._run, name="HotFolder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _wanted(self, rel_path):
+        return not self.suffixes or os.path.splitext(rel_path)[1].lower() in self.suffixes
+
+    def _watch_tree(self, rel_dir):
+        """为 rel_dir 及其所有子目录添加 inotify watch"""
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_MODIFY
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(os.path.join(self.root, current)), mask)
+            if wd >= 0:
+                self._wd_dir[wd] = current
+            try:
+                with os.scandir(os.path.join(self.root, current)) as iterator:
+                    stack.extend(os.path.join(current, entry.name) if current else entry.name
+                                 for entry in iterator if entry.is_dir(follow_symlinks=False))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+    def _observe(self, rel_path, signature=None, now=None):
+        """记录一次文件变化；签名变化时重新开始稳定计时"""
+        if signature is None:
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except FileNotFoundError:
+                self._forget(rel_path)
+                return
+            signature = (stat.st_size, stat.st_mtime_ns)
+        if self._index.get(rel_path) == signature:
+            return
+        candidate = self._candidates.get(rel_path)
+        if candidate is None or candidate[:2] != signature:
+            self._candidates[rel_path] = signature + (now or time.time(),)
+
+    def _forget(self, rel_path):
+        self._index.pop(rel_path, None)
+        self._candidates.pop(rel_path, None)
+
+    def _rescan(self):
+        """增量重扫：只把新出现或发生变化的文件加入候选；已消失的文件移出索引"""
+        now = time.time()
+        seen = set()
+        for rel_path, size, mtime_ns in utils_data.scan_files(self.root, self.suffixes):
+            seen.add(rel_path)
+            self._observe(rel_path, (size, mtime_ns), now)
+        for rel_path in [rel_path for rel_path in self._index if rel_path not in seen]:
+            del self._index[rel_path]
+        self._last_rescan = now
+
+    def _scan_dir(self, rel_dir, now):
+        """轮询模式：重扫单个目录的直接内容，返回其子目录列表"""
+        path = os.path.join(self.root, rel_dir)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+            iterator = os.scandir(path)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            self._drop_dir(rel_dir)
+            return []
+        seen, sub_dirs = set(), []
+        with iterator:
+            for entry in iterator:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        sub_dirs.append(rel_path)
+                        continue
+                    if not entry.is_file() or not self._wanted(rel_path):
+                        continue
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                seen.add(rel_path)
+                self._observe(rel_path, (stat.st_size, stat.st_mtime_ns), now)
+        for rel_path in self._dir_files.get(rel_dir, set()) - seen:
+            self._index.pop(rel_path, None)
+        self._dir_files[rel_dir] = seen
+        self._dirs[rel_dir] = None if now - mtime_ns / 1e9 < RACY_SECONDS else mtime_ns
+        return sub_dirs
+
+    def _drop_dir(self, rel_dir):
+        """目录已消失：连同其子目录一起移出轮询，其中的文件移出索引"""
+        prefix = os.path.join(rel_dir, "") if rel_dir else ""
+        for current in [d for d in self._dirs if d == rel_dir or (prefix and d.startswith(prefix))]:
+            del self._dirs[current]
+            for rel_path in self._dir_files.pop(current, ()):
+                self._forget(rel_path)
+
+    def _poll_dirs(self):
+        """轮询模式的增量检查：每个已知目录 stat 一次，mtime 变化的目录才重扫，新出现的子目录递归重扫"""
+        now = time.time()
+        self._dirs.setdefault("", None)
+        stack = []
+        for rel_dir, mtime_ns in list(self._dirs.items()):
+            if rel_dir not in self._dirs:
+                # 父目录消失时已一并移除
+                continue
+            try:
+                current = os.stat(os.path.join(self.root, rel_dir)).st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                self._drop_dir(rel_dir)
+                continue
+            if current != mtime_ns:
+                stack.append(rel_dir)
+        while stack:
+            for sub_dir in self._scan_dir(stack.pop(), now):
+                if sub_dir not in self._dirs:
+                    stack.append(sub_dir)
+
+    def _settle(self):
+        """候选文件签名在 settle_seconds 内未变化则视为到达完毕并回调"""
+        now = time.time()
+        for rel_path, (size, mtime_ns, changed_at) in list(self._candidates.items()):
+            if now - changed_at < self.settle_seconds:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.root, rel_path))
+            except FileNotFoundError:
+                self._forget(rel_path)
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != (size, mtime_ns):
+                self._candidates[rel_path] = signature + (now,)
+                continue
+            del self._candidates[rel_path]
+            self._index[rel_path] = signature
+            self.on_file(rel_path)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_STRUCT.unpack_from(data, offset)
+            offset += _EVENT_STRUCT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self._rescan()
+                continue
+            if mask & IN_IGNORED:
+                self._wd_dir.pop(wd, None)
+                continue
+            rel_dir = self._wd_dir.get(wd)
+            if rel_dir is None or not name:
+                continue
+            rel_path = os.path.join(rel_dir, name) if rel_dir else name
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # 新目录中的文件可能在 watch 生效前就已写入，先监听再扫描
+                    self._watch_tree(rel_path)
+                    for sub_path, size, mtime_ns in utils_data.scan_files(os.path.join(self.root, rel_path), self.suffixes):
+                        self._observe(os.path.join(rel_path, sub_path), (size, mtime_ns))
+                continue
+            if not self._wanted(rel_path):
+                continue
+            if mask & (IN_MOVED_FROM | IN_DELETE):
+                self._forget(rel_path)
+            else:
+                self._observe(rel_path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            timeout = min(self.poll_interval, self.settle_seconds) if self._candidates else self.poll_interval
+            if self._fd >= 0:
+                readable, _, _ = select.select([self._fd], [], [], timeout)
+                if readable:
+                    self._read_events()
+            else:
+                self._stop.wait(timeout)
+                self._poll_dirs()
+            if time.time() - self._last_rescan >= self.rescan_interval:
+                self._rescan()
+            self._settle()
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 11:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: conftest.py
+@Description: 测试公共配置
+
+reverie/settings.py 是本机配置，不在仓库中；缺失时注册一个只含 PATH 的模块，
+使 import reverie.settings 的模块（main、scriptlistener2jsx、utils_database）可以被测试导入。
+"""
+import sys
+import types
+import tempfile
+
+try:
+    import reverie.settings  # noqa: F401
+except ImportError:
+    settings = types.ModuleType("reverie.settings")
+    settings.PATH = tempfile.gettempdir()
+    sys.modules["reverie.settings"] = settings
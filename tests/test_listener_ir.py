@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 11:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_listener_ir.py
+@Description: listener_ir 解析与优化的回归测试
+"""
+from reverie.decompile import listener_ir
+
+
+def select_layer(name, make_visible=None):
+    lines = [
+        'var idslct = charIDToTypeID( "slct" );',
+        'var desc1 = new ActionDescriptor();',
+        'var idnull = charIDToTypeID( "null" );',
+        'var ref1 = new ActionReference();',
+        f'ref1.putName( charIDToTypeID( "Lyr " ), "{name}" );',
+        'desc1.putReference( idnull, ref1 );',
+    ]
+    if make_visible is not None:
+        lines.append(f'desc1.putBoolean( charIDToTypeID( "MkVs" ), {make_visible} );')
+    lines.append('executeAction( idslct, desc1, DialogModes.NO );')
+    return "\n".join(lines)
+
+
+def select_target(make_visible=None):
+    lines = [
+        'var desc1 = new ActionDescriptor();',
+        'var ref1 = new ActionReference();',
+        'ref1.putEnumerated( charIDToTypeID( "Lyr " ), charIDToTypeID( "Ordn" ), charIDToTypeID( "Trgt" ) );',
+        'desc1.putReference( charIDToTypeID( "null" ), ref1 );',
+    ]
+    if make_visible is not None:
+        lines.append(f'desc1.putBoolean( charIDToTypeID( "MkVs" ), {make_visible} );')
+    lines.append('executeAction( charIDToTypeID( "slct" ), desc1, DialogModes.NO );')
+    return "\n".join(lines)
+
+
+def parse(*blocks):
+    return [item for block in blocks for item in listener_ir.parse_block(block)]
+
+
+def test_parse_block_expands_ids_and_objects():
+    [action] = listener_ir.parse_block(select_layer("Background"))
+    assert action.name == "select"
+    assert action.mode == "DialogModes.NO"
+    assert action.target().calls[0][0] == "putName"
+
+
+def test_unknown_statement_becomes_raw_block():
+    [item] = listener_ir.parse_block('alert( "hi" );')
+    assert isinstance(item, listener_ir.RawBlock)
+
+
+def test_later_absolute_select_overrides_earlier():
+    items, stats = listener_ir.optimize(parse(select_layer("A"), select_layer("B")))
+    assert len(items) == 1
+    assert stats["select_overridden"] == 1
+
+
+def test_select_with_make_visible_is_kept():
+    items, stats = listener_ir.optimize(parse(select_layer("A", "true"), select_layer("B")))
+    assert len(items) == 2
+    assert "select_overridden" not in stats
+
+
+def test_select_with_make_visible_false_is_overridden():
+    items, _ = listener_ir.optimize(parse(select_layer("A", "false"), select_layer("B")))
+    assert len(items) == 1
+
+
+def test_select_target_noop_respects_make_visible():
+    items, stats = listener_ir.optimize(parse(select_target(), select_target("false")))
+    assert items == []
+    assert stats["select_target"] == 2
+    items, _ = listener_ir.optimize(parse(select_target("true")))
+    assert len(items) == 1
+
+
+def test_identical_idempotent_actions_merge():
+    items, stats = listener_ir.optimize(parse(select_layer("A", "true"), select_layer("A", "true")))
+    assert len(items) == 1
+    assert stats["merged_duplicate"] == 1
+
+
+def test_emit_hoists_repeated_ids():
+    items, _ = listener_ir.optimize(parse(select_layer("A", "true"), select_layer("B", "true")))
+    header, blocks = listener_ir.emit(items)
+    assert 'var cid_slct = charIDToTypeID( "slct" );' in header
+    assert all("cid_slct" in block for block in blocks)
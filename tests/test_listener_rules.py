@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 14:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_listener_rules.py
+@Description: RuleEngine 的回归测试
+"""
+from reverie.decompile.listener_rules import Rule, RuleEngine
+
+
+def make_engine():
+    return RuleEngine(
+        [Rule("skip", "hostFocusChanged", "hostFocusChanged", word=True)],
+        [Rule("rewrite", "strip_execute_action", r"executeAction\([\s\S]*?,\s*DialogModes\.NO\s*\)\s*;?", "",
+              flags="ms", contains="executeAction"),
+         Rule("rewrite", "path_placeholder", r'File\("([A-Za-z]:/[^"]+)"\)', r'File("{TMP_JSX}")', contains="File(")])
+
+
+def test_skip_rule_reports_hit():
+    engine = make_engine()
+    assert engine.apply('stringIDToTypeID( "hostFocusChanged" );') == (None, ["hostFocusChanged"])
+    assert engine.report()["hits"]["hostFocusChanged"] == 1
+
+
+def test_word_boundary_skip_does_not_match_substring():
+    engine = make_engine()
+    text, fired = engine.apply("var hostFocusChangedX = 1;")
+    assert text == "var hostFocusChangedX = 1;"
+    assert fired == []
+
+
+def test_rewrite_rules_apply_in_one_pass():
+    engine = make_engine()
+    text, fired = engine.apply('var f = File("C:/tmp/a.jsx");\nexecuteAction( idX, undefined, DialogModes.NO );')
+    assert text.strip() == 'var f = File("{TMP_JSX}");'
+    assert fired == ["path_placeholder", "strip_execute_action"]
+
+
+def test_prefilter_skips_sub_without_literals():
+    engine = make_engine()
+    engine.rewrite("var a = 1;")
+    assert engine.seconds["rewrite"] == 0.0
+
+
+def test_dict_round_trip():
+    engine = make_engine()
+    again = RuleEngine.from_dict(engine.to_dict())
+    assert again.to_dict() == engine.to_dict()
+    assert again.apply("executeAction( idX, undefined, DialogModes.NO );")[0] == ""
+
+
+def test_profile_times_every_rule():
+    engine = make_engine()
+    timings = engine.profile(["executeAction( idX, undefined, DialogModes.NO );"], repeat=2)
+    assert set(timings) == {"hostFocusChanged", "strip_execute_action", "path_placeholder"}
+    assert all(seconds >= 0 for seconds in timings.values())
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 11:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_scriptlistener2jsx.py
+@Description: ScriptListener 日志转换的回归测试
+"""
+from reverie.decompile import scriptlistener2jsx
+
+DELIMITER = "// =======================================================\n"
+
+SELECT_BLOCK = """var idslct = charIDToTypeID( "slct" );
+var desc1 = new ActionDescriptor();
+var ref1 = new ActionReference();
+ref1.putName( charIDToTypeID( "Lyr " ), "Layer 1" );
+desc1.putReference( charIDToTypeID( "null" ), ref1 );
+desc1.putBoolean( charIDToTypeID( "MkVs" ), true );
+executeAction( idslct, desc1, DialogModes.NO );
+"""
+
+# 引用块外变量 idX，解析为原始块；strip_execute_action 改写后为空
+EMPTY_AFTER_REWRITE = "executeAction( idX, undefined, DialogModes.NO );\n"
+
+
+def write_log(path, *blocks):
+    path.write_text("".join(DELIMITER + block for block in blocks), encoding="utf-8")
+    return path
+
+
+def test_build_library_skips_blocks_empty_after_rewrite(tmp_path):
+    log_path = write_log(tmp_path / "effect.log", SELECT_BLOCK, EMPTY_AFTER_REWRITE)
+    stats = scriptlistener2jsx.build_library([log_path], tmp_path / "jsx", workers=1)
+    assert stats["unique_actions"] == 1
+    library = (tmp_path / "jsx" / scriptlistener2jsx.LIBRARY_NAME).read_text(encoding="utf-8")
+    assert library.count("function act_") == 1
+
+
+def test_build_library_only_empty_blocks(tmp_path):
+    log_path = write_log(tmp_path / "empty.log", EMPTY_AFTER_REWRITE)
+    stats = scriptlistener2jsx.build_library([log_path], tmp_path / "jsx", workers=1)
+    assert stats["actions"] == 0
+
+
+def test_optimize_log_writes_no_empty_blocks(tmp_path):
+    log_path = write_log(tmp_path / "effect.log", EMPTY_AFTER_REWRITE, SELECT_BLOCK, EMPTY_AFTER_REWRITE)
+    out_path = tmp_path / "out.jsx"
+    stats = scriptlistener2jsx.optimize_log(log_path, out_path)
+    text = out_path.read_text(encoding="utf-8")
+    assert stats["actions_out"] == 1
+    assert stats["raw_blocks"] == 0
+    assert scriptlistener2jsx.BLOCK_BOUNDARY * 2 not in text
+    assert not text.endswith(scriptlistener2jsx.BLOCK_BOUNDARY)
+
+
+def test_convert_log_drops_blocks_empty_after_rewrite(tmp_path):
+    log_path = write_log(tmp_path / "effect.log", SELECT_BLOCK, EMPTY_AFTER_REWRITE)
+    assert scriptlistener2jsx.convert_log(log_path, tmp_path / "out.jsx") == 1
+
+
+def test_profile_rules_covers_every_rule(tmp_path):
+    log_path = write_log(tmp_path / "effect.log", SELECT_BLOCK, EMPTY_AFTER_REWRITE)
+    timings = scriptlistener2jsx.profile_rules(log_path, repeat=2)
+    engine = scriptlistener2jsx.DEFAULT_ENGINE
+    assert set(timings) == {rule.name for rule in engine.skip_rules + engine.rewrite_rules}
+
+
+def test_poll_log_restarts_output_after_truncation(tmp_path):
+    log_path = tmp_path / "ScriptingListenerJS.log"
+    out_path, state_path = tmp_path / "out.jsx", tmp_path / "out.jsx.offset"
+    write_log(log_path, SELECT_BLOCK, SELECT_BLOCK.replace("Layer 1", "Layer 2"), "// pending\n")
+    offset = scriptlistener2jsx.poll_log(log_path, out_path, state_path, 0)
+    assert out_path.read_text(encoding="utf-8").count("executeAction") == 0
+    assert "Layer 2" in out_path.read_text(encoding="utf-8")
+
+    # 末尾未结束的块留到下次；Photoshop 清空日志后重新写入，新日志比旧偏移短
+    write_log(log_path, SELECT_BLOCK.replace("Layer 1", "Layer 3"), "// pending\n")
+    offset = scriptlistener2jsx.poll_log(log_path, out_path, state_path, offset)
+    text = out_path.read_text(encoding="utf-8")
+    assert "Layer 3" in text
+    assert "Layer 1" not in text and "Layer 2" not in text
+    assert scriptlistener2jsx.load_offset(state_path, log_path) == offset
+    rotated = [path for path in tmp_path.glob("out.*.jsx")]
+    assert len(rotated) == 1 and "Layer 2" in rotated[0].read_text(encoding="utf-8")
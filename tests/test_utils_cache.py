@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 10:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_cache.py
+@Description: ResultCache 回归测试
+"""
+from reverie.utils.utils_cache import ResultCache, cache_key
+
+
+def test_overwrite_output_after_put_keeps_cached_bytes(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    output_path = tmp_path / "out.jpg"
+    output_path.write_bytes(b"action A")
+    key_a = cache_key("input", "action_a", ".jpg")
+    cache.put(key_a, output_path)
+
+    # 同一路径被下一个动作原地覆盖
+    with open(output_path, "r+b") as f:
+        f.write(b"action B")
+
+    restored_path = tmp_path / "restored.jpg"
+    assert cache.get(key_a, restored_path)
+    assert restored_path.read_bytes() == b"action A"
+    cache.close()
+
+
+def test_overwrite_materialized_output_keeps_cached_bytes(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    source_path = tmp_path / "source.jpg"
+    source_path.write_bytes(b"cached")
+    key = cache_key("input", "action", ".jpg")
+    cache.put(key, source_path)
+
+    output_path = tmp_path / "out.jpg"
+    assert cache.get(key, output_path)
+    with open(output_path, "r+b") as f:
+        f.write(b"edited")
+    assert cache.object_path(key, ".jpg").read_bytes() == b"cached"
+    cache.close()
+
+
+def test_miss_and_eviction(tmp_path):
+    cache = ResultCache(tmp_path / "cache", max_bytes=10)
+    assert not cache.get("missing", tmp_path / "out.jpg")
+    for i in range(3):
+        path = tmp_path / f"out_{i}.jpg"
+        path.write_bytes(b"x" * 6)
+        cache.put(cache_key(str(i), "action", ".jpg"), path)
+    assert cache.stats()["entries"] == 1
+    assert cache.total_bytes() <= 10
+    cache.close()
+
+
+def test_partial_hit_materializes_nothing(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    cached_path = tmp_path / "cached.jpg"
+    cached_path.write_bytes(b"main")
+    key_main, key_thumb = cache_key("input", "action", ".jpg"), cache_key("input", "action", "_thumb.jpg")
+    cache.put(key_main, cached_path)
+
+    outputs = [(key_main, tmp_path / "out" / "a.jpg"), (key_thumb, tmp_path / "out" / "a_thumb.jpg")]
+    assert cache.contains(key_main) and not cache.contains(key_thumb)
+    assert not cache.get_all(outputs)
+    assert not (tmp_path / "out").exists() or not any((tmp_path / "out").iterdir())
+
+    cache.put(key_thumb, cached_path)
+    assert cache.get_all(outputs)
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["a.jpg", "a_thumb.jpg"]
+    cache.close()
+
+
+def test_object_evicted_during_get_all_rolls_back(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    cached_path = tmp_path / "cached.jpg"
+    cached_path.write_bytes(b"main")
+    keys = [cache_key("input", "action", suffix) for suffix in (".jpg", "_thumb.jpg")]
+    for key in keys:
+        cache.put(key, cached_path)
+    outputs = [(keys[0], tmp_path / "a.jpg"), (keys[1], tmp_path / "a_thumb.jpg")]
+
+    get = cache.get
+
+    def get_then_evict(key, output_path):
+        # 第一个输出物化后，第二个对象被外部删除
+        hit = get(key, output_path)
+        cache.object_path(keys[1], ".jpg").unlink(missing_ok=True)
+        return hit
+
+    cache.get = get_then_evict
+    assert not cache.get_all(outputs)
+    assert not (tmp_path / "a.jpg").exists()
+    cache.close()
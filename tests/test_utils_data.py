@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/21 10:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_data.py
+@Description: Finalizer 批量建目录与移动回归测试
+"""
+from unittest import mock
+
+from reverie.utils import utils_data
+
+
+def test_prepare_dirs_creates_each_directory_once(tmp_path):
+    finalizer = utils_data.Finalizer(workers=2)
+    targets = [tmp_path / "finish" / day / f"{i}.jpg" for day in ("0102", "0103") for i in range(3)]
+    assert finalizer.prepare_dirs(targets) == 2
+    assert (tmp_path / "finish" / "0102").is_dir() and (tmp_path / "finish" / "0103").is_dir()
+    assert finalizer.prepare_dirs(targets) == 0
+
+    sources = []
+    for i, target in enumerate(targets):
+        source = tmp_path / f"src{i}.jpg"
+        source.write_bytes(b"x")
+        sources.append(source)
+    # 目录已批量创建，移动时不再 makedirs
+    with mock.patch.object(utils_data.os, "makedirs", side_effect=AssertionError("makedirs per move")):
+        results = [finalizer.submit(source, target).result() for source, target in zip(sources, targets)]
+    finalizer.shutdown()
+    assert all(result.ok for result in results)
+    assert all(target.exists() for target in targets)
+    assert finalizer.summary()["replace"] == len(targets)
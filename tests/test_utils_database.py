@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 15:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_database.py
+@Description: utils_database 中不依赖数据库服务的部分：分块类型转换、Parquet 写出
+"""
+import uuid
+import datetime
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from reverie.utils import utils_database
+
+pa = pytest.importorskip("pyarrow")
+
+Column = namedtuple("Column", ["name", "type_code"])
+
+
+def test_arrow_chunk_casts_unknown_types_to_text():
+    # uuid(2950)、time(1083)、jsonb(3802) 不在 PG_TYPE_OIDS 中
+    description = [Column("id", 2950), Column("at", 1083), Column("meta", 3802), Column("close", 1700)]
+    key = uuid.uuid4()
+    rows = [(key, datetime.time(9, 30), {"a": 1}, None), (None, None, [1, "x"], 1.5)]
+    table = utils_database._typed_chunk(rows, description, as_arrow=True)
+    assert table.schema.field("id").type == pa.string()
+    assert table.column("id").to_pylist() == [str(key), None]
+    assert table.column("at").to_pylist() == ["09:30:00", None]
+    assert table.column("meta").to_pylist() == ['{"a": 1}', '[1, "x"]']
+    assert table.column("close").to_pylist() == [None, 1.5]
+
+
+def test_arrow_chunk_all_null_text_column_keeps_string_type():
+    table = utils_database._typed_chunk([(None,)], [Column("note", 25)], as_arrow=True)
+    assert table.schema.field("note").type == pa.string()
+
+
+def test_parquet_rewrite_removes_stale_parts(tmp_path):
+    def chunks(count):
+        for i in range(count):
+            yield pa.table({"date": ["2024-01-02", "2024-01-03"], "close": [float(i), float(i)]})
+
+    assert utils_database.write_parquet_chunks(chunks(3), tmp_path, partition_cols=["date"]) == 6
+    # 第二次运行分块更少：上次的 part-1/part-2 不能残留
+    assert utils_database.write_parquet_chunks(chunks(1), tmp_path, partition_cols=["date"]) == 2
+    assert sorted(p.name for p in (tmp_path / "date=2024-01-02").iterdir()) == ["part-0-0.parquet"]
+    import pyarrow.dataset as ds
+    assert ds.dataset(tmp_path, format="parquet", partitioning="hive").count_rows() == 2
+
+
+def test_parquet_without_partitions(tmp_path):
+    table = pa.table({"close": [1.0, 2.0]})
+    utils_database.write_parquet_chunks([table, table], tmp_path)
+    utils_database.write_parquet_chunks([table], tmp_path)
+    assert [p.name for p in tmp_path.iterdir()] == ["part-0-0.parquet"]
+
+
+def _decode_pgcopy(payload, column_types):
+    """按 PGCOPY 格式解码回逐行的 Python 值，用于校验编码结果"""
+    header = utils_database.PGCOPY_HEADER
+    assert payload[:len(header)] == header and payload.endswith(utils_database.PGCOPY_TRAILER)
+    body, rows, offset = payload[len(header):-2], [], 0
+    epoch = datetime.datetime(2000, 1, 1)
+    while offset < len(body):
+        count = int(np.frombuffer(body, ">i2", 1, offset)[0])
+        assert count == len(column_types)
+        offset, row = offset + 2, []
+        for pg_type in column_types:
+            length = int(np.frombuffer(body, ">i4", 1, offset)[0])
+            offset += 4
+            if length == -1:
+                row.append(None)
+                continue
+            raw = body[offset:offset + length]
+            offset += length
+            if pg_type in utils_database.TEXT_TYPES:
+                row.append(raw.decode("utf-8"))
+            elif pg_type == "date":
+                row.append((epoch + datetime.timedelta(days=int(np.frombuffer(raw, ">i4")[0]))).date())
+            elif pg_type.startswith("timestamp"):
+                value = epoch + datetime.timedelta(microseconds=int(np.frombuffer(raw, ">i8")[0]))
+                row.append(value.replace(tzinfo=datetime.timezone.utc) if "with time zone" in pg_type else value)
+            else:
+                row.append(np.frombuffer(raw, utils_database.BINARY_TYPES[pg_type])[0].item())
+        rows.append(tuple(row))
+    return rows
+
+
+def test_binary_copy_round_trip():
+    frame = pd.DataFrame({
+        "code": ["600000.sh", "", None, "平安银行"],
+        "date": pd.to_datetime(["2024-01-02", None, "1999-12-31", "2024-02-29"]),
+        "at": pd.to_datetime(["2024-01-02 09:30:00.000001+08:00", "1970-01-01 00:00:00.000000+00:00", None,
+                              "2024-02-29 15:00:00.000000+08:00"], utc=True).tz_convert("Asia/Shanghai"),
+        "suspended": pd.array([True, False, None, True], dtype="boolean"),
+        "volume": pd.array([2 ** 40 + 7, None, -1, 0], dtype="Int64"),
+        "close": [10.5, np.nan, -0.25, 1e300],
+        "lot": [100, 200, 300, -32768],
+    })
+    column_types = ["text", "date", "timestamp with time zone", "boolean", "bigint", "double precision", "smallint"]
+    # 分块边界落在行中间，确认各块独立编码
+    payload = b"".join(utils_database.iter_binary_chunks(frame, column_types, chunk_rows=3))
+    rows = _decode_pgcopy(payload, column_types)
+    utc = datetime.timezone.utc
+    assert rows == [
+        ("600000.sh", datetime.date(2024, 1, 2), datetime.datetime(2024, 1, 2, 1, 30, 0, 1, tzinfo=utc),
+         True, 2 ** 40 + 7, 10.5, 100),
+        ("", None, datetime.datetime(1970, 1, 1, tzinfo=utc), False, None, None, 200),
+        (None, datetime.date(1999, 12, 31), None, None, -1, -0.25, 300),
+        ("平安银行", datetime.date(2024, 2, 29), datetime.datetime(2024, 2, 29, 7, 0, tzinfo=utc), True, 0, 1e300, -32768),
+    ]
+
+
+@pytest.mark.parametrize("values, pg_type", [
+    ([2 ** 40 + 7, 3.9], "integer"),  # 超出 int32 且带小数
+    ([2 ** 31], "integer"),
+    ([1.5], "bigint"),
+    ([2 ** 63], "bigint"),
+    ([np.inf], "bigint"),
+    ([32768], "smallint"),
+    ([2], "boolean"),
+    ([1e300], "real"),
+])
+def test_binary_copy_rejects_lossy_casts(values, pg_type):
+    with pytest.raises(ValueError, match="losslessly"):
+        utils_database.encode_binary_rows(pd.DataFrame({"v": values}), [pg_type])
+
+
+def test_binary_copy_accepts_integral_floats():
+    # 含空值的整数列在 pandas 中常为 float64
+    payload = utils_database.encode_binary_rows(pd.DataFrame({"v": [3.0, np.nan, -2.0 ** 31]}), ["integer"])
+    header = utils_database.PGCOPY_HEADER
+    rows = _decode_pgcopy(header + payload + utils_database.PGCOPY_TRAILER, ["integer"])
+    assert rows == [(3,), (None,), (-2 ** 31,)]
+
+
+def test_create_table_maps_int64_to_bigint():
+    frame = pd.DataFrame({"volume": np.array([2 ** 40], dtype=np.int64), "lot": np.array([1], dtype=np.int32),
+                          "amount": pd.array([1], dtype="Int64"), "flag": np.array([1], dtype=np.uint32)})
+    sql = utils_database.DatabaseConnection._generate_create_table_sql(frame, "daily")
+    assert sql == "CREATE TABLE IF NOT EXISTS daily (volume BIGINT, lot INTEGER, amount BIGINT, flag BIGINT);"
+
+
+def test_pool_stats_follow_engine_lifecycle(tmp_path):
+    engine = utils_database.get_engine("SQLITE_TEST", f"sqlite:///{tmp_path / 'pool.db'}")
+    try:
+        with utils_database.DatabaseConnection(f"sqlite:///{tmp_path / 'pool.db'}", "SQLITE_TEST") as conn:
+            assert conn.engine is engine
+        stats = utils_database._stats_for(engine)
+        assert stats is not None and stats.checkouts == 1 and stats.waits == 1
+        assert [key for key in utils_database.pool_stats("SQLITE_TEST")] == [f"SQLITE_TEST:sqlite:///{tmp_path / 'pool.db'}"]
+    finally:
+        utils_database.dispose_engines()
+    assert utils_database._stats_for(engine) is None
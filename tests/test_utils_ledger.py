@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/21 10:30
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_ledger.py
+@Description: 任务台账的回归测试
+"""
+import os
+
+from reverie.utils.utils_ledger import JobLedger
+
+
+def make_jobs(tmp_path, names):
+    jobs = []
+    for name in names:
+        source_path = tmp_path / "input" / name
+        source_path.parent.mkdir(exist_ok=True)
+        source_path.write_bytes(name.encode())
+        jobs.append((source_path, tmp_path / "output" / name, tmp_path / "finish" / name))
+    return jobs
+
+
+def test_done_jobs_are_skipped_on_restart(tmp_path):
+    jobs = make_jobs(tmp_path, ["a.jpg", "b.jpg"])
+    ledger = JobLedger(tmp_path / "ledger.sqlite")
+    assert ledger.register(jobs, "action") == jobs
+    ledger.mark_started(jobs, "action")
+    ledger.record(jobs[0][0], "action", ("done", 120, ""))
+    ledger.close()
+
+    # 重启：b 停留在 running（进程崩溃），应重新执行
+    ledger = JobLedger(tmp_path / "ledger.sqlite")
+    assert ledger.register(jobs, "action") == [jobs[1]]
+    assert ledger.status_counts() == {"done": 1, "running": 1}
+    ledger.close()
+
+
+def test_changed_content_or_action_requeues(tmp_path):
+    jobs = make_jobs(tmp_path, ["a.jpg"])
+    ledger = JobLedger(tmp_path / "ledger.sqlite")
+    ledger.register(jobs, "action")
+    ledger.record_results({jobs[0][0]: ("done", 10, "")}, "action")
+    assert ledger.register(jobs, "action") == []
+    assert ledger.register(jobs, "other_action") == jobs
+
+    jobs[0][0].write_bytes(b"new content")
+    assert ledger.register(jobs, "action") == jobs
+
+
+def test_touch_without_content_change_keeps_status(tmp_path):
+    jobs = make_jobs(tmp_path, ["a.jpg"])
+    ledger = JobLedger(tmp_path / "ledger.sqlite")
+    ledger.register(jobs, "action")
+    ledger.record(jobs[0][0], "action", ("done", 10, ""))
+    stat = os.stat(jobs[0][0])
+    os.utime(jobs[0][0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert ledger.register(jobs, "action") == []
+
+
+def test_failed_jobs_retry_until_max_attempts(tmp_path):
+    jobs = make_jobs(tmp_path, ["a.jpg"])
+    ledger = JobLedger(tmp_path / "ledger.sqlite")
+    for _ in range(2):
+        runnable = ledger.register(jobs, "action", max_attempts=2)
+        assert runnable == jobs
+        ledger.mark_started(runnable, "action")
+        ledger.record(jobs[0][0], "action", ("failed", 5, "Photoshop error"))
+    assert ledger.register(jobs, "action", max_attempts=2) == []
+    summary = ledger.summary()
+    assert summary["status"] == {"failed": 1}
+    assert summary["failure_rate"] == 1.0
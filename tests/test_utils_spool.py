@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 17:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_spool.py
+@Description: spool 通道心跳与 stop 文件的回归测试
+"""
+import os
+import time
+import threading
+
+from reverie.utils import utils_spool
+
+
+def age_heartbeat(channel, seconds):
+    path = channel.spool_dir / "heartbeat"
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_busy_heartbeat_survives_long_job(tmp_path):
+    channel = utils_spool.SpoolChannel(tmp_path)
+    utils_spool.write_atomic(tmp_path / "heartbeat", "busy\t0")
+    age_heartbeat(channel, 120)
+    assert channel.is_worker_alive()
+    utils_spool.write_atomic(tmp_path / "heartbeat", "idle\t0")
+    age_heartbeat(channel, 120)
+    assert not channel.is_worker_alive()
+
+
+def test_worker_beats_around_each_job(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    states = []
+
+    def slow_handler(input_path, output_path):
+        states.append((tmp_path / "heartbeat").read_text(encoding="utf-8").split("\t")[0])
+        started.set()
+        release.wait(5)
+
+    worker = utils_spool.LocalSpoolWorker(tmp_path, handler=slow_handler, heartbeat_interval=60).start()
+    job_id = worker.channel.submit(tmp_path / "in.jpg", tmp_path / "out.jpg")
+    assert started.wait(5)
+    assert states == ["busy"]
+    release.set()
+    result = worker.channel.wait(job_id, timeout=5, poll_interval=0.01)
+    assert result is not None and result[0] == "done"
+    worker.channel.stop_worker()
+    worker.join(5)
+    assert (tmp_path / "heartbeat").read_text(encoding="utf-8").startswith("idle\t")
+    assert not (tmp_path / "stop").exists()
+
+
+def test_clear_stop_lets_new_worker_run(tmp_path):
+    channel = utils_spool.SpoolChannel(tmp_path)
+    channel.stop_worker()
+    channel.clear_stop()
+    worker = utils_spool.LocalSpoolWorker(tmp_path, handler=lambda i, o: None).start()
+    job_id = channel.submit(tmp_path / "in.jpg", tmp_path / "out.jpg")
+    result = channel.wait(job_id, timeout=5, poll_interval=0.01)
+    assert result is not None and result[0] == "done"
+    channel.stop_worker()
+    worker.join(5)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/21 10:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_tile.py
+@Description: 分块切分与羽化拼接的回归测试
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from reverie.utils import utils_tile
+
+
+def make_image(path, width, height):
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x % 256, y % 256, (x + y) % 256], axis=-1).astype(np.uint8)
+    Image.fromarray(pixels).save(path)
+    return pixels
+
+
+def test_plan_tiles_cores_cover_image_once():
+    width, height = 1000, 700
+    coverage = np.zeros((height, width), dtype=np.int32)
+    for tile in utils_tile.plan_tiles(width, height, tile_size=300, overlap=32):
+        x0, y0, x1, y1 = tile.core
+        coverage[y0:y1, x0:x1] += 1
+        bx0, by0, bx1, by1 = tile.box
+        assert bx0 <= x0 and by0 <= y0 and bx1 >= x1 and by1 >= y1
+    assert (coverage == 1).all()
+
+
+def test_plan_tiles_rejects_overlap_larger_than_core():
+    with pytest.raises(ValueError):
+        utils_tile.plan_tiles(1000, 1000, tile_size=100, overlap=80)
+
+
+def test_feather_weights_sum_to_one():
+    width, height, overlap = 900, 500, 40
+    total = np.zeros((height, width), dtype=np.float32)
+    for tile in utils_tile.plan_tiles(width, height, tile_size=256, overlap=overlap):
+        x0, y0, x1, y1 = tile.box
+        total[y0:y1, x0:x1] += utils_tile.feather_weights(tile, width, height, overlap)
+    np.testing.assert_allclose(total, 1.0, atol=1e-5)
+
+
+def test_split_and_stitch_round_trip(tmp_path):
+    pixels = make_image(tmp_path / "big.png", 600, 450)
+    width, height, tiles = utils_tile.split_image(tmp_path / "big.png", tmp_path / "tiles", tile_size=200, overlap=24)
+    assert len(tiles) == 9
+    size = utils_tile.stitch_tiles(tiles, width, height, tmp_path / "out.png", overlap=24, work_dir=tmp_path,
+                                   strip_rows=64)
+    assert size == (600, 450)
+    stitched = np.asarray(Image.open(tmp_path / "out.png"), dtype=np.int16)
+    assert np.abs(stitched - pixels).max() <= 1
+    assert not list(tmp_path.glob("stitch_*"))
+
+
+def test_stitch_scaled_tiles(tmp_path):
+    make_image(tmp_path / "big.png", 400, 300)
+    width, height, tiles = utils_tile.split_image(tmp_path / "big.png", tmp_path / "tiles", tile_size=200, overlap=16)
+    # 模拟缩放 50% 的动作
+    for _, tile_path in tiles:
+        with Image.open(tile_path) as img:
+            img.resize((img.width // 2, img.height // 2)).save(tile_path)
+    size = utils_tile.stitch_tiles(tiles, width, height, tmp_path / "out.jpg", overlap=16, work_dir=tmp_path)
+    assert size == (200, 150)
+    assert Image.open(tmp_path / "out.jpg").size == (200, 150)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 18:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_utils_watch.py
+@Description: HotFolder 轮询模式的回归测试
+"""
+import os
+import time
+import threading
+
+from reverie.utils import utils_data, utils_watch
+
+
+class Collector:
+    def __init__(self):
+        self.files = []
+        self.changed = threading.Condition()
+
+    def __call__(self, rel_path):
+        with self.changed:
+            self.files.append(rel_path)
+            self.changed.notify_all()
+
+    def wait_for(self, count, timeout=5):
+        with self.changed:
+            return self.changed.wait_for(lambda: len(self.files) >= count, timeout)
+
+
+def make_folder(root, collector, **kwargs):
+    options = dict(suffixes=[".jpg"], settle_seconds=0.1, poll_interval=0.02, use_inotify=False)
+    options.update(kwargs)
+    return utils_watch.HotFolder(root, collector, **options)
+
+
+def test_polling_picks_up_new_files_and_directories(tmp_path):
+    (tmp_path / "a.jpg").write_bytes(b"a")
+    collector = Collector()
+    folder = make_folder(tmp_path, collector).start()
+    try:
+        assert folder.backend == "poll"
+        assert collector.wait_for(1)
+        (tmp_path / "sub" / "deep").mkdir(parents=True)
+        (tmp_path / "sub" / "deep" / "b.jpg").write_bytes(b"b")
+        (tmp_path / "c.txt").write_bytes(b"c")
+        assert collector.wait_for(2)
+        time.sleep(0.2)
+    finally:
+        folder.stop()
+    assert sorted(collector.files) == ["a.jpg", os.path.join("sub", "deep", "b.jpg")]
+
+
+def test_polling_does_not_rescan_the_whole_tree(tmp_path, monkeypatch):
+    calls = []
+    scan_files = utils_data.scan_files
+    monkeypatch.setattr(utils_data, "scan_files", lambda *args: calls.append(args) or scan_files(*args))
+    collector = Collector()
+    folder = make_folder(tmp_path, collector, rescan_interval=3600).start()
+    try:
+        (tmp_path / "a.jpg").write_bytes(b"a")
+        assert collector.wait_for(1)
+        time.sleep(0.2)
+    finally:
+        folder.stop()
+    assert calls == []
+
+
+def test_removed_file_can_arrive_again(tmp_path):
+    collector = Collector()
+    folder = make_folder(tmp_path, collector).start()
+    try:
+        path = tmp_path / "a.jpg"
+        path.write_bytes(b"a")
+        assert collector.wait_for(1)
+        path.unlink()
+        time.sleep(0.1)
+        path.write_bytes(b"again")
+        assert collector.wait_for(2)
+    finally:
+        folder.stop()
+    assert collector.files == ["a.jpg", "a.jpg"]
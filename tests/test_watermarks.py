@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+@Date: 2026/2/20 16:00
+@Author: Damian
+@Email: zengyuwei1995@163.com
+@File: test_watermarks.py
+@Description: WatermarkRegistry / database_maximum_date 的回归测试，用只记录 SQL 的 DB-API 连接代替数据库
+"""
+import pytest
+
+from reverie.utils import utils_database
+
+
+class RecordingCursor:
+    def __init__(self, log, rows):
+        self.log = log
+        self.rows = rows
+        self._result = []
+
+    def execute(self, sql, params=None):
+        self.log.append(sql)
+        self._result = self.rows.get(sql.split()[0].upper(), [])
+
+    def fetchall(self):
+        return list(self._result)
+
+
+class RecordingConnection:
+    def __init__(self, log, rows):
+        self.log = log
+        self.rows = rows
+
+    def cursor(self):
+        return RecordingCursor(self.log, self.rows)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingEngine:
+    """raw_connection 返回的游标记录执行过的 SQL；SELECT 按 rows["SELECT"] 返回"""
+    def __init__(self, rows=None):
+        self.log = []
+        self.rows = rows or {}
+
+    def raw_connection(self):
+        return RecordingConnection(self.log, self.rows)
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = utils_database.WatermarkRegistry(RecordingEngine())
+    monkeypatch.setattr(utils_database, "get_watermarks", lambda *args, **kwargs: registry)
+    return registry
+
+
+def scans(registry):
+    return sum("max(" in sql for sql in registry.engine.log)
+
+
+def test_key_without_key_column_fails_before_io(registry):
+    with pytest.raises(ValueError):
+        utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date", key="300588.sz")
+    with pytest.raises(ValueError):
+        utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date", key_column="full_code")
+    assert registry.engine.log == []
+
+
+def test_empty_table_bootstraps_once(registry):
+    for _ in range(3):
+        assert utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date",
+                                                    default_start="2020-01-01") == "2020-01-01"
+    assert scans(registry) == 1
+
+
+def test_missing_key_bootstraps_once(registry):
+    for _ in range(3):
+        with pytest.raises(utils_database.WatermarkNotFound):
+            utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date", key="300588.sz",
+                                                 key_column="full_code")
+    assert scans(registry) == 1
+
+
+def test_invalidate_allows_bootstrap_again(registry):
+    utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date", default_start="2020-01-01")
+    registry.invalidate("dwd_ohlc_stock_incr")
+    utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date", default_start="2020-01-01")
+    assert scans(registry) == 2
+
+
+def test_existing_watermark_is_read_from_cache(registry):
+    registry.engine.rows["SELECT"] = [("", "2024-01-05")]
+    assert utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date") == "2024-01-06"
+    assert utils_database.database_maximum_date("dwd_ohlc_stock_incr", "date") == "2024-01-06"
+    assert scans(registry) == 0
+    assert sum(sql.startswith("SELECT") for sql in registry.engine.log) == 1
+
+
+def test_apply_updates_loaded_marks(registry):
+    registry.engine.rows["SELECT"] = [("", "2024-01-05")]
+    registry.marks("dwd_ohlc_stock_incr", "date")
+    registry.apply({("dwd_ohlc_stock_incr", "date"): {"": "2024-01-08"}})
+    assert registry.get("dwd_ohlc_stock_incr", "date") == "2024-01-08"
+
+
+def test_fork_reset_clears_watermark_registries(monkeypatch):
+    monkeypatch.setitem(utils_database._watermark_registries, "postgresql://parent",
+                        utils_database.WatermarkRegistry(RecordingEngine()))
+    monkeypatch.setattr(utils_database, "_engines_pid", -1)
+    utils_database._reset_after_fork()
+    assert utils_database._watermark_registries == {}
+
+
+def test_rolled_back_table_creation_is_retried(registry):
+    def creates():
+        return sum("CREATE TABLE" in sql for sql in registry.engine.log)
+
+    # advance 在调用方事务中建表：提交前（或回滚后）不能认为表已存在
+    cursor = registry.engine.raw_connection().cursor()
+    registry._ensure_table(cursor)
+    registry._ensure_table(cursor)
+    assert creates() == 2
+    registry.marks("dwd_ohlc_stock_incr", "date")
+    assert creates() == 3
+    registry._ensure_table(cursor)
+    assert creates() == 3